@@ -0,0 +1,331 @@
+#!/usr/bin/env python2.6
+"""Benchmarks for jersey.inet.
+
+Times address parsing, comparison, hashing and membership on a reproducible
+mix of IPv4, IPv6 and invalid inputs, and measures the memory used by each
+kind of address object.  Results are written as JSON and may be compared
+against a saved baseline, in which case the run fails if any benchmark has
+regressed by more than the threshold.
+
+Run via `make bench-inet`, or directly with jersey on the PYTHONPATH:
+
+    python bench/bench_inet.py --output=results.json --baseline=baseline.json
+"""
+
+import gc, json, platform, random, socket, sys, time, timeit
+
+from twisted.python import usage
+
+from jersey import inet
+
+
+SEED = 0x6a657273
+
+
+def generateInputs(count, seed=SEED):
+    """Generate a reproducible list of address strings.
+
+    Roughly 60% are IPv4, 30% IPv6 (compressed, full and IPv4-mapped) and
+    10% are invalid.
+    """
+    rand = random.Random(seed)
+    inputs = []
+    for i in xrange(count):
+        kind = rand.random()
+        if kind < 0.6:
+            inputs.append(".".join(str(rand.randint(0, 255)) for o in range(4)))
+
+        elif kind < 0.9:
+            packed = "".join(chr(rand.randint(0, 255)) for o in range(16))
+            style = rand.random()
+            if style < 0.4:
+                # Sparse addresses, as typically assigned, compress well.
+                packed = packed[:8] + "\0" * 6 + packed[14:]
+            elif style < 0.5:
+                packed = "\0" * 10 + "\xff" * 2 + packed[12:]
+            if style < 0.9:
+                address = socket.inet_ntop(socket.AF_INET6, packed)
+            else:
+                # Uncompressed, zero-padded form.
+                address = ":".join(packed[w:w + 2].encode("hex")
+                                   for w in range(0, 16, 2))
+            inputs.append(address)
+
+        else:
+            inputs.append(rand.choice([
+                    "", "localhost", "256.1.2.3", "1.2.3", "1.2.3.4.5",
+                    "::1::2", "12345::", "not an address",
+                    "{0}.{0}".format(rand.randint(0, 99)),
+                    ]))
+    return inputs
+
+
+def parseInputs(inputs):
+    """Return the valid Addresses among the inputs."""
+    addresses = []
+    for text in inputs:
+        try:
+            addresses.append(inet.IP(text))
+        except ValueError:
+            pass
+    return addresses
+
+
+
+def _parseAll(inputs):
+    for text in inputs:
+        try:
+            inet.IP(text)
+        except ValueError:
+            pass
+
+
+def benchmarks(inputs):
+    """Return (name, function, opsPerCall) for each benchmark."""
+    addresses = parseInputs(inputs)
+    v4 = [ip for ip in addresses if ip.family == inet.AF_INET]
+    v6 = [ip for ip in addresses if ip.family == inet.AF_INET6]
+    packed = [ip.toBytes() for ip in addresses]
+    v4Packed = [ip.toBytes() for ip in v4]
+    v6Packed = [ip.toBytes() for ip in v6]
+
+    shuffled = list(addresses)
+    random.Random(SEED).shuffle(shuffled)
+    pairs = zip(addresses, shuffled)
+    textPairs = zip(addresses, [str(ip) for ip in shuffled])
+
+    members = set(addresses[::2])
+    probes = addresses + [inet.IP("192.0.2.1"), inet.IP("2001:db8::1")]
+
+    def parse():
+        _parseAll(inputs)
+
+    def nToIP():
+        for bytes in packed:
+            inet.nToIP(bytes)
+
+    def fromBytesV4():
+        for bytes in v4Packed:
+            inet.V4Address.fromBytes(bytes)
+
+    def fromBytesV6():
+        for bytes in v6Packed:
+            inet.V6Address.fromBytes(bytes)
+
+    def compare():
+        for a, b in pairs:
+            cmp(a, b)
+
+    def equal():
+        for a, b in pairs:
+            a == b
+
+    def equalStr():
+        for a, b in textPairs:
+            a == b
+
+    def hashing():
+        for ip in addresses:
+            hash(ip)
+
+    def toV6():
+        for ip in v4:
+            ip.toV6()
+
+    def sort():
+        sorted(shuffled)
+
+    def membership():
+        for ip in probes:
+            ip in members
+
+    return [
+        ("IP", parse, len(inputs)),
+        ("nToIP", nToIP, len(packed)),
+        ("V4Address.fromBytes", fromBytesV4, len(v4Packed)),
+        ("V6Address.fromBytes", fromBytesV6, len(v6Packed)),
+        ("__cmp__", compare, len(pairs)),
+        ("__eq__", equal, len(pairs)),
+        ("__eq__(str)", equalStr, len(textPairs)),
+        ("__hash__", hashing, len(addresses)),
+        ("toV6", toV6, len(v4)),
+        ("sorted", sort, len(shuffled)),
+        ("set membership", membership, len(probes)),
+        ]
+
+
+
+def deepSize(obj, seen=None):
+    """Return the memory used by an object and the objects it references.
+
+    Only instance attributes (__dict__ and __slots__) and containers are
+    followed; classes and other shared objects are not counted.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deepSize(key, seen) + deepSize(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deepSize(item, seen)
+
+    if hasattr(obj, "__dict__"):
+        size += deepSize(obj.__dict__, seen)
+    for klass in type(obj).__mro__:
+        for slot in getattr(klass, "__slots__", ()):
+            if hasattr(obj, slot):
+                size += deepSize(getattr(obj, slot), seen)
+    return size
+
+
+def memoryUsage(addresses):
+    """Return the average bytes used per object, by kind of object."""
+    samples = {
+        "V4Address": [ip for ip in addresses if ip.family == inet.AF_INET],
+        "V6Address": [ip for ip in addresses if ip.family == inet.AF_INET6],
+        }
+    samples["Endpoint"] = [inet.Endpoint(ip, 80) for ip in addresses]
+    samples["Prefix"] = [inet.Prefix(ip, ip.bits) for ip in addresses]
+
+    usage = {}
+    for kind, objects in sorted(samples.items()):
+        if objects:
+            total = sum(deepSize(obj) for obj in objects)
+            usage[kind] = float(total) / len(objects)
+    return usage
+
+
+def timeBenchmark(function, ops, repeat):
+    """Return the best time per operation, in nanoseconds."""
+    gc.collect()
+    timer = timeit.Timer(function)
+    best = min(timer.repeat(repeat=repeat, number=1))
+    return best * 1e9 / max(ops, 1)
+
+
+def run(count, repeat, log=None):
+    """Run all benchmarks, returning a JSON-serializable result."""
+    inputs = generateInputs(count)
+    timings = {}
+    for name, function, ops in benchmarks(inputs):
+        timings[name] = {
+            "nsPerOp": timeBenchmark(function, ops, repeat),
+            "ops": ops,
+            }
+        if log is not None:
+            log.write("{0:<24} {1:>12.1f} ns/op\n".format(
+                    name, timings[name]["nsPerOp"]))
+
+    memory = memoryUsage(parseInputs(inputs))
+    if log is not None:
+        for kind, size in sorted(memory.items()):
+            log.write("{0:<24} {1:>12.1f} bytes\n".format(kind, size))
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "count": count,
+        "time": timings,
+        "memory": memory,
+        }
+
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline.
+
+    Returns:
+        A list of (metric, baseline, current, ratio) for every metric that
+        increased by more than threshold (e.g. 0.1 for 10%).
+    """
+    regressions = []
+    pairs = [("time " + name, baseline["time"][name]["nsPerOp"],
+              result["nsPerOp"])
+             for name, result in results["time"].iteritems()
+             if name in baseline.get("time", {})]
+    pairs += [("memory " + kind, baseline["memory"][kind], size)
+              for kind, size in results["memory"].iteritems()
+              if kind in baseline.get("memory", {})]
+
+    for metric, old, new in sorted(pairs):
+        ratio = new / old if old else 1.0
+        if ratio > 1 + threshold:
+            regressions.append((metric, old, new, ratio))
+    return regressions
+
+
+
+class Options(usage.Options):
+
+    synopsis = "Usage: bench_inet.py [options]"
+
+    optParameters = [
+        ["count", "n", 20000, "Number of input addresses.", int],
+        ["repeat", "r", 5, "Timing repetitions (the best is kept).", int],
+        ["output", "o", None, "Write results to this JSON file."],
+        ["baseline", "b", None,
+            "Compare results with this JSON file (if it exists)."],
+        ["threshold", "t", 0.1,
+            "Fail if a metric regresses by more than this fraction.", float],
+        ]
+
+    optFlags = [
+        ["save-baseline", None, "Write results to the baseline file."],
+        ]
+
+    def postOptions(self):
+        if self["save-baseline"] and not self["baseline"]:
+            raise usage.UsageError("--save-baseline requires --baseline")
+
+
+
+def main(args=None):
+    options = Options()
+    try:
+        options.parseOptions(args)
+    except usage.UsageError, ue:
+        sys.stderr.write("{0}\n{1}\n".format(options, ue))
+        return 2
+
+    results = run(options["count"], options["repeat"], sys.stdout)
+
+    if options["output"]:
+        with open(options["output"], "w") as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+    baselinePath = options["baseline"]
+    if options["save-baseline"]:
+        with open(baselinePath, "w") as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+        sys.stdout.write("Saved baseline: {0}\n".format(baselinePath))
+        return 0
+
+    if baselinePath:
+        try:
+            with open(baselinePath) as baselineFile:
+                baseline = json.load(baselineFile)
+        except IOError:
+            sys.stdout.write("No baseline: {0}\n".format(baselinePath))
+            return 0
+
+        regressions = compare(results, baseline, options["threshold"])
+        for metric, old, new, ratio in regressions:
+            sys.stdout.write("REGRESSION {0}: {1:.1f} -> {2:.1f} ({3:+.0%})\n"
+                    .format(metric, old, new, ratio - 1))
+        if regressions:
+            return 1
+        sys.stdout.write("No regressions past {0:.0%}\n".format(
+                options["threshold"]))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""The Jersey Core libraries
+"""
+
+from jersey._version import copyright, license, version
@@ -0,0 +1,78 @@
+"""The process protocol of ProcessPoolService workers.
+
+This is kept apart from jersey.cli so that programs that don't use process
+pools don't import twisted.internet.protocol.
+"""
+
+from cPickle import loads
+
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ProcessProtocol
+
+from jersey.cli import (_FRAME, _POOL_CALL, _POOL_VALUE, _POOL_CALLS_FD,
+        _POOL_RESULTS_FD)
+
+
+
+class PoolWorker(ProcessProtocol):
+    """Runs tasks in a worker process, one at a time."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.task = None
+        self.tasks = 0
+        self.retired = False
+        self.ended = Deferred()
+        self._buffer = ""
+
+
+    def connectionMade(self):
+        self.transport.closeStdin()
+
+
+    def run(self, task):
+        """Run a (Deferred, pickled call) task."""
+        d, data = task
+        self.task = task
+        self.tasks += 1
+        self.transport.writeToChild(_POOL_CALLS_FD,
+                _FRAME.pack(_POOL_CALL, len(data)) + data)
+
+
+    def retire(self):
+        """Stop the worker once its current task is complete."""
+        self.retired = True
+        self.transport.closeChildFD(_POOL_CALLS_FD)
+
+
+    def childDataReceived(self, fd, data):
+        if fd != _POOL_RESULTS_FD:
+            return
+        self._buffer += data
+        while len(self._buffer) >= _FRAME.size:
+            kind, size = _FRAME.unpack(self._buffer[:_FRAME.size])
+            end = _FRAME.size + size
+            if len(self._buffer) < end:
+                break
+            data, self._buffer = self._buffer[_FRAME.size:end], self._buffer[end:]
+            self.resultReceived(kind, data)
+
+
+    def resultReceived(self, kind, data):
+        (d, call), self.task = self.task, None
+        self.pool._workerIdle(self)
+        try:
+            result = loads(data)
+        except Exception:
+            d.errback()
+        else:
+            if kind == _POOL_VALUE:
+                d.callback(result)
+            else:
+                d.errback(result)
+
+
+    def processEnded(self, reason):
+        task, self.task = self.task, None
+        self.pool._workerEnded(self, task, reason)
+        self.ended.callback(None)
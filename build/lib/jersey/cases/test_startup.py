@@ -0,0 +1,128 @@
+"""Test cases for jersey.startup"""
+
+import __builtin__, os, sys
+from StringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+
+from jersey import startup
+
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+
+class RequestedTestCase(TestCase):
+
+    def test_requested(self):
+        self.assertTrue(startup.requested(["prog", startup.FLAG], {}))
+        self.assertTrue(startup.requested(["prog"],
+                {startup.ENVIRONMENT_VARIABLE: "1"}))
+        self.assertTrue(startup.requested(["prog", "-v", startup.FLAG, "cmd"],
+                                          {}))
+        self.assertFalse(startup.requested(["prog", "--help"], {}))
+        self.assertFalse(startup.requested(["prog", "cmd", startup.FLAG], {}))
+        self.assertFalse(startup.requested(["prog", "--", startup.FLAG], {}))
+        self.assertFalse(startup.requested(["prog"],
+                {startup.ENVIRONMENT_VARIABLE: ""}))
+
+
+
+class StartupProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.profiler = startup.StartupProfiler(self.clock)
+        self.profiler.enable()
+
+
+    def test_phases(self):
+        with self.profiler.phase("parsing"):
+            self.clock.now += 0.5
+        self.profiler.begin("reactor")
+        self.clock.now += 0.25
+        self.profiler.end("reactor")
+        self.profiler.end("never begun")
+
+        self.assertEquals([("parsing", 100.0, 100.5), ("reactor", 100.5, 100.75)],
+                          self.profiler.phases)
+
+
+    def test_phaseError(self):
+        def fail():
+            with self.profiler.phase("failing"):
+                self.clock.now += 1
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEquals([("failing", 100.0, 101.0)], self.profiler.phases)
+
+
+    def test_disabled(self):
+        profiler = startup.StartupProfiler(self.clock)
+        with profiler.phase("parsing"):
+            self.clock.now += 0.5
+        profiler.record("imports", 100.0)
+        self.assertEquals([], profiler.phases)
+
+
+    def test_report(self):
+        self.profiler.record("imports", 100.0, 100.1)
+        self.profiler.record("parsing", 100.1, 100.4)
+        self.profiler.imports = {
+            "twisted.internet.reactor": (0.05, 0.07),
+            "jersey.cli": (0.01, 0.1),
+            "json": (0.02, 0.02),
+            }
+        self.clock.now = 100.5
+
+        out = StringIO()
+        self.profiler.report(out, limit=2)
+        lines = out.getvalue().splitlines()
+        self.assertEquals("Startup profile: 500.0 ms", lines[0])
+        self.assertEquals(["parsing", "imports"],
+                          [l.split()[0] for l in lines[3:5]])
+        self.assertEquals(["twisted.internet.reactor", "json"],
+                          [l.split()[0] for l in lines[7:9]])
+        self.assertEquals("(1 more imports)", lines[9])
+
+
+    def test_importHook(self):
+        path = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(path, "startup_fixture"))
+        with open(os.path.join(path, "startup_fixture", "__init__.py"), "w"):
+            pass
+        with open(os.path.join(path, "startup_fixture", "child.py"), "w"):
+            pass
+        with open(os.path.join(path, "startup_fixture", "parent.py"), "w") as f:
+            f.write("import child\n")
+
+        sys.path.insert(0, path)
+        self.addCleanup(sys.path.remove, path)
+        for name in ("startup_fixture", "startup_fixture.parent",
+                     "startup_fixture.child", "startup_fixture.sys"):
+            self.addCleanup(sys.modules.pop, name, None)
+
+        profiler = startup.StartupProfiler()
+        original = __builtin__.__import__
+        profiler.installImportHook()
+        try:
+            self.assertNotIdentical(original, __builtin__.__import__)
+            import startup_fixture.parent
+            import startup_fixture.parent
+        finally:
+            profiler.removeImportHook()
+
+        self.assertIdentical(original, __builtin__.__import__)
+        self.assertEquals(["startup_fixture.child", "startup_fixture.parent"],
+                          sorted(profiler.imports))
+        parentSelf, parentTotal = profiler.imports["startup_fixture.parent"]
+        childSelf, childTotal = profiler.imports["startup_fixture.child"]
+        self.assertTrue(parentTotal >= childTotal)
+        self.assertAlmostEqual(parentTotal, parentSelf + childTotal)
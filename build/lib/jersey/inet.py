@@ -0,0 +1,3149 @@
+"""Internet Addresses
+"""
+
+import binascii, bisect, csv, errno, math, mmap, os, random, re, socket, struct
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+
+try:
+    from cStringIO import StringIO as _StringIO
+except ImportError:
+    from StringIO import StringIO as _StringIO
+
+AF_INET = socket.AF_INET
+AF_INET6 = socket.AF_INET6
+
+# NumPy dtype specifications for packed address arrays.  IPv4 addresses are
+# stored as native unsigned integers; IPv6 addresses are stored as two
+# network-ordered 64-bit halves, so an array's buffer is exactly the
+# concatenation of the addresses' packed bytes.
+V4_DTYPE = "uint32"
+V6_DTYPE = [("hi", ">u8"), ("lo", ">u8")]
+
+
+def IP(address):
+    """Build an IPv4 or IPv6 address from a string representation.
+    """
+    for klass in (V4Address, V6Address):
+        try:
+            ip = klass(address)
+        except ValueError, e:
+            error = e
+        else:
+            return ip
+
+    raise error
+
+
+def nToIP(bytes):
+    """Build an IPv4 or IPv6 address from a network representation.
+    """
+    for klass in (V4Address, V6Address):
+        try:
+            return klass.fromBytes(bytes)
+        except ValueError, ve:
+            error = ve
+        else:
+            return ip
+
+    raise error
+
+
+
+class AbstractAddress(object):
+    """Abstract Internet address.
+
+    Attributes:
+        family --  Address family (i.e. AF_INET or AF_INET6).
+                   Must be set by subclasses.
+        bits --  Number of bits in an address of this family.
+                 Must be set by subclasses.
+    """
+
+    family = None
+    bits = None
+
+    def __init__(self, address):
+        """Build an instance based on an address string.
+
+        Arguments:
+            address --  Text-representation of an Address.
+        Preconditions:
+            self.family is set (i.e. by a subclass)
+        Raises:
+            ValueError if address is not a valid IP address.
+        """
+        assert self.family is not None
+
+        try:
+            self._bytes = socket.inet_pton(self.family, address)
+
+        except (socket.error, TypeError):
+            raise ValueError("Invalid {0.__class__.__name__}".format(self),
+                             address, self.family)
+
+
+    @classmethod
+    def fromBytes(klass, bytes):
+        """Build an instance based on a network-ordered byte-representation.
+
+        Arguments:
+            bytes --  Network-ordered bytes representing an Address.
+        Preconditions:
+            klass.family is set (i.e. by a subclass)
+        Raises:
+            ValueError if bytes
+        """
+        assert klass.family is not None
+
+        try:
+            address = socket.inet_ntop(klass.family, bytes)
+
+        except (socket.error, TypeError):
+            raise ValueError("Invalid {0.__name__}".format(klass), bytes)
+
+        return klass(address)
+
+
+    @classmethod
+    def _fromPacked(klass, bytes):
+        """Build an instance from bytes that are known to be valid.
+
+        Skips the string round-trip performed by fromBytes().
+        """
+        ip = klass.__new__(klass)
+        ip._bytes = bytes
+        return ip
+
+
+    @classmethod
+    def fromInt(klass, value):
+        """Build an instance from its integer value.
+
+        Raises:
+            ValueError if value is out of range for the address family.
+        """
+        assert klass.bits is not None
+
+        if not 0 <= value < (1 << klass.bits):
+            raise ValueError("Invalid {0.__name__}".format(klass), value)
+
+        hexValue = "{0:0{1}x}".format(value, klass.bits // 4)
+        return klass._fromPacked(binascii.unhexlify(hexValue))
+
+
+    def toBytes(self):
+        """Return a network-order byte-representation of the address."""
+        return self._bytes
+
+    def toInt(self):
+        """Return the integer value of the address."""
+        return int(binascii.hexlify(self._bytes), 16)
+
+
+    def __add__(self, offset):
+        """Return the address offset addresses after this one.
+
+        Raises:
+            ValueError if the result is out of range for the address family.
+        """
+        if not isinstance(offset, (int, long)):
+            return NotImplemented
+        return self.fromInt(self.toInt() + offset)
+
+    __radd__ = __add__
+
+
+    def __sub__(self, obj):
+        """Subtract an integer offset or another Address of the same family.
+
+        Returns:
+            An Address if obj is an integer, or the integer distance between
+            the addresses if obj is an Address.
+        Raises:
+            ValueError if the result is out of range or the families differ.
+        """
+        if isinstance(obj, (int, long)):
+            return self.fromInt(self.toInt() - obj)
+        if not isinstance(obj, AbstractAddress):
+            return NotImplemented
+        if obj.family != self.family:
+            raise ValueError("Address family mismatch", str(self), str(obj))
+        return self.toInt() - obj.toInt()
+
+
+    def successor(self):
+        """Return the next address, or raise ValueError if there is none."""
+        return self + 1
+
+    def predecessor(self):
+        """Return the previous address, or raise ValueError if there is none."""
+        return self - 1
+
+
+    def __str__(self):
+        return socket.inet_ntop(self.family, self._bytes)
+
+    def __repr__(self):
+        return "{0.__class__.__name__}('{0!s}')".format(self)
+
+
+    def __cmp__(self, obj):
+        """Compare this object with another.""" 
+        if obj is self:
+            return 0
+
+        if isinstance(obj, AbstractAddress):
+            other = obj
+        else:
+            # Stringifying obj puts it in a state where it can be parsed by
+            # IP().
+            other = IP(str(obj))
+
+        # Compare IPs by byte representation.
+        if self.family == other.family:
+            return cmp(self._bytes, other.toBytes())
+        else:
+            return cmp(self.family, other.family)
+
+
+    def __eq__(self, obj):
+        if obj is self:
+            return True
+
+        try:
+            comparison = self.__cmp__(obj)
+
+        except (ValueError, TypeError):
+            # The obj can't be stringified or it is not a valid IP address.
+            equality = False
+
+        else:
+            equality = bool(comparison == 0)
+
+        return equality
+
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+
+    def __hash__(self):
+        # Addresses hash as their strings do, so that they may be looked up
+        # by string in dicts and sets.
+        return hash(str(self))
+
+
+
+class V4Address(AbstractAddress):
+    """IPv4 Address"""
+
+    family = AF_INET
+    bits = 32
+
+    def toV6(self):
+        """Return the a V6Address mapped from this address."""
+        return V6Address.fromV4(self)
+
+
+class V6Address(AbstractAddress):
+    """IPv6 Address"""
+
+    family = AF_INET6
+    bits = 128
+
+    _v4MappedPrefix = "\0" * 10 + "\xff" * 2
+
+    @classmethod
+    def fromV4(klass, ip):
+        """Build an IPv4-mapped IPv6 address."""
+        if not isinstance(ip, V4Address):
+            ip = V4Address(str(ip))
+        return klass("::ffff:{0!s}".format(ip))
+
+    def isV4Mapped(self):
+        """Determine whether this is an IPv4-mapped address (::ffff:0:0/96)."""
+        return self._bytes[:12] == self._v4MappedPrefix
+
+    def toV4(self):
+        """Return the V4Address this address is mapped from.
+
+        Raises:
+            ValueError if this is not an IPv4-mapped address.
+        """
+        if not self.isV4Mapped():
+            raise ValueError("Not an IPv4-mapped address", str(self))
+        return V4Address._fromPacked(self._bytes[12:])
+
+
+
+def _toAddress(obj):
+    """Coerce obj to an Address as AbstractAddress.__cmp__() does."""
+    if isinstance(obj, AbstractAddress):
+        return obj
+    return IP(str(obj))
+
+
+_FAMILY_CLASSES = {
+    AF_INET: V4Address,
+    AF_INET6: V6Address,
+    }
+
+
+
+class AddressPool(object):
+    """A pool of canonical Address instances.
+
+    Interning addresses through a pool ensures that there is only one
+    instance per distinct address, so that duplicate addresses share memory
+    and compare by identity.  Instances are held weakly, and are dropped from
+    the pool once they are no longer otherwise referenced.
+
+    Addresses are never modified, so interned instances may be shared freely.
+
+    Attributes:
+        foldMapped --  If set, IPv4-mapped IPv6 addresses are interned as
+                       their V4Address.  Note that such addresses do not
+                       compare equal to their IPv6 form.
+    """
+
+    _classesBySize = {
+        4: V4Address,
+        16: V6Address,
+        }
+
+    def __init__(self, foldMapped=False):
+        self.foldMapped = foldMapped
+        self._addresses = WeakValueDictionary()
+
+
+    def __len__(self):
+        """Return the number of live interned addresses."""
+        return len(self._addresses)
+
+    def __contains__(self, address):
+        try:
+            ip = _toAddress(address)
+        except ValueError:
+            return False
+        return self._key(ip.toBytes()) in self._addresses
+
+
+    def _key(self, packed):
+        if self.foldMapped and packed[:12] == V6Address._v4MappedPrefix:
+            return packed[12:]
+        return packed
+
+
+    def _intern(self, packed, ip=None):
+        key = self._key(packed)
+        canonical = self._addresses.get(key)
+        if canonical is None:
+            if ip is None or len(key) != len(packed):
+                ip = self._classesBySize[len(key)]._fromPacked(key)
+            canonical = self._addresses.setdefault(key, ip)
+        return canonical
+
+
+    def intern(self, address):
+        """Return the canonical instance of an Address (or address string).
+
+        Raises:
+            ValueError if address is not a valid address.
+        """
+        ip = _toAddress(address)
+        return self._intern(ip.toBytes(), ip)
+
+
+    def fromBytes(self, packed):
+        """Return the canonical instance of a packed 4- or 16-byte address.
+
+        Raises:
+            ValueError if packed is not a packed address.
+        """
+        if not isinstance(packed, str) or len(packed) not in self._classesBySize:
+            raise ValueError("Invalid packed address", packed)
+        return self._intern(packed)
+
+
+
+class Endpoint(object):
+    """An Internet address and port (i.e. one end of a TCP connection).
+
+    Endpoints are immutable and hashable.  Their sockaddr and string forms are
+    computed once, so they may be passed to socket calls repeatedly without
+    re-parsing.
+
+    Attributes:
+        address --  The V4Address or V6Address of the endpoint.
+        port --  The port number.
+    """
+
+    __slots__ = ("address", "port", "_sockaddr", "_str", "_hash")
+
+    def __init__(self, address, port):
+        """Build an endpoint.
+
+        Arguments:
+            address --  An Address or address string.
+            port --  A port number, from 0 to 65535.
+        Raises:
+            ValueError if address or port is invalid.
+        """
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid port", port)
+        if not 0 <= port <= 0xffff:
+            raise ValueError("Invalid port", port)
+
+        self.address = _toAddress(address)
+        self.port = port
+        self._sockaddr = self._str = self._hash = None
+
+
+    @classmethod
+    def parse(klass, endpoint):
+        """Build an endpoint from 'host:port' or '[v6host]:port'.
+
+        Raises:
+            ValueError if endpoint is malformed.
+        """
+        host, sep, port = str(endpoint).rpartition(":")
+        if not sep or not port.isdigit():
+            raise ValueError("Invalid Endpoint", endpoint)
+
+        if host.startswith("[") and host.endswith("]"):
+            address = V6Address(host[1:-1])
+        elif ":" in host:
+            # An unbracketed IPv6 address is ambiguous with its port.
+            raise ValueError("IPv6 endpoints must be bracketed", endpoint)
+        else:
+            address = V4Address(host)
+
+        return klass(address, port)
+
+
+    @classmethod
+    def fromTwisted(klass, address):
+        """Build an endpoint from a Twisted IPv4Address or IPv6Address."""
+        return klass(address.host, address.port)
+
+
+    @property
+    def family(self):
+        return self.address.family
+
+
+    def sockaddr(self):
+        """Return the address tuple used by socket methods (e.g. connect())."""
+        if self._sockaddr is None:
+            if self.family == AF_INET:
+                self._sockaddr = (str(self.address), self.port)
+            else:
+                self._sockaddr = (str(self.address), self.port, 0, 0)
+        return self._sockaddr
+
+
+    def toTwisted(self, type="TCP"):
+        """Return the Twisted IPv4Address or IPv6Address of this endpoint.
+
+        Arguments:
+            type --  The transport type, "TCP" or "UDP".
+        """
+        from twisted.internet.address import IPv4Address, IPv6Address
+
+        if self.family == AF_INET:
+            return IPv4Address(type, str(self.address), self.port)
+        return IPv6Address(type, str(self.address), self.port)
+
+
+    def __str__(self):
+        if self._str is None:
+            if self.family == AF_INET:
+                template = "{0!s}:{1}"
+            else:
+                template = "[{0!s}]:{1}"
+            self._str = template.format(self.address, self.port)
+        return self._str
+
+    def __repr__(self):
+        return "{0.__class__.__name__}('{0.address!s}', {0.port})".format(self)
+
+
+    def __eq__(self, obj):
+        if not isinstance(obj, Endpoint):
+            return False
+        return (self.port == obj.port
+                and self.family == obj.family
+                and self.address.toBytes() == obj.address.toBytes())
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.address.toBytes(), self.port))
+        return self._hash
+
+
+
+class Prefix(object):
+    """An address prefix (i.e. a CIDR network such as 10.0.0.0/8).
+
+    Attributes:
+        network --  The network Address.  Its host bits are all clear.
+        length --  The prefix length, in bits.
+    """
+
+    def __init__(self, prefix, length=None):
+        """Build a prefix.
+
+        Arguments:
+            prefix --  A "network/length" string, or a network Address (or
+                       address string) if length is given.
+            length --  The prefix length.
+        Raises:
+            ValueError if the prefix is invalid or has host bits set.
+        """
+        if length is None:
+            try:
+                prefix, length = str(prefix).split("/")
+            except ValueError:
+                raise ValueError("Invalid Prefix", prefix)
+
+        network = _toAddress(prefix)
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid Prefix length", length)
+
+        if not 0 <= length <= network.bits:
+            raise ValueError("Invalid Prefix length", length)
+        if network.toInt() & self._hostMask(network.bits, length):
+            raise ValueError("Prefix has host bits set", str(network), length)
+
+        self.network = network
+        self.length = length
+
+
+    @staticmethod
+    def _hostMask(bits, length):
+        return (1 << (bits - length)) - 1
+
+
+    @property
+    def family(self):
+        return self.network.family
+
+
+    def first(self):
+        """Return the first Address in the prefix."""
+        return self.network
+
+    def last(self):
+        """Return the last Address in the prefix."""
+        klass = self.network.__class__
+        hostMask = self._hostMask(klass.bits, self.length)
+        return klass.fromInt(self.network.toInt() | hostMask)
+
+    def addresses(self):
+        """Return an AddressRange of the addresses in the prefix."""
+        return AddressRange(self.first(), self.last())
+
+
+    def __contains__(self, address):
+        try:
+            ip = _toAddress(address)
+        except ValueError:
+            return False
+
+        if ip.family != self.family:
+            return False
+        hostMask = self._hostMask(ip.bits, self.length)
+        return (ip.toInt() & ~hostMask) == self.network.toInt()
+
+
+    def __str__(self):
+        return "{0.network!s}/{0.length}".format(self)
+
+    def __repr__(self):
+        return "{0.__class__.__name__}('{0!s}')".format(self)
+
+
+    def __eq__(self, obj):
+        if not isinstance(obj, Prefix):
+            try:
+                obj = Prefix(obj)
+            except ValueError:
+                return False
+        return self.length == obj.length and self.network == obj.network
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+
+class AddressRange(object):
+    """An inclusive, contiguous range of addresses, computed lazily.
+
+    Ranges behave as read-only sequences of Addresses: they support len(),
+    indexing, slicing and membership tests in constant time.  Addresses are
+    only built as they are accessed.
+
+    Since IPv6 ranges may be larger than len() can report, size() should be
+    used for ranges that may be large.
+    """
+
+    def __init__(self, start, end):
+        """Build a range of addresses.
+
+        Arguments:
+            start --  The first Address (or address string) in the range.
+            end --  The last Address in the range, of the same family.
+        Raises:
+            ValueError if the addresses are invalid, of different families, or
+            end precedes start.
+        """
+        start, end = _toAddress(start), _toAddress(end)
+        if start.family != end.family:
+            raise ValueError("Address family mismatch", str(start), str(end))
+        if start.toInt() > end.toInt():
+            raise ValueError("Invalid range", str(start), str(end))
+
+        self._klass = start.__class__
+        self._first = start.toInt()
+        self._count = end.toInt() - self._first + 1
+
+
+    @classmethod
+    def _fromInts(klass, addressClass, first, count):
+        """Build a range of count addresses, which may be empty."""
+        addresses = klass.__new__(klass)
+        addresses._klass = addressClass
+        addresses._first = first
+        addresses._count = count
+        return addresses
+
+
+    @property
+    def family(self):
+        return self._klass.family
+
+    @property
+    def start(self):
+        """The first Address in the range."""
+        return self[0]
+
+    @property
+    def end(self):
+        """The last Address in the range."""
+        return self[-1]
+
+
+    def size(self):
+        """Return the number of addresses in the range."""
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __nonzero__(self):
+        return self._count > 0
+
+
+    def _index(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("AddressRange index out of range", index)
+        return index
+
+
+    def _bound(self, index, default):
+        if index is None:
+            return default
+        if index < 0:
+            index += self._count
+        return min(max(index, 0), self._count)
+
+
+    def __getitem__(self, index):
+        """Return the Address at an index, or an AddressRange for a slice.
+
+        Raises:
+            ValueError if a slice has a step other than 1.
+        """
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("AddressRanges must be contiguous", index.step)
+            start = self._bound(index.start, 0)
+            stop = self._bound(index.stop, self._count)
+            return self._fromInts(self._klass, self._first + start,
+                                  max(stop - start, 0))
+
+        return self._klass.fromInt(self._first + self._index(index))
+
+
+    def __iter__(self):
+        klass, value = self._klass, self._first
+        last = value + self._count
+        while value < last:
+            yield klass.fromInt(value)
+            value += 1
+
+
+    def __contains__(self, address):
+        try:
+            ip = _toAddress(address)
+        except ValueError:
+            return False
+        if ip.family != self.family:
+            return False
+        return 0 <= ip.toInt() - self._first < self._count
+
+
+    def index(self, address):
+        """Return the index of an Address in the range.
+
+        Raises:
+            ValueError if the address is not in the range.
+        """
+        if address not in self:
+            raise ValueError("Address not in range", str(address))
+        return _toAddress(address).toInt() - self._first
+
+
+    def chunks(self, size):
+        """Split the range into consecutive AddressRanges of at most size.
+
+        Useful for distributing a range among workers.
+
+        Raises:
+            ValueError if size is not positive.
+        """
+        if size < 1:
+            raise ValueError("Invalid chunk size", size)
+        return (self[offset:offset + size]
+                for offset in _xrange(0, self._count, size))
+
+
+    def __eq__(self, obj):
+        if not isinstance(obj, AddressRange):
+            return False
+        if self._count == 0 or obj._count == 0:
+            return self._count == obj._count
+        return (self.family == obj.family
+                and self._first == obj._first and self._count == obj._count)
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __hash__(self):
+        if self._count == 0:
+            return hash(0)
+        return hash((self.family, self._first, self._count))
+
+
+    def __repr__(self):
+        if self._count == 0:
+            return "{0.__class__.__name__}()".format(self)
+        return "{0.__class__.__name__}('{0.start!s}', '{0.end!s}')".format(
+                self)
+
+
+
+def _xrange(start, stop, step):
+    """Like xrange(), but supporting long integers."""
+    value = start
+    while value < stop:
+        yield value
+        value += step
+
+
+
+class IPRangeSet(object):
+    """A set of addresses stored as ranges.
+
+    Each address family's ranges are kept as sorted lists of inclusive,
+    non-overlapping, non-adjacent integer intervals, so membership is a
+    binary search and set operations are linear merges.
+
+    Ranges may be given as Addresses, Prefixes, AddressRanges,
+    "network/length" or address strings, or (first, last) address pairs.
+
+    IPv4-mapped IPv6 addresses are distinct from IPv4 addresses, as they are
+    when Addresses are compared.  If foldMapped is set, they are folded into
+    the IPv4 family instead.
+    """
+
+    def __init__(self, ranges=(), foldMapped=False):
+        self.foldMapped = foldMapped
+        intervals = dict((f, []) for f in _FAMILY_CLASSES)
+        for item in ranges:
+            for family, first, last in self._intervals(item):
+                intervals[family].append((first, last))
+
+        self._starts, self._ends = {}, {}
+        for family, fIntervals in intervals.iteritems():
+            fIntervals.sort()
+            self._setIntervals(family, self._coalesce(fIntervals))
+
+
+    def _setIntervals(self, family, intervals):
+        self._starts[family] = [first for first, last in intervals]
+        self._ends[family] = [last for first, last in intervals]
+
+
+    def _getIntervals(self, family):
+        return zip(self._starts[family], self._ends[family])
+
+
+    @staticmethod
+    def _coalesce(intervals):
+        """Merge sorted intervals that overlap or are adjacent."""
+        merged = []
+        for first, last in intervals:
+            if merged and first <= merged[-1][1] + 1:
+                if last > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], last)
+            else:
+                merged.append((first, last))
+        return merged
+
+
+    _mappedFirst = 0xffff << 32
+    _mappedLast = _mappedFirst | 0xffffffff
+
+    def _intervals(self, item):
+        """Generate (family, first, last) intervals from a range item.
+
+        Raises:
+            ValueError if item is not a valid range.
+        """
+        if isinstance(item, AddressRange):
+            if not item:
+                return
+            family, lo = item.family, item._first
+            hi = lo + item.size() - 1
+
+        elif isinstance(item, tuple):
+            try:
+                first, last = map(_toAddress, item)
+            except TypeError:
+                raise ValueError("Invalid range", item)
+            if first.family != last.family or first.toInt() > last.toInt():
+                raise ValueError("Invalid range", item)
+            family, lo, hi = first.family, first.toInt(), last.toInt()
+
+        elif isinstance(item, Prefix) or "/" in str(item):
+            if not isinstance(item, Prefix):
+                item = Prefix(item)
+            lo = item.network.toInt()
+            family, hi = item.family, lo | item._hostMask(item.network.bits,
+                                                           item.length)
+        else:
+            ip = _toAddress(item)
+            family, lo = ip.family, ip.toInt()
+            hi = lo
+
+        if self.foldMapped and family == AF_INET6:
+            mappedLo = max(lo, self._mappedFirst)
+            mappedHi = min(hi, self._mappedLast)
+            if mappedLo <= mappedHi:
+                yield AF_INET, mappedLo & 0xffffffff, mappedHi & 0xffffffff
+                if lo < mappedLo:
+                    yield AF_INET6, lo, mappedLo - 1
+                if mappedHi < hi:
+                    yield AF_INET6, mappedHi + 1, hi
+                return
+
+        yield family, lo, hi
+
+
+    def __contains__(self, item):
+        try:
+            intervals = list(self._intervals(item))
+        except ValueError:
+            return False
+
+        for family, lo, hi in intervals:
+            idx = bisect.bisect_right(self._starts[family], lo) - 1
+            if idx < 0 or self._ends[family][idx] < hi:
+                return False
+        return True
+
+
+    def _derive(self, other, merge):
+        if not isinstance(other, IPRangeSet):
+            other = self.__class__(other, self.foldMapped)
+
+        derived = self.__class__(foldMapped=self.foldMapped)
+        for family in _FAMILY_CLASSES:
+            intervals = merge(self._getIntervals(family),
+                              other._getIntervals(family))
+            derived._setIntervals(family, intervals)
+        return derived
+
+
+    @classmethod
+    def _union(klass, mine, theirs):
+        merged, i, j = [], 0, 0
+        while i < len(mine) or j < len(theirs):
+            if j == len(theirs) or (i < len(mine) and mine[i] < theirs[j]):
+                merged.append(mine[i])
+                i += 1
+            else:
+                merged.append(theirs[j])
+                j += 1
+        return klass._coalesce(merged)
+
+
+    @staticmethod
+    def _intersection(mine, theirs):
+        intersected, i, j = [], 0, 0
+        while i < len(mine) and j < len(theirs):
+            lo = max(mine[i][0], theirs[j][0])
+            hi = min(mine[i][1], theirs[j][1])
+            if lo <= hi:
+                intersected.append((lo, hi))
+            if mine[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return intersected
+
+
+    @staticmethod
+    def _difference(mine, theirs):
+        remaining, j = [], 0
+        for lo, hi in mine:
+            while j < len(theirs) and theirs[j][1] < lo:
+                j += 1
+            k = j
+            while lo <= hi and k < len(theirs) and theirs[k][0] <= hi:
+                if theirs[k][0] > lo:
+                    remaining.append((lo, theirs[k][0] - 1))
+                lo = theirs[k][1] + 1
+                k += 1
+            if lo <= hi:
+                remaining.append((lo, hi))
+        return remaining
+
+
+    def union(self, other):
+        """Return a set of the addresses in either set."""
+        return self._derive(other, self._union)
+
+    def intersection(self, other):
+        """Return a set of the addresses in both sets."""
+        return self._derive(other, self._intersection)
+
+    def difference(self, other):
+        """Return a set of the addresses in this set but not in other."""
+        return self._derive(other, self._difference)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+    def ranges(self, family=None):
+        """Generate (first, last) Address pairs, IPv4 ranges first."""
+        for fam in sorted(_FAMILY_CLASSES):
+            if family in (None, fam):
+                klass = _FAMILY_CLASSES[fam]
+                for lo, hi in self._getIntervals(fam):
+                    yield klass.fromInt(lo), klass.fromInt(hi)
+
+
+    def prefixes(self, family=None):
+        """Return the minimal list of Prefixes covering the set."""
+        prefixes = []
+        for fam in sorted(_FAMILY_CLASSES):
+            if family in (None, fam):
+                klass = _FAMILY_CLASSES[fam]
+                for lo, hi in self._getIntervals(fam):
+                    prefixes.extend(self._collapse(klass, lo, hi))
+        return prefixes
+
+
+    @staticmethod
+    def _collapse(klass, lo, hi):
+        """Generate the largest aligned Prefixes that cover [lo, hi]."""
+        while lo <= hi:
+            hostBits = klass.bits
+            while hostBits and (lo & ((1 << hostBits) - 1)
+                                or lo + (1 << hostBits) - 1 > hi):
+                hostBits -= 1
+            yield Prefix(klass.fromInt(lo), klass.bits - hostBits)
+            lo += 1 << hostBits
+
+
+    def size(self, family=None):
+        """Return the number of addresses in the set."""
+        return sum(hi - lo + 1
+                   for fam in _FAMILY_CLASSES if family in (None, fam)
+                   for lo, hi in self._getIntervals(fam))
+
+
+    def __nonzero__(self):
+        return any(self._starts.itervalues())
+
+
+    def __eq__(self, obj):
+        if not isinstance(obj, IPRangeSet):
+            return False
+        return self._starts == obj._starts and self._ends == obj._ends
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return "{0.__class__.__name__}({1!r})".format(
+                self, map(str, self.prefixes()))
+
+
+
+
+def _numpy():
+    """Import NumPy on demand, so that it is only required by array users."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for address arrays")
+    return numpy
+
+
+def _isBuffer(obj):
+    """Determine whether obj is a contiguous buffer of packed bytes."""
+    return isinstance(obj, (str, bytearray, buffer, memoryview, mmap.mmap))
+
+
+_ARRAY_FAMILIES = {
+    AF_INET: (4, V4_DTYPE),
+    AF_INET6: (16, V6_DTYPE),
+    }
+
+
+def _arrayFromPacked(numpy, family, packed):
+    """Build an address array from a buffer of packed addresses."""
+    dtype = _ARRAY_FAMILIES[family][1]
+    if family == AF_INET:
+        return numpy.frombuffer(packed, dtype=">u4").astype(dtype)
+    else:
+        return numpy.frombuffer(packed, dtype=dtype).copy()
+
+
+def _parseFamilyArray(family, addresses):
+    numpy = _numpy()
+    size = _ARRAY_FAMILIES[family][0]
+    null = "\0" * size
+
+    packed, valid = bytearray(), bytearray()
+    for address in addresses:
+        try:
+            packed += socket.inet_pton(family, address)
+        except (socket.error, TypeError):
+            packed += null
+            valid.append(0)
+        else:
+            valid.append(1)
+
+    values = _arrayFromPacked(numpy, family, buffer(packed))
+    return values, numpy.frombuffer(valid, dtype=numpy.bool_).copy()
+
+
+def parseV4Array(addresses):
+    """Parse IPv4 address strings into an array.
+
+    Arguments:
+        addresses --  An iterable of IPv4 address strings.
+    Returns:
+        (values, valid) --  A V4_DTYPE array and a boolean mask.  Invalid
+                            entries are False in the mask and 0 in values.
+    """
+    return _parseFamilyArray(AF_INET, addresses)
+
+
+def parseV6Array(addresses):
+    """Parse IPv6 address strings into an array.
+
+    Arguments:
+        addresses --  An iterable of IPv6 address strings.
+    Returns:
+        (values, valid) --  A V6_DTYPE array and a boolean mask.  Invalid
+                            entries are False in the mask and 0 in values.
+    """
+    return _parseFamilyArray(AF_INET6, addresses)
+
+
+def parseArray(addresses):
+    """Parse a mix of IPv4 and IPv6 address strings into arrays.
+
+    Arguments:
+        addresses --  An iterable of address strings.
+    Returns:
+        (v4, v6, families) --  A V4_DTYPE array, a V6_DTYPE array, and an
+                array of address families, all indexed like addresses.  Each
+                entry's family is AF_INET, AF_INET6, or 0 if it is invalid;
+                values for the other family are 0.
+    """
+    numpy = _numpy()
+    v4Null, v6Null = "\0" * 4, "\0" * 16
+
+    v4Packed, v6Packed, families = bytearray(), bytearray(), []
+    for address in addresses:
+        try:
+            v4Packed += socket.inet_pton(AF_INET, address)
+        except (socket.error, TypeError):
+            v4Packed += v4Null
+            try:
+                v6Packed += socket.inet_pton(AF_INET6, address)
+            except (socket.error, TypeError):
+                v6Packed += v6Null
+                families.append(0)
+            else:
+                families.append(AF_INET6)
+        else:
+            v6Packed += v6Null
+            families.append(AF_INET)
+
+    v4 = _arrayFromPacked(numpy, AF_INET, buffer(v4Packed))
+    v6 = _arrayFromPacked(numpy, AF_INET6, buffer(v6Packed))
+    return v4, v6, numpy.array(families, dtype=numpy.uint8)
+
+
+def _unpackFamilyArray(family, packed):
+    numpy = _numpy()
+    size = _ARRAY_FAMILIES[family][0]
+
+    if _isBuffer(packed):
+        if len(packed) % size:
+            raise ValueError("Buffer length is not a multiple of {0}".format(
+                    size), len(packed))
+        values = _arrayFromPacked(numpy, family, packed)
+        return values, numpy.ones(len(values), dtype=numpy.bool_)
+
+    null = "\0" * size
+    buf, valid = bytearray(), bytearray()
+    for item in packed:
+        if isinstance(item, (str, bytearray)) and len(item) == size:
+            buf += item
+            valid.append(1)
+        else:
+            buf += null
+            valid.append(0)
+
+    values = _arrayFromPacked(numpy, family, buffer(buf))
+    return values, numpy.frombuffer(valid, dtype=numpy.bool_).copy()
+
+
+def unpackV4Array(packed):
+    """Build an IPv4 array from network-ordered bytes.
+
+    Arguments:
+        packed --  Either a buffer of concatenated 4-byte addresses (e.g. a
+                   str, bytearray, or mmap) or an iterable of 4-byte strings.
+    Returns:
+        (values, valid) --  A V4_DTYPE array and a boolean mask.
+    Raises:
+        ValueError if a buffer's length is not a multiple of 4.
+    """
+    return _unpackFamilyArray(AF_INET, packed)
+
+
+def unpackV6Array(packed):
+    """Build an IPv6 array from network-ordered bytes.
+
+    Arguments:
+        packed --  Either a buffer of concatenated 16-byte addresses or an
+                   iterable of 16-byte strings.
+    Returns:
+        (values, valid) --  A V6_DTYPE array and a boolean mask.
+    Raises:
+        ValueError if a buffer's length is not a multiple of 16.
+    """
+    return _unpackFamilyArray(AF_INET6, packed)
+
+
+def _arrayFamily(values):
+    """Determine the address family of an array by its dtype."""
+    return AF_INET6 if values.dtype.names else AF_INET
+
+
+def packArray(values):
+    """Return the concatenated network-ordered bytes of an address array."""
+    if _arrayFamily(values) == AF_INET:
+        return values.astype(">u4").tostring()
+    else:
+        return values.tostring()
+
+
+def formatV4Array(values):
+    """Format a V4_DTYPE array as an array of dotted-quad strings."""
+    numpy = _numpy()
+    values = numpy.asarray(values, dtype=V4_DTYPE)
+
+    text = None
+    for shift in (24, 16, 8, 0):
+        octets = ((values >> shift) & 0xff).astype("S3")
+        if text is None:
+            text = octets
+        else:
+            text = numpy.char.add(numpy.char.add(text, "."), octets)
+
+    return text
+
+
+def formatV6Array(values):
+    """Format a V6_DTYPE array as an array of IPv6 address strings."""
+    numpy = _numpy()
+    packed = packArray(numpy.asarray(values, dtype=V6_DTYPE))
+    text = [socket.inet_ntop(AF_INET6, packed[i:i+16])
+            for i in xrange(0, len(packed), 16)]
+    return numpy.array(text, dtype="S39")
+
+
+def formatArray(values):
+    """Format a V4_DTYPE or V6_DTYPE array as an array of strings."""
+    if _arrayFamily(values) == AF_INET:
+        return formatV4Array(values)
+    else:
+        return formatV6Array(values)
+
+
+_V4_STRUCT = struct.Struct("!I")
+
+def _addressFromValue(family, value):
+    """Build an Address from an element of a V4_DTYPE or V6_DTYPE array."""
+    if family == AF_INET:
+        return V4Address._fromPacked(_V4_STRUCT.pack(value))
+    else:
+        return V6Address._fromPacked(value.tostring())
+
+
+def addressesFromArray(values):
+    """Lazily generate V4Address or V6Address objects from an array."""
+    family = _arrayFamily(values)
+    for value in values:
+        yield _addressFromValue(family, value)
+
+
+def arrayFromAddresses(addresses, family=AF_INET):
+    """Build an address array from V4Address or V6Address objects.
+
+    Arguments:
+        addresses --  An iterable of Address objects.
+        family --  The family of the array to build (AF_INET or AF_INET6).
+    Raises:
+        ValueError if an address does not belong to family.
+    """
+    numpy = _numpy()
+    packed = bytearray()
+    for ip in addresses:
+        if ip.family != family:
+            raise ValueError("Address family mismatch", ip, family)
+        packed += ip.toBytes()
+
+    return _arrayFromPacked(numpy, family, buffer(packed))
+
+
+
+class AddressArray(object):
+    """A compact sequence of addresses of a single family.
+
+    Addresses are stored contiguously as packed integers in a NumPy array
+    (see V4_DTYPE and V6_DTYPE), and are only built into V4Address or
+    V6Address objects as they are accessed.  Membership tests use a binary
+    search once the array is sorted; set operations produce sorted,
+    duplicate-free arrays.
+
+    Attributes:
+        family --  The address family (AF_INET or AF_INET6).
+        values --  The underlying NumPy array.
+    """
+
+    def __init__(self, values=None, family=AF_INET):
+        """Build an array of addresses.
+
+        Arguments:
+            values --  A V4_DTYPE or V6_DTYPE array (or anything NumPy can
+                       convert to one).  If not specified, the array is empty.
+            family --  The address family of values.
+        """
+        numpy = _numpy()
+        if family not in _ARRAY_FAMILIES:
+            raise ValueError("Invalid address family", family)
+        dtype = _ARRAY_FAMILIES[family][1]
+
+        if values is None:
+            values = numpy.empty(0, dtype=dtype)
+        self.family = family
+        self.values = numpy.asarray(values, dtype=dtype)
+        self._sorted = len(self.values) < 2
+
+
+    @classmethod
+    def fromAddresses(klass, addresses, family=AF_INET):
+        """Build an array from an iterable of Address objects."""
+        return klass(arrayFromAddresses(addresses, family), family)
+
+
+    @classmethod
+    def fromBytes(klass, packed, family=AF_INET):
+        """Build an array from a buffer of concatenated packed addresses."""
+        if family == AF_INET:
+            values, valid = unpackV4Array(packed)
+        else:
+            values, valid = unpackV6Array(packed)
+        return klass(values, family)
+
+
+    def toBytes(self):
+        """Return the concatenated network-ordered bytes of all addresses."""
+        return packArray(self.values)
+
+
+    @property
+    def isSorted(self):
+        """True if the array is known to be in ascending order."""
+        return self._sorted
+
+
+    def sort(self):
+        """Sort the array in place."""
+        self.values = self._numpy.sort(self.values, kind="mergesort")
+        self._sorted = True
+
+
+    def dedupe(self):
+        """Sort the array in place and remove duplicate addresses."""
+        self.values = self._numpy.unique(self.values)
+        self._sorted = True
+
+
+    @property
+    def _numpy(self):
+        return _numpy()
+
+
+    def _derive(self, values, isSorted):
+        array = self.__class__(values, self.family)
+        array._sorted = isSorted or len(values) < 2
+        return array
+
+
+    def _key(self, address):
+        """Return a one-element array holding address's packed value.
+
+        Addresses are coerced as by AbstractAddress.__cmp__().
+        Raises:
+            ValueError if address is not an address of this array's family.
+        """
+        address = _toAddress(address)
+        if address.family != self.family:
+            raise ValueError("Address family mismatch", address, self.family)
+        return arrayFromAddresses([address], self.family)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __iter__(self):
+        return addressesFromArray(self.values)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            step = index.step or 1
+            return self._derive(self.values[index], self._sorted and step > 0)
+        else:
+            return _addressFromValue(self.family, self.values[index])
+
+
+    def __contains__(self, address):
+        try:
+            key = self._key(address)
+        except (ValueError, TypeError):
+            return False
+
+        if self._sorted:
+            idx = self._numpy.searchsorted(self.values, key)[0]
+            return bool(idx < len(self.values) and self.values[idx] == key[0])
+        else:
+            return bool((self.values == key[0]).any())
+
+
+    def _sortedValues(self, other):
+        """Return sorted, unique values of self and other."""
+        if not isinstance(other, AddressArray):
+            other = self.fromAddresses(other, self.family)
+        if other.family != self.family:
+            raise ValueError("Address family mismatch", self.family,
+                             other.family)
+
+        numpy = self._numpy
+        return numpy.unique(self.values), numpy.unique(other.values)
+
+
+    def _membership(self, values, other):
+        """Return a mask of values (sorted) that are in other (sorted)."""
+        numpy = self._numpy
+        if len(other) == 0:
+            return numpy.zeros(len(values), dtype=numpy.bool_)
+        idx = numpy.searchsorted(other, values)
+        idx[idx == len(other)] = 0
+        return other[idx] == values
+
+
+    def union(self, other):
+        """Return a sorted, duplicate-free array of addresses in either."""
+        mine, theirs = self._sortedValues(other)
+        extra = theirs[~self._membership(theirs, mine)]
+        merged = self._numpy.concatenate((mine, extra))
+        return self._derive(self._numpy.sort(merged, kind="mergesort"), True)
+
+
+    def intersection(self, other):
+        """Return a sorted, duplicate-free array of addresses in both."""
+        mine, theirs = self._sortedValues(other)
+        return self._derive(mine[self._membership(mine, theirs)], True)
+
+
+    def difference(self, other):
+        """Return a sorted, duplicate-free array of addresses not in other."""
+        mine, theirs = self._sortedValues(other)
+        return self._derive(mine[~self._membership(mine, theirs)], True)
+
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} family={0.family} len={1}>".format(
+                self, len(self))
+
+
+
+def _openTemporary(directory, prefix):
+    """Create a uniquely named file to be renamed over a shared file.
+
+    Unlike tempfile.mkstemp(), which makes files readable only by their owner,
+    the file is given the mode that the umask gives new files.
+
+    Returns:
+        (fd, path) of the file, opened for writing.
+    """
+    for attempt in xrange(100):
+        path = os.path.join(directory, "{0}{1:016x}".format(prefix,
+                random.getrandbits(64)))
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                           0666), path
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    raise OSError(errno.EEXIST, "No unused temporary file name", directory)
+
+
+
+class PrefixIndexBuilder(object):
+    """Compiles a prefix-to-metadata table into a PrefixIndex file.
+
+    Nested prefixes are flattened into disjoint address ranges, each
+    labeled with the metadata of its longest matching prefix, so that a
+    PrefixIndex lookup is a single binary search.
+
+    File format (all integers are network-ordered):
+        header --  magic, version, IPv4 record count, IPv6 record count
+        IPv4 records --  first, last, metadata offset, metadata length,
+                         prefix length; sorted by first
+        IPv6 records --  as IPv4 records, with 16-byte first and last
+        metadata --  metadata strings, referenced by offset
+    """
+
+    magic = "JPFX"
+    version = 1
+
+    headerFormat = struct.Struct("!4sBxxxII")
+    recordFormats = {
+        AF_INET: struct.Struct("!4s4sIIB"),
+        AF_INET6: struct.Struct("!16s16sIIB"),
+        }
+
+
+    def __init__(self):
+        self._entries = []
+
+
+    def add(self, prefix, metadata):
+        """Add a prefix to the table.
+
+        Later additions of the same prefix replace earlier ones.
+
+        Arguments:
+            prefix --  A Prefix or a "network/length" string.
+            metadata --  A string.
+        Raises:
+            ValueError if prefix is invalid.
+        """
+        if not isinstance(prefix, Prefix):
+            prefix = Prefix(prefix)
+        self._entries.append((prefix, str(metadata)))
+
+
+    def addCSV(self, csvFile):
+        """Add rows from a CSV file of prefixes and metadata.
+
+        The first column of each row is a prefix; the remaining columns are
+        kept, CSV-encoded, as its metadata.  Blank lines and lines beginning
+        with "#" are skipped.
+
+        Raises:
+            ValueError if a row's prefix is invalid.
+        """
+        for row in csv.reader(csvFile):
+            if not row or row[0].startswith("#"):
+                continue
+            prefix = row[0].strip()
+
+            metadata = _StringIO()
+            csv.writer(metadata, lineterminator="").writerow(row[1:])
+            self.add(prefix, metadata.getvalue())
+
+
+    def _flatten(self, family):
+        """Generate disjoint (first, last, metadata, length) ranges."""
+        klass = _FAMILY_CLASSES[family]
+        prefixes = []
+        for order, (prefix, metadata) in enumerate(self._entries):
+            if prefix.family == family:
+                first = prefix.network.toInt()
+                last = first | Prefix._hostMask(klass.bits, prefix.length)
+                prefixes.append((first, prefix.length, order, last, metadata))
+        prefixes.sort()
+
+        # Prefixes are either nested or disjoint, so a stack of enclosing
+        # prefixes determines the longest match for each range.
+        stack, cursor = [], None
+        for first, length, order, last, metadata in prefixes:
+            while stack and stack[-1][0] < first:
+                top = stack.pop()
+                if cursor <= top[0]:
+                    yield cursor, top[0], top[1], top[2]
+                cursor = top[0] + 1
+            if stack and cursor < first:
+                yield cursor, first - 1, stack[-1][1], stack[-1][2]
+            cursor = first
+            stack.append((last, metadata, length))
+
+        while stack:
+            top = stack.pop()
+            if cursor <= top[0]:
+                yield cursor, top[0], top[1], top[2]
+            cursor = top[0] + 1
+
+
+    def write(self, path):
+        """Atomically write the index to path.
+
+        The index is written to a temporary file that is renamed over path,
+        so readers never see a partial index, and PrefixIndexes that are
+        already open keep using the previous file until they are reopened.
+        """
+        sections, metadataOffsets, metadata = [], {}, _StringIO()
+        for family in (AF_INET, AF_INET6):
+            klass = _FAMILY_CLASSES[family]
+            record = self.recordFormats[family]
+            records = []
+            for first, last, meta, length in self._flatten(family):
+                if meta not in metadataOffsets:
+                    metadataOffsets[meta] = metadata.tell()
+                    metadata.write(meta)
+                records.append(record.pack(
+                        klass.fromInt(first).toBytes(),
+                        klass.fromInt(last).toBytes(),
+                        metadataOffsets[meta], len(meta), length))
+            sections.append(records)
+
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, tmpPath = _openTemporary(directory, ".{0}.".format(name))
+        try:
+            f = os.fdopen(fd, "wb")
+        except:
+            os.close(fd)
+            os.unlink(tmpPath)
+            raise
+
+        try:
+            with f:
+                f.write(self.headerFormat.pack(self.magic, self.version,
+                        len(sections[0]), len(sections[1])))
+                for records in sections:
+                    f.writelines(records)
+                f.write(metadata.getvalue())
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpPath, path)
+
+        except:
+            os.unlink(tmpPath)
+            raise
+
+
+
+class PrefixIndex(object):
+    """A memory-mapped, read-only prefix-to-metadata index.
+
+    Indexes are built by PrefixIndexBuilder.  Opening one maps the file
+    without parsing it; lookups binary-search the mapped records.
+    """
+
+    def __init__(self, path):
+        """Open an index.
+
+        Raises:
+            ValueError if path is not a valid index file.
+            IOError if path cannot be opened.
+        """
+        self.path = path
+        self._map = None
+        self._load()
+
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            try:
+                indexMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                raise ValueError("Invalid prefix index", self.path)
+
+        header = PrefixIndexBuilder.headerFormat
+        try:
+            magic, version, v4Count, v6Count = header.unpack_from(indexMap)
+        except struct.error:
+            magic = version = None
+        if (magic, version) != (PrefixIndexBuilder.magic,
+                                PrefixIndexBuilder.version):
+            indexMap.close()
+            raise ValueError("Invalid prefix index", self.path)
+
+        formats = PrefixIndexBuilder.recordFormats
+        offset, self._sections = header.size, {}
+        for family, count in ((AF_INET, v4Count), (AF_INET6, v6Count)):
+            self._sections[family] = (offset, count, formats[family])
+            offset += count * formats[family].size
+        self._metadataOffset = offset
+
+        if offset > len(indexMap):
+            indexMap.close()
+            raise ValueError("Truncated prefix index", self.path)
+
+        oldMap, self._map = self._map, indexMap
+        if oldMap is not None:
+            oldMap.close()
+
+
+    def reopen(self):
+        """Map the current file at self.path, e.g. after a rebuild."""
+        self._load()
+
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        """The number of ranges in the index."""
+        return sum(count for offset, count, fmt in self._sections.itervalues())
+
+
+    def _find(self, address):
+        """Return the record containing address, or None."""
+        ip = _toAddress(address)
+        offset, count, record = self._sections[ip.family]
+        key, size, indexMap = ip.toBytes(), record.size, self._map
+
+        # Find the last record whose first address is <= key.
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * size
+            if indexMap[start:start+len(key)] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        first, last, metaOffset, metaLength, length = record.unpack_from(
+                indexMap, offset + (lo - 1) * size)
+        if key > last:
+            return None
+        return ip, metaOffset, metaLength, length
+
+
+    def lookupOffset(self, address):
+        """Find the metadata of the longest prefix containing address.
+
+        Returns:
+            (offset, length) of the metadata within the metadata section, or
+            None if no prefix contains address.
+        Raises:
+            ValueError if address is not a valid address.
+        """
+        found = self._find(address)
+        return found and found[1:3]
+
+
+    def lookup(self, address):
+        """Return the metadata of the longest prefix containing address.
+
+        Returns:
+            The metadata string, or None if no prefix contains address.
+        Raises:
+            ValueError if address is not a valid address.
+        """
+        found = self._find(address)
+        if found is None:
+            return None
+        start = self._metadataOffset + found[1]
+        return self._map[start:start+found[2]]
+
+
+    def lookupPrefix(self, address):
+        """Return the longest Prefix containing address, or None."""
+        found = self._find(address)
+        if found is None:
+            return None
+        ip, length = found[0], found[3]
+        hostMask = Prefix._hostMask(ip.bits, length)
+        return Prefix(ip.fromInt(ip.toInt() & ~hostMask), length)
+
+
+
+# Address literal candidates.  Matches are only plausible addresses; each is
+# validated with inet_pton() before being reported.  A candidate never begins
+# inside another candidate, so scanning a text in pieces finds the same
+# candidates as scanning it whole.  Trailing dots (e.g. ending a sentence)
+# and ports (e.g. "10.0.0.1:80") are not part of an address.
+_SCAN_PATTERN = re.compile(r"""
+      (?<![0-9A-Fa-f:.])
+      (?:[0-9A-Fa-f]{0,4}:){2,7}
+      (?:(?:[0-9]{1,3}\.){3}[0-9]{1,3}|[0-9A-Fa-f]{1,4})?
+      (?![0-9A-Fa-f:]|\.[0-9])
+    |
+      (?<![0-9.])(?<![0-9A-Fa-f:]:)
+      (?:[0-9]{1,3}\.){3}[0-9]{1,3}
+      (?![0-9]|\.[0-9])
+    """, re.VERBOSE)
+
+# Longer than any candidate match, so that matches starting in one region
+# may be completed from the next.
+_SCAN_OVERLAP = 64
+
+SCAN_CHUNK_SIZE = 1 << 24
+
+
+def _scanPacked(pattern, text, start=0, end=None):
+    """Generate packed addresses found in text[start:end].
+
+    Matches must begin in the region, but may extend past its end.
+    """
+    if end is None:
+        end = len(text)
+    endpos = min(len(text), end + _SCAN_OVERLAP)
+
+    inet_pton, error = socket.inet_pton, socket.error
+    for match in pattern.finditer(text, start, endpos):
+        if match.start() >= end:
+            break
+        candidate = match.group()
+        family = AF_INET6 if ":" in candidate else AF_INET
+        try:
+            yield inet_pton(family, candidate)
+        except error:
+            pass
+
+
+def _packedToAddress(packed):
+    klass = V4Address if len(packed) == 4 else V6Address
+    return klass._fromPacked(packed)
+
+
+def scanText(text, packed=False):
+    """Generate the IPv4 and IPv6 addresses found in a string.
+
+    Arguments:
+        text --  A string or buffer.
+        packed --  If True, generate network-ordered bytes rather than
+                   Address objects.
+    """
+    for found in _scanPacked(_SCAN_PATTERN, text):
+        yield found if packed else _packedToAddress(found)
+
+
+def _scanRegions(size, chunkSize):
+    """Split [0, size) into regions of at most chunkSize bytes."""
+    return [(start, min(size, start + chunkSize))
+            for start in xrange(0, size, chunkSize)]
+
+
+def _mapFile(path):
+    """Map a file read-only, or return None if it is empty."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _scanFileRegion(args):
+    """Scan a region of a file.  Runs in scanFile()'s worker processes."""
+    path, start, end = args
+    fileMap = _mapFile(path)
+    try:
+        return list(_scanPacked(_SCAN_PATTERN, fileMap, start, end))
+    finally:
+        fileMap.close()
+
+
+def scanFile(path, packed=False, processes=None, chunkSize=SCAN_CHUNK_SIZE):
+    """Generate the IPv4 and IPv6 addresses found in a file, in file order.
+
+    The file is memory-mapped and scanned a chunk at a time, so it is never
+    read into memory as a whole.  Addresses that span chunk boundaries are
+    found exactly once.
+
+    Arguments:
+        path --  The path of the file to scan.
+        packed --  If True, generate network-ordered bytes rather than
+                   Address objects.
+        processes --  If greater than 1, chunks are scanned by a pool of
+                      this many worker processes.
+        chunkSize --  The number of bytes scanned per chunk.
+    """
+    fileMap = _mapFile(path)
+    if fileMap is None:
+        return
+
+    try:
+        regions = _scanRegions(len(fileMap), chunkSize)
+        if processes and processes > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                chunks = pool.imap(_scanFileRegion,
+                        [(path, start, end) for start, end in regions])
+                for chunk in chunks:
+                    for found in chunk:
+                        yield found if packed else _packedToAddress(found)
+            except:
+                pool.terminate()
+                raise
+            else:
+                # Terminating an idle pool can hang while a Twisted reactor
+                # is handling SIGCHLD, so finished pools are joined instead.
+                pool.close()
+                pool.join()
+
+        else:
+            for start, end in regions:
+                for found in _scanPacked(_SCAN_PATTERN, fileMap, start, end):
+                    yield found if packed else _packedToAddress(found)
+
+    finally:
+        fileMap.close()
+
+
+
+# Kinds of address set sections.
+ADDRESSES, PREFIXES, RANGES = 1, 2, 3
+
+
+def _encodeVarint(value):
+    """Encode a non-negative integer as an unsigned LEB128 varint."""
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return encoded
+
+
+def _decodeVarint(data, pos):
+    """Decode an unsigned LEB128 varint from data at pos.
+
+    Returns:
+        (value, pos) --  The value and the position following it.
+    Raises:
+        IndexError if data ends within the varint.
+    """
+    value = shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _view(source):
+    """Return a zero-copy view of a buffer."""
+    try:
+        return memoryview(source)
+    except TypeError:
+        # e.g. mmap objects, which only provide the old buffer interface.
+        return buffer(source)
+
+
+
+class AddressSetWriter(object):
+    """Writes a section of a compact binary address set.
+
+    A section holds sorted addresses, prefixes, or ranges of one family.
+    It begins with a header:
+        magic --  "JADS"
+        version --  1 byte
+        kind --  1 byte: ADDRESSES, PREFIXES, or RANGES
+        family --  1 byte: 4 or 6
+        count --  8 bytes: the number of items, or UNKNOWN_COUNT
+    and each item is encoded as unsigned varints:
+        ADDRESSES --  the difference from the previous address
+        PREFIXES --  the difference from the previous network, and the length
+        RANGES --  the difference of the first address from the previous
+                   range's last address, and the difference of the last
+                   address from the first
+    The first item's differences are from 0.  Address values are the integer
+    values of their network-ordered bytes (see AbstractAddress.toBytes()).
+
+    Sections may be concatenated.  A section with an UNKNOWN_COUNT must be
+    the last in its stream.
+    """
+
+    magic = "JADS"
+    version = 1
+    headerFormat = struct.Struct("!4sBBBxQ")
+
+    UNKNOWN_COUNT = (1 << 64) - 1
+
+    familyCodes = {AF_INET: 4, AF_INET6: 6, }
+
+    bufferSize = 1 << 16
+
+
+    def __init__(self, out, kind, family=AF_INET, count=None):
+        """Begin writing a section.
+
+        Arguments:
+            out --  A file-like object.
+            kind --  ADDRESSES, PREFIXES, or RANGES.
+            family --  AF_INET or AF_INET6.
+            count --  The number of items that will be written.  If not
+                      specified and out is seekable, the count is written
+                      when the writer is closed.
+        """
+        if kind not in (ADDRESSES, PREFIXES, RANGES):
+            raise ValueError("Invalid address set kind", kind)
+        if family not in self.familyCodes:
+            raise ValueError("Invalid address family", family)
+
+        self.kind = kind
+        self.family = family
+        self.count = 0
+
+        self._out = out
+        self._expected = count
+        self._buffer = bytearray()
+        self._previous = 0
+        self._last = None
+
+        self._headerPos = None
+        if count is None:
+            try:
+                self._headerPos = out.tell()
+            except (AttributeError, IOError):
+                pass
+
+        self._writeHeader(self.UNKNOWN_COUNT if count is None else count)
+
+
+    def _writeHeader(self, count):
+        self._out.write(self.headerFormat.pack(self.magic, self.version,
+                self.kind, self.familyCodes[self.family], count))
+
+
+    def write(self, item):
+        """Write an item.
+
+        Arguments:
+            item --  An Address for ADDRESSES sections, a Prefix for PREFIXES
+                     sections, and a (first, last) pair of Addresses for
+                     RANGES sections.  Strings are parsed.
+        Raises:
+            ValueError if the item is invalid, of the wrong family, or out of
+            order.
+        """
+        if self.kind == ADDRESSES:
+            self._writeAddress(self._toInt(item))
+
+        elif self.kind == PREFIXES:
+            if not isinstance(item, Prefix):
+                item = Prefix(item)
+            self._writePrefix(self._toInt(item.network), item.length)
+
+        else:
+            try:
+                first, last = item
+            except (TypeError, ValueError):
+                raise ValueError("Invalid range", item)
+            self._writeRange(self._toInt(first), self._toInt(last))
+
+
+    def _toInt(self, address):
+        return _familyInt(address, self.family)
+
+
+    def _writeAddress(self, value):
+        if value < self._previous:
+            raise ValueError("Addresses are not sorted")
+        self._append(value - self._previous)
+        self._previous = value
+
+    def _writePrefix(self, value, length):
+        if (value, length) < (self._previous, self._last):
+            raise ValueError("Prefixes are not sorted")
+        self._append(value - self._previous, length)
+        self._previous, self._last = value, length
+
+    def _writeRange(self, first, last):
+        if last < first:
+            raise ValueError("Invalid range", first, last)
+        if self._last is not None and first <= self._last:
+            raise ValueError("Ranges are not sorted and disjoint")
+        self._append(first - self._previous, last - first)
+        self._previous = self._last = last
+
+
+    def _append(self, *values):
+        for value in values:
+            self._buffer += _encodeVarint(value)
+        self.count += 1
+        if len(self._buffer) >= self.bufferSize:
+            self.flush()
+
+
+    def flush(self):
+        self._out.write(str(self._buffer))
+        del self._buffer[:]
+
+
+    def close(self):
+        """Finish the section.  Does not close the underlying file.
+
+        Raises:
+            ValueError if a count was specified and a different number of
+            items were written.
+        """
+        self.flush()
+        if self._expected is not None and self._expected != self.count:
+            raise ValueError("Wrote {0} of {1} items".format(
+                    self.count, self._expected))
+
+        if self._headerPos is not None:
+            end = self._out.tell()
+            self._out.seek(self._headerPos)
+            self._writeHeader(self.count)
+            self._out.seek(end)
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.close()
+
+
+
+class AddressSetReader(object):
+    """Reads the items of a stream of address set sections.
+
+    Sources may be file-like objects, which are read incrementally, or
+    buffers (e.g. str, mmap), which are decoded in place without copying.
+
+    Attributes:
+        kind, family, count --  Describe the section being read.
+    """
+
+    blockSize = 1 << 16
+
+
+    def __init__(self, source):
+        if _isBuffer(source):
+            self._data, self._file = _view(source), None
+        else:
+            self._data, self._file = "", source
+        self._pos = 0
+
+        self.kind = self.family = self.count = None
+
+
+    def _fill(self):
+        """Read another block of a file source.  Returns False at EOF."""
+        if self._file is None:
+            return False
+        block = self._file.read(self.blockSize)
+        if not block:
+            return False
+        self._data = self._data[self._pos:] + block
+        self._pos = 0
+        return True
+
+
+    def _readVarint(self):
+        while True:
+            try:
+                value, self._pos = _decodeVarint(self._data, self._pos)
+                return value
+            except IndexError:
+                if not self._fill():
+                    raise ValueError("Truncated address set")
+
+
+    def _readHeader(self):
+        """Read a section header.  Returns False at the end of the stream."""
+        header = AddressSetWriter.headerFormat
+        while len(self._data) - self._pos < header.size:
+            if not self._fill():
+                if len(self._data) == self._pos:
+                    return False
+                raise ValueError("Truncated address set header")
+
+        magic, version, kind, familyCode, count = header.unpack_from(
+                self._data, self._pos)
+        self._pos += header.size
+
+        families = dict((code, family) for family, code
+                        in AddressSetWriter.familyCodes.iteritems())
+        if (magic != AddressSetWriter.magic
+                or version != AddressSetWriter.version
+                or kind not in (ADDRESSES, PREFIXES, RANGES)
+                or familyCode not in families):
+            raise ValueError("Invalid address set header")
+
+        self.kind, self.family, self.count = kind, families[familyCode], count
+        return True
+
+
+    def _atEnd(self):
+        return self._pos == len(self._data) and not self._fill()
+
+
+    def _readValues(self):
+        """Generate each item of the section as a tuple of integers."""
+        unknown = self.count == AddressSetWriter.UNKNOWN_COUNT
+        read, previous, remaining = self._readVarint, 0, self.count
+        while not self._atEnd() if unknown else remaining:
+            if self.kind == ADDRESSES:
+                previous += read()
+                yield (previous, )
+            elif self.kind == PREFIXES:
+                previous += read()
+                yield previous, read()
+            else:
+                first = previous + read()
+                previous = first + read()
+                yield first, previous
+            remaining -= 1
+
+
+    def iterValues(self):
+        """Generate (family, kind, values) for each item of every section.
+
+        Values are a tuple of integers: (address, ), (network, length), or
+        (first, last).
+        """
+        while self._readHeader():
+            family, kind = self.family, self.kind
+            for values in self._readValues():
+                yield family, kind, values
+
+
+    def __iter__(self):
+        """Generate Addresses, Prefixes, or (first, last) Address pairs."""
+        for family, kind, values in self.iterValues():
+            klass = _FAMILY_CLASSES[family]
+            if kind == ADDRESSES:
+                yield klass.fromInt(values[0])
+            elif kind == PREFIXES:
+                yield Prefix(klass.fromInt(values[0]), values[1])
+            else:
+                yield klass.fromInt(values[0]), klass.fromInt(values[1])
+
+
+
+def _familyInt(address, family):
+    """Return the integer value of address, which must belong to family."""
+    ip = _toAddress(address)
+    if ip.family != family:
+        raise ValueError("Address family mismatch", ip, family)
+    return ip.toInt()
+
+
+def dumpAddresses(addresses, out, family=AF_INET):
+    """Write an ADDRESSES section of the sorted addresses.
+
+    Arguments:
+        addresses --  An AddressArray or an iterable of Addresses.
+        out --  A file-like object.
+        family --  The family of the addresses (taken from AddressArrays).
+    """
+    if isinstance(addresses, AddressArray):
+        family = addresses.family
+        values = addresses._numpy.sort(addresses.values)
+        if family == AF_INET:
+            ints = (int(v) for v in values)
+        else:
+            ints = ((int(v["hi"]) << 64) | int(v["lo"]) for v in values)
+    else:
+        ints = sorted(_familyInt(a, family) for a in addresses)
+
+    writer = AddressSetWriter(out, ADDRESSES, family)
+    for value in ints:
+        writer._writeAddress(value)
+    writer.close()
+
+
+def dumpPrefixes(prefixes, out, family=AF_INET):
+    """Write a PREFIXES section of the sorted prefixes."""
+    prefixes = [p if isinstance(p, Prefix) else Prefix(p) for p in prefixes]
+    items = sorted((_familyInt(p.network, family), p.length) for p in prefixes)
+
+    writer = AddressSetWriter(out, PREFIXES, family)
+    for value, length in items:
+        writer._writePrefix(value, length)
+    writer.close()
+
+
+def dumpRanges(ranges, out):
+    """Write RANGES sections (IPv4, then IPv6) of an IPRangeSet."""
+    for family in (AF_INET, AF_INET6):
+        intervals = ranges._getIntervals(family)
+        writer = AddressSetWriter(out, RANGES, family, len(intervals))
+        for first, last in intervals:
+            writer._writeRange(first, last)
+        writer.close()
+
+
+def _loadKind(source, kind):
+    reader = AddressSetReader(source)
+    for family, itemKind, values in reader.iterValues():
+        if itemKind != kind:
+            raise ValueError("Unexpected address set kind", itemKind)
+        yield family, values
+
+
+def loadAddresses(source):
+    """Read the Addresses of ADDRESSES sections from a file or buffer."""
+    return [_FAMILY_CLASSES[family].fromInt(values[0])
+            for family, values in _loadKind(source, ADDRESSES)]
+
+
+def loadArray(source):
+    """Read an ADDRESSES section from a file or buffer into an AddressArray.
+
+    Raises:
+        ValueError if the source holds addresses of both families.
+    """
+    families, packed = set(), bytearray()
+    for family, values in _loadKind(source, ADDRESSES):
+        families.add(family)
+        packed += _FAMILY_CLASSES[family].fromInt(values[0]).toBytes()
+
+    if len(families) > 1:
+        raise ValueError("Address set holds addresses of both families")
+    family = families.pop() if families else AF_INET
+
+    array = AddressArray.fromBytes(buffer(packed), family)
+    array._sorted = True
+    return array
+
+
+def loadPrefixes(source):
+    """Read the Prefixes of PREFIXES sections from a file or buffer."""
+    return [Prefix(_FAMILY_CLASSES[family].fromInt(values[0]), values[1])
+            for family, values in _loadKind(source, PREFIXES)]
+
+
+def loadRanges(source):
+    """Read RANGES sections from a file or buffer into an IPRangeSet."""
+    intervals = dict((family, []) for family in _FAMILY_CLASSES)
+    for family, values in _loadKind(source, RANGES):
+        intervals[family].append(values)
+
+    ranges = IPRangeSet()
+    for family, fIntervals in intervals.iteritems():
+        ranges._setIntervals(family, IPRangeSet._coalesce(sorted(fIntervals)))
+    return ranges
+
+
+# Address filters hash the 64-bit halves of packed addresses (IPv4 addresses
+# have a zero upper half) with the splitmix64 finalizer.  The hash is computed
+# identically on Python integers and on NumPy uint64 arrays.
+_MASK64 = (1 << 64) - 1
+_HASH_SALT = 0x9e3779b97f4a7c15
+_V6_HALVES = struct.Struct("!QQ")
+
+
+def _mix64(x):
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return x ^ (x >> 31)
+
+
+def _filterHash(packed):
+    """Return a pair of 64-bit hashes of a packed address."""
+    if len(packed) == 4:
+        hi, lo = 0, _V4_STRUCT.unpack(packed)[0]
+    else:
+        hi, lo = _V6_HALVES.unpack(packed)
+    h1 = _mix64(_mix64((hi + len(packed)) & _MASK64) ^ lo)
+    return h1, _mix64(h1 ^ _HASH_SALT) | 1
+
+
+def _mix64Array(numpy, x):
+    u64 = numpy.uint64
+    x = (x ^ (x >> u64(30))) * u64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> u64(27))) * u64(0x94d049bb133111eb)
+    return x ^ (x >> u64(31))
+
+
+def _filterHashArray(values):
+    """Return a pair of arrays of 64-bit hashes of an address array."""
+    if isinstance(values, AddressArray):
+        values = values.values
+    numpy, u64 = _numpy(), _numpy().uint64
+    if _arrayFamily(values) == AF_INET:
+        lo = values.astype(u64)
+        hi = numpy.zeros(len(values), dtype=u64) + u64(4)
+    else:
+        lo = values["lo"].astype(u64)
+        hi = values["hi"].astype(u64) + u64(16)
+    h1 = _mix64Array(numpy, _mix64Array(numpy, hi) ^ lo)
+    return h1, _mix64Array(numpy, h1 ^ u64(_HASH_SALT)) | u64(1)
+
+
+def _packedKey(address):
+    """Return the packed bytes of an Address (or address string)."""
+    return _toAddress(address).toBytes()
+
+
+
+class _AddressFilter(object):
+    """Base class for filters stored in a single buffer.
+
+    The buffer holds a header followed by the filter's table, so that it
+    can be written to a file and later used in place, e.g. from an mmap.
+    """
+
+    magic = None
+    version = 1
+    headerFormat = None
+
+
+    @classmethod
+    def fromBuffer(klass, data):
+        """Use a serialized filter in place.
+
+        Arguments:
+            data --  A buffer produced by toBytes(), e.g. a str, bytearray,
+                     or mmap.  Filters over read-only buffers are read-only.
+        Raises:
+            ValueError if data is not a valid filter of this class.
+        """
+        self = klass.__new__(klass)
+        self._data = data
+        try:
+            header = klass.headerFormat.unpack_from(data)
+        except (struct.error, TypeError):
+            raise ValueError("Invalid {0.__name__}".format(klass))
+        if header[:2] != (klass.magic, klass.version):
+            raise ValueError("Invalid {0.__name__}".format(klass))
+        self._loadHeader(*header[2:])
+        if len(data) < klass.headerFormat.size + self._tableSize():
+            raise ValueError("Truncated {0.__name__}".format(klass))
+        return self
+
+
+    def toBytes(self):
+        """Return the serialized filter."""
+        return str(self._data[:self.headerFormat.size + self._tableSize()])
+
+
+    def _tableView(self):
+        """Return the table as a NumPy uint8 array sharing the buffer."""
+        numpy = _numpy()
+        return numpy.frombuffer(self._data, dtype=numpy.uint8,
+                count=self._tableSize(), offset=self.headerFormat.size)
+
+
+    def update(self, addresses):
+        """Add each Address of an iterable."""
+        for address in addresses:
+            self.add(address)
+
+
+    def __contains__(self, address):
+        try:
+            key = _packedKey(address)
+        except ValueError:
+            return False
+        return self._containsHash(*_filterHash(key))
+
+
+    def containsArray(self, values):
+        """Test each address of a V4_DTYPE or V6_DTYPE array (or AddressArray).
+
+        Returns:
+            A boolean array, True where an address may be in the filter.
+        """
+        numpy = _numpy()
+        h1, h2 = _filterHashArray(values)
+        return numpy.array([self._containsHash(int(a), int(b))
+                            for a, b in zip(h1, h2)], dtype=numpy.bool_)
+
+
+
+class BloomFilter(_AddressFilter):
+    """A Bloom filter of addresses.
+
+    Membership tests may report false positives at about errorRate when the
+    filter holds capacity addresses, but never false negatives.
+    """
+
+    magic = "JBLM"
+    headerFormat = struct.Struct("!4sBBxxQQ")
+    _byte = struct.Struct("B")
+
+
+    def __init__(self, capacity, errorRate=0.01):
+        """Build an empty filter.
+
+        Arguments:
+            capacity --  The number of addresses the filter is sized for.
+            errorRate --  The false-positive rate at capacity.
+        """
+        if capacity <= 0 or not 0 < errorRate < 1:
+            raise ValueError("Invalid BloomFilter size", capacity, errorRate)
+
+        bitCount = int(math.ceil(
+                -capacity * math.log(errorRate) / (math.log(2) ** 2)))
+        hashCount = max(1, int(round(bitCount * math.log(2) / capacity)))
+
+        self._loadHeader(hashCount, bitCount, 0)
+        self._data = bytearray(self.headerFormat.size + self._tableSize())
+        self._storeHeader()
+
+
+    def _loadHeader(self, hashCount, bitCount, count):
+        self.hashCount = hashCount
+        self.bitCount = bitCount
+        self.count = count
+
+
+    def _storeHeader(self):
+        self.headerFormat.pack_into(self._data, 0, self.magic, self.version,
+                self.hashCount, self.bitCount, self.count)
+
+
+    def _tableSize(self):
+        return (self.bitCount + 7) // 8
+
+
+    def _positions(self, h1, h2):
+        bitCount = self.bitCount
+        for i in xrange(self.hashCount):
+            yield ((h1 + i * h2) & _MASK64) % bitCount
+
+
+    def add(self, address):
+        """Add an Address (or address string) to the filter."""
+        self._addHash(*_filterHash(_packedKey(address)))
+        self.count += 1
+        self._storeHeader()
+
+
+    def _addHash(self, h1, h2):
+        data, byte, offset = self._data, self._byte, self.headerFormat.size
+        for pos in self._positions(h1, h2):
+            idx = offset + (pos >> 3)
+            byte.pack_into(data, idx,
+                           byte.unpack_from(data, idx)[0] | (1 << (pos & 7)))
+
+
+    def _containsHash(self, h1, h2):
+        data, byte, offset = self._data, self._byte, self.headerFormat.size
+        for pos in self._positions(h1, h2):
+            if not byte.unpack_from(data, offset + (pos >> 3))[0] & (
+                    1 << (pos & 7)):
+                return False
+        return True
+
+
+    def _arrayPositions(self, values):
+        numpy, u64 = _numpy(), _numpy().uint64
+        h1, h2 = _filterHashArray(values)
+        return [(h1 + u64(i) * h2) % u64(self.bitCount)
+                for i in xrange(self.hashCount)]
+
+
+    def addArray(self, values):
+        """Add each address of a V4_DTYPE or V6_DTYPE array (or AddressArray).
+        """
+        numpy = _numpy()
+        table = self._tableView()
+        for positions in self._arrayPositions(values):
+            masks = numpy.left_shift(1, positions & 7).astype(numpy.uint8)
+            numpy.bitwise_or.at(table, (positions >> 3).astype(numpy.intp),
+                                masks)
+        self.count += len(values)
+        self._storeHeader()
+
+
+    def containsArray(self, values):
+        """Test each address of a V4_DTYPE or V6_DTYPE array (or AddressArray).
+
+        Returns:
+            A boolean array, True where an address may be in the filter.
+        """
+        numpy = _numpy()
+        table = self._tableView()
+        found = numpy.ones(len(values), dtype=numpy.bool_)
+        for positions in self._arrayPositions(values):
+            masks = numpy.left_shift(1, positions & 7).astype(numpy.uint8)
+            found &= (table[(positions >> 3).astype(numpy.intp)] & masks) != 0
+        return found
+
+
+
+class CuckooFilter(_AddressFilter):
+    """A cuckoo filter of addresses, which supports removal.
+
+    Each address is represented by a fingerprint stored in one of two
+    buckets.  Membership tests may report false positives at about errorRate,
+    but never false negatives (unless an address that was never added is
+    removed).
+    """
+
+    magic = "JCKO"
+    headerFormat = struct.Struct("!4sBBBxQQ")
+
+    bucketSize = 4
+    maxKicks = 500
+    loadFactor = 0.95
+
+    _fingerprintFormats = {1: "B", 2: "H", 4: "I", }
+
+
+    def __init__(self, capacity, errorRate=0.01):
+        """Build an empty filter.
+
+        Arguments:
+            capacity --  The number of addresses the filter is sized for.
+            errorRate --  The false-positive rate.
+        """
+        if capacity <= 0 or not 0 < errorRate < 1:
+            raise ValueError("Invalid CuckooFilter size", capacity, errorRate)
+
+        bits = math.log(2.0 * self.bucketSize / errorRate, 2)
+        fingerprintSize = min(size for size in (1, 2, 4) if size * 8 >= bits
+                              ) if bits <= 32 else 4
+
+        bucketCount = 1
+        while bucketCount * self.bucketSize * self.loadFactor < capacity:
+            bucketCount <<= 1
+
+        self._loadHeader(fingerprintSize, self.bucketSize, bucketCount, 0)
+        self._data = bytearray(self.headerFormat.size + self._tableSize())
+        self._storeHeader()
+
+
+    def _loadHeader(self, fingerprintSize, bucketSize, bucketCount, count):
+        self.fingerprintSize = fingerprintSize
+        self.bucketSize = bucketSize
+        self.bucketCount = bucketCount
+        self.count = count
+        self._slot = struct.Struct(
+                "!" + self._fingerprintFormats[fingerprintSize])
+
+
+    def _storeHeader(self):
+        self.headerFormat.pack_into(self._data, 0, self.magic, self.version,
+                self.fingerprintSize, self.bucketSize, self.bucketCount,
+                self.count)
+
+
+    def _tableSize(self):
+        return self.bucketCount * self.bucketSize * self.fingerprintSize
+
+
+    def _locate(self, h1, h2):
+        """Return the fingerprint and bucket indexes of a hash."""
+        fingerprint = (h2 >> (64 - 8 * self.fingerprintSize)) or 1
+        mask = self.bucketCount - 1
+        first = h1 & mask
+        return fingerprint, first, self._alternate(first, fingerprint)
+
+
+    def _alternate(self, bucket, fingerprint):
+        return (bucket ^ _mix64(fingerprint)) & (self.bucketCount - 1)
+
+
+    def _offset(self, bucket, slot):
+        return self.headerFormat.size + (
+                bucket * self.bucketSize + slot) * self.fingerprintSize
+
+
+    def _get(self, bucket, slot):
+        return self._slot.unpack_from(self._data, self._offset(bucket, slot))[0]
+
+    def _set(self, bucket, slot, fingerprint):
+        self._slot.pack_into(self._data, self._offset(bucket, slot),
+                             fingerprint)
+
+
+    def _insert(self, bucket, fingerprint):
+        for slot in xrange(self.bucketSize):
+            if self._get(bucket, slot) == 0:
+                self._set(bucket, slot, fingerprint)
+                return True
+        return False
+
+
+    def add(self, address):
+        """Add an Address (or address string) to the filter.
+
+        Raises:
+            ValueError if the filter is full.  The filter is unchanged.
+        """
+        self._addHash(*_filterHash(_packedKey(address)))
+
+
+    def _addHash(self, h1, h2):
+        fingerprint, first, second = self._locate(h1, h2)
+        if not (self._insert(first, fingerprint)
+                or self._insert(second, fingerprint)):
+            self._relocate(random.choice((first, second)), fingerprint)
+        self.count += 1
+        self._storeHeader()
+
+
+    def _relocate(self, bucket, fingerprint):
+        """Evict fingerprints along a random path to make room."""
+        evictions = []
+        for kick in xrange(self.maxKicks):
+            slot = random.randrange(self.bucketSize)
+            evicted = self._get(bucket, slot)
+            self._set(bucket, slot, fingerprint)
+            evictions.append((bucket, slot, evicted))
+
+            fingerprint = evicted
+            bucket = self._alternate(bucket, fingerprint)
+            if self._insert(bucket, fingerprint):
+                return
+
+        for bucket, slot, evicted in reversed(evictions):
+            self._set(bucket, slot, evicted)
+        raise ValueError("CuckooFilter is full", self.count)
+
+
+    def addArray(self, values):
+        """Add each address of a V4_DTYPE or V6_DTYPE array (or AddressArray).
+
+        Raises:
+            ValueError if the filter becomes full.  Addresses preceding the
+            one that did not fit remain added.
+        """
+        for h1, h2 in zip(*_filterHashArray(values)):
+            self._addHash(int(h1), int(h2))
+
+
+    def _containsHash(self, h1, h2):
+        fingerprint, first, second = self._locate(h1, h2)
+        for bucket in (first, second):
+            for slot in xrange(self.bucketSize):
+                if self._get(bucket, slot) == fingerprint:
+                    return True
+        return False
+
+
+    def remove(self, address):
+        """Remove an Address (or address string) that was added.
+
+        Returns:
+            True if a matching fingerprint was removed.
+        """
+        try:
+            key = _packedKey(address)
+        except ValueError:
+            return False
+
+        fingerprint, first, second = self._locate(*_filterHash(key))
+        for bucket in (first, second):
+            for slot in xrange(self.bucketSize):
+                if self._get(bucket, slot) == fingerprint:
+                    self._set(bucket, slot, 0)
+                    self.count -= 1
+                    self._storeHeader()
+                    return True
+        return False
+
+
+
+def reverseName(address):
+    """Return the reverse-lookup (PTR) domain name of an Address."""
+    ip = _toAddress(address)
+    if ip.family == AF_INET:
+        labels = [str(ord(b)) for b in ip.toBytes()]
+        suffix = "in-addr.arpa"
+    else:
+        labels = list(binascii.hexlify(ip.toBytes()))
+        suffix = "ip6.arpa"
+    return ".".join(labels[::-1] + [suffix])
+
+
+
+class CachingResolver(object):
+    """Resolves names to Addresses asynchronously, with caching.
+
+    Answers are cached for their TTL, and failed lookups for negativeTTL
+    seconds.  Concurrent lookups of the same name share a single query.
+
+    Expired entries are replaced when they are looked up, and purged from the
+    cache when it has doubled in size since it was last purged (so that
+    purging costs O(1) per answer, amortized).
+
+    Attributes:
+        negativeTTL --  Seconds that failed lookups are cached for.
+        maxTTL --  An upper bound on the time answers are cached for.
+        minPurgeSize --  The size the cache may reach before it is purged.
+    """
+
+    negativeTTL = 60
+    maxTTL = 86400
+    minPurgeSize = 1024
+
+
+    def __init__(self, resolver=None, clock=None, negativeTTL=None):
+        """Build a resolver.
+
+        Arguments:
+            resolver --  A twisted.internet.interfaces.IResolver (e.g. from
+                         twisted.names.client or twisted.names.hosts).  If not
+                         specified, the system's configured resolver is used.
+            clock --  An IReactorTime.  Defaults to the reactor.
+            negativeTTL --  Overrides the class's negativeTTL.
+        """
+        if resolver is None:
+            from twisted.names.client import createResolver
+            resolver = createResolver()
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if negativeTTL is not None:
+            self.negativeTTL = negativeTTL
+
+        self.resolver = resolver
+        self.clock = clock
+        self._cache = {}
+        self._pending = {}
+        self._purgeSize = self.minPurgeSize
+
+
+    def resolve(self, name, family=None):
+        """Look up the addresses of a name.
+
+        Address literals resolve to themselves without a lookup.
+
+        Arguments:
+            name --  A host name.
+            family --  AF_INET or AF_INET6 to look up only addresses of that
+                       family; by default both are looked up.
+        Returns:
+            A Deferred that fires with a list of V4Addresses and V6Addresses,
+            IPv4 addresses first, or fails (e.g. with a
+            twisted.names.error.DomainError) if the name has no addresses.
+        """
+        from twisted.internet.defer import fail, succeed
+
+        try:
+            ip = IP(name)
+        except ValueError:
+            pass
+        else:
+            if family in (None, ip.family):
+                return succeed([ip])
+            return fail(ValueError("Address family mismatch", ip, family))
+
+        key = ("addresses", name.lower(), family)
+        return self._lookup(key, self._queryAddresses, name, family)
+
+
+    def reverse(self, address):
+        """Look up the name of an Address (or address string).
+
+        Returns:
+            A Deferred that fires with the name, or fails if there is none.
+        """
+        ip = _toAddress(address)
+        key = ("name", ip.toBytes(), None)
+        return self._lookup(key, self._queryName, ip)
+
+
+    def _lookup(self, key, query, *args):
+        from twisted.internet.defer import Deferred
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > self.clock.seconds():
+                return self._fire(result)
+            del self._cache[key]
+
+        waiter = Deferred()
+        if key in self._pending:
+            self._pending[key].append(waiter)
+        else:
+            self._pending[key] = [waiter]
+            d = query(*args)
+            d.addCallbacks(self._cb_answered, self._eb_failed)
+            d.addCallback(self._cb_cached, key)
+        return waiter
+
+
+    @staticmethod
+    def _fire(result):
+        from twisted.internet.defer import fail, succeed
+        from twisted.python.failure import Failure
+
+        if isinstance(result, Failure):
+            return fail(result)
+        return succeed(list(result) if isinstance(result, list) else result)
+
+
+    def _cb_answered(self, (result, ttl)):
+        return result, min(ttl, self.maxTTL)
+
+    def _eb_failed(self, reason):
+        return reason, self.negativeTTL
+
+
+    def _cb_cached(self, (result, ttl), key):
+        if len(self._cache) >= self._purgeSize:
+            self.purge()
+        if ttl > 0:
+            self._cache[key] = (self.clock.seconds() + ttl, result)
+
+        for waiter in self._pending.pop(key):
+            self._fire(result).chainDeferred(waiter)
+
+
+    def purge(self):
+        """Remove expired entries from the cache."""
+        now = self.clock.seconds()
+        for key, (expires, result) in self._cache.items():
+            if expires <= now:
+                del self._cache[key]
+        self._purgeSize = max(self.minPurgeSize, 2 * len(self._cache))
+
+
+    def _queryAddresses(self, name, family):
+        from twisted.internet.defer import DeferredList
+
+        lookups = []
+        if family in (None, AF_INET):
+            lookups.append(self.resolver.lookupAddress(name))
+        if family in (None, AF_INET6):
+            lookups.append(self.resolver.lookupIPV6Address(name))
+
+        d = DeferredList(lookups, consumeErrors=True)
+        d.addCallback(self._cb_addresses, name)
+        return d
+
+
+    def _cb_addresses(self, results, name):
+        from twisted.names import dns, error
+        from twisted.python.failure import Failure
+
+        addresses, ttls, failure = [], [], None
+        for success, result in results:
+            if not success:
+                failure = failure or result
+                continue
+            answers = result[0]
+            for rr in answers:
+                if rr.type == dns.A:
+                    addresses.append(V4Address(rr.payload.dottedQuad()))
+                elif rr.type == dns.AAAA:
+                    addresses.append(V6Address._fromPacked(rr.payload.address))
+                else:
+                    continue
+                ttls.append(rr.ttl)
+
+        if not addresses:
+            if failure is None:
+                failure = Failure(error.DomainError(name))
+            return failure
+        return addresses, min(ttls)
+
+
+    def _queryName(self, ip):
+        d = self.resolver.lookupPointer(reverseName(ip))
+        d.addCallback(self._cb_name, ip)
+        return d
+
+
+    def _cb_name(self, (answers, authority, additional), ip):
+        from twisted.names import dns, error
+        from twisted.python.failure import Failure
+
+        for rr in answers:
+            if rr.type == dns.PTR:
+                return str(rr.payload.name), rr.ttl
+        return Failure(error.DomainError(reverseName(ip)))
+
+
+
+def _prefixKey(address, v4Length, v6Length):
+    """Return a hashable key for the prefix of an Address.
+
+    The key is the family's bit count followed by the packed prefix bytes, so
+    prefixes of different families never collide.
+    """
+    ip = _toAddress(address)
+    length = v4Length if ip.family == AF_INET else v6Length
+    full, partial = divmod(length, 8)
+    key = chr(ip.bits) + ip.toBytes()[:full]
+    if partial:
+        mask = (0xff << (8 - partial)) & 0xff
+        key += chr(ord(ip.toBytes()[full]) & mask)
+    return key
+
+
+def _checkPrefixLengths(v4Length, v6Length):
+    if not 0 <= v4Length <= V4Address.bits:
+        raise ValueError("Invalid prefix length", v4Length, AF_INET)
+    if not 0 <= v6Length <= V6Address.bits:
+        raise ValueError("Invalid prefix length", v6Length, AF_INET6)
+
+
+
+class RateLimiter(object):
+    """A token-bucket rate limiter for clients, aggregated by prefix.
+
+    Each prefix's bucket holds up to `burst` tokens and refills at `rate`
+    tokens per second.  Buckets are refilled lazily when used, so no timers
+    are scheduled.  At most `maxKeys` buckets are kept; when there are more,
+    the least recently used buckets are discarded (i.e. refilled).
+
+    Attributes:
+        rate --  Tokens added to each bucket per second.
+        burst --  The capacity of each bucket.
+        v4Length --  The prefix length IPv4 clients are aggregated by.
+        v6Length --  The prefix length IPv6 clients are aggregated by.
+        maxKeys --  The maximum number of buckets to track.
+    """
+
+    def __init__(self, rate, burst, v4Length=32, v6Length=128,
+            maxKeys=65536, clock=None):
+        """Build a rate limiter.
+
+        Arguments:
+            rate --  Tokens per second, e.g. requests per second.
+            burst --  The capacity of each bucket.
+            v4Length, v6Length --  Prefix lengths to aggregate clients by (e.g.
+                                   24 and 64).  By default, each address is
+                                   limited separately.
+            maxKeys --  The maximum number of buckets to track.
+            clock --  An IReactorTime.  Defaults to the reactor.
+        Raises:
+            ValueError if a parameter is out of range.
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError("Rate and burst must be positive", rate, burst)
+        if maxKeys < 1:
+            raise ValueError("Invalid maxKeys", maxKeys)
+        _checkPrefixLengths(v4Length, v6Length)
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.v4Length = v4Length
+        self.v6Length = v6Length
+        self.maxKeys = maxKeys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+
+    def __len__(self):
+        """Return the number of buckets being tracked."""
+        return len(self._buckets)
+
+
+    def _refill(self, key):
+        """Return the refilled [tokens, timestamp] bucket for a key.
+
+        The bucket becomes the most recently used.
+        """
+        now = self.clock.seconds()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = [self.burst, now]
+        else:
+            elapsed = max(now - bucket[1], 0)
+            bucket[0] = min(self.burst, bucket[0] + elapsed * self.rate)
+            bucket[1] = now
+        self._buckets[key] = bucket
+        return bucket
+
+
+    def tokens(self, address):
+        """Return the number of tokens available to an address's prefix.
+
+        Unlike allow(), this does not make the bucket the most recently used.
+        """
+        key = _prefixKey(address, self.v4Length, self.v6Length)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        elapsed = max(self.clock.seconds() - bucket[1], 0)
+        return min(self.burst, bucket[0] + elapsed * self.rate)
+
+
+    def allow(self, address, cost=1):
+        """Consume tokens from an address's bucket if enough are available.
+
+        Arguments:
+            address --  An Address (or address string).
+            cost --  The number of tokens to consume.
+        Returns:
+            True if the tokens were consumed, False if the client is limited.
+        """
+        key = _prefixKey(address, self.v4Length, self.v6Length)
+        bucket = self._refill(key)
+        allowed = bucket[0] >= cost
+        if allowed:
+            bucket[0] -= cost
+
+        while len(self._buckets) > self.maxKeys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+
+    def purge(self):
+        """Discard buckets that have refilled completely.
+
+        Such buckets are indistinguishable from new ones, so this frees memory
+        without affecting limits.
+        """
+        now = self.clock.seconds()
+        for key, (tokens, stamp) in self._buckets.items():
+            if tokens + (now - stamp) * self.rate >= self.burst:
+                del self._buckets[key]
+
+
+
+class ConnectionTracker(object):
+    """Counts open connections per client prefix and enforces a maximum.
+
+    Prefixes are tracked only while they have open connections, so memory is
+    bounded by the number of open connections.
+    """
+
+    def __init__(self, maxConnections, v4Length=32, v6Length=128):
+        """Build a connection tracker.
+
+        Arguments:
+            maxConnections --  The number of connections allowed per prefix.
+            v4Length, v6Length --  Prefix lengths to aggregate clients by.
+        Raises:
+            ValueError if a parameter is out of range.
+        """
+        if maxConnections < 1:
+            raise ValueError("Invalid maxConnections", maxConnections)
+        _checkPrefixLengths(v4Length, v6Length)
+
+        self.maxConnections = maxConnections
+        self.v4Length = v4Length
+        self.v6Length = v6Length
+        self._counts = {}
+
+
+    def __len__(self):
+        """Return the number of prefixes with open connections."""
+        return len(self._counts)
+
+
+    def count(self, address):
+        """Return the number of connections open from an address's prefix."""
+        key = _prefixKey(address, self.v4Length, self.v6Length)
+        return self._counts.get(key, 0)
+
+
+    def open(self, address):
+        """Record a connection from an address, if it is allowed.
+
+        Returns:
+            True if the connection was recorded, False if the prefix already
+            has maxConnections open.  Only recorded connections should be
+            close()d.
+        """
+        key = _prefixKey(address, self.v4Length, self.v6Length)
+        count = self._counts.get(key, 0)
+        if count >= self.maxConnections:
+            return False
+        self._counts[key] = count + 1
+        return True
+
+
+    def close(self, address):
+        """Record that a connection from an address has closed.
+
+        Raises:
+            ValueError if no connections are open from the address's prefix.
+        """
+        key = _prefixKey(address, self.v4Length, self.v6Length)
+        count = self._counts.get(key, 0)
+        if count < 1:
+            raise ValueError("No open connections", str(address))
+        if count == 1:
+            del self._counts[key]
+        else:
+            self._counts[key] = count - 1
+
+
+
+__version__ = """$Revision: 74 $"""[11:-2]
+__author__ = """Oliver Gould <ver@yahoo-inc.com>"""
+__copyright__ = """Copyright Yahoo!, Inc (2010).  All rights reserved."""
+
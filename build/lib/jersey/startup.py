@@ -0,0 +1,210 @@
+"""Startup-time profiling for jersey programs.
+
+A process-wide StartupProfiler records how long each startup phase takes
+(importing, option parsing, plugin loading, starting services, ...) and, when
+its import hook is installed, how long each module takes to import.
+
+Imports happen before command-line options are parsed, so jersey.cli enables
+the profiler when it is imported if startup profiling was requested (i.e. by
+--startup-profile among the options in sys.argv, before any sub-command, or
+by JERSEY_STARTUP_PROFILE in the environment).
+"""
+
+import __builtin__, os, sys, time
+
+from contextlib import contextmanager
+
+
+FLAG = "--startup-profile"
+ENVIRONMENT_VARIABLE = "JERSEY_STARTUP_PROFILE"
+
+
+def requested(argv=None, environ=None):
+    """Determine whether startup profiling was requested.
+
+    Only the options preceding the first argument (e.g. a sub-command) are
+    considered, since the flag belongs to the program's own options.
+    """
+    if argv is None:
+        argv = sys.argv
+    if environ is None:
+        environ = os.environ
+    for arg in argv[1:]:
+        if arg == FLAG:
+            return True
+        if arg == "--" or not arg.startswith("-"):
+            break
+    return bool(environ.get(ENVIRONMENT_VARIABLE))
+
+
+
+class StartupProfiler(object):
+    """Records the wall time spent in startup phases and module imports.
+
+    Phases are only recorded once the profiler is enabled, so long-running
+    programs that were not asked for a report do not accumulate them; the
+    import hook is only installed on request.
+
+    Attributes:
+        started --  When the profiler was created.
+        enabled --  Whether a report has been requested.
+        phases --  A list of (name, start, end) phase timings.
+        imports --  A dict mapping module names to (selfTime, totalTime).
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.enabled = False
+        self.phases = []
+        self.imports = {}
+        self._open = {}
+        self._stack = []
+        self._import = None
+
+
+    def enable(self):
+        """Request a report of the profile."""
+        self.enabled = True
+
+
+    def record(self, name, start, end=None):
+        """Record a phase that started at start and ends now (or at end).
+
+        Nothing is recorded unless the profiler is enabled.
+        """
+        if not self.enabled:
+            return
+        if end is None:
+            end = self.clock()
+        self.phases.append((name, start, end))
+
+
+    def begin(self, name):
+        """Mark the beginning of a phase."""
+        self._open[name] = self.clock()
+
+    def end(self, name):
+        """Mark the end of a phase that was begun.
+
+        Phases that were not begun are ignored.
+        """
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.record(name, start)
+
+
+    @contextmanager
+    def phase(self, name):
+        """A context manager that records a phase."""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+
+    def installImportHook(self):
+        """Time the import of each module from now on."""
+        if self._import is None:
+            self._import = __builtin__.__import__
+            __builtin__.__import__ = self._timedImport
+
+    def removeImportHook(self):
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+
+    def _timedImport(self, name, globals=None, locals=None, fromlist=None,
+            level=-1):
+        package = self._package(globals)
+        moduleName = name
+        if level > 0:
+            # Explicitly relative, i.e. `from . import name`.
+            parts = package.split(".")
+            base = ".".join(parts[:len(parts) - (level - 1)])
+            moduleName = ".".join(filter(None, [base, name]))
+
+        submodules = ["{0}.{1}".format(moduleName, attr)
+                      for attr in (fromlist or ()) if attr != "*"]
+        submodules = [m for m in submodules if m not in sys.modules]
+        loaded = len(sys.modules)
+
+        self._stack.append(0.0)
+        start = self.clock()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+
+        finally:
+            elapsed = self.clock() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+
+            # Only imports that loaded modules are interesting.
+            if len(sys.modules) != loaded:
+                self._recordImport(package, moduleName, submodules, level,
+                                   elapsed - nested, elapsed)
+
+
+    @staticmethod
+    def _package(globals):
+        """Return the name of the package an import was performed in."""
+        globals = globals or {}
+        package = globals.get("__package__")
+        if not package:
+            package = globals.get("__name__") or ""
+            if "__path__" not in globals:
+                package = package.rpartition(".")[0]
+        return package
+
+
+    def _recordImport(self, package, name, submodules, level, selfTime,
+            totalTime):
+        # Attribute `from package import module` to the module.
+        submodules = [m for m in submodules if sys.modules.get(m) is not None]
+        if len(submodules) == 1:
+            name = submodules[0]
+
+        elif level < 0 and package and name not in sys.modules:
+            # Implicitly relative (Python 2), e.g. `import log` within jersey.
+            qualified = "{0}.{1}".format(package, name)
+            if sys.modules.get(qualified) is not None:
+                name = qualified
+
+        oldSelf, oldTotal = self.imports.get(name, (0.0, 0.0))
+        self.imports[name] = (oldSelf + selfTime, oldTotal + totalTime)
+
+
+    def report(self, out, limit=20):
+        """Write phase and import timings, most expensive first.
+
+        Arguments:
+            out --  A file to write the report to.
+            limit --  The number of imports to report.
+        """
+        total = self.clock() - self.started
+        out.write("Startup profile: {0:.1f} ms\n".format(total * 1000))
+
+        phases = sorted(self.phases, key=lambda (n, s, e): s - e)
+        out.write("\n{0:<40} {1:>10} {2:>10}\n".format(
+                "Phase", "ms", "at ms"))
+        for name, start, end in phases:
+            out.write("{0:<40} {1:>10.1f} {2:>10.1f}\n".format(name,
+                    (end - start) * 1000, (start - self.started) * 1000))
+
+        if self.imports:
+            imports = sorted(self.imports.iteritems(),
+                             key=lambda (n, (s, t)): (-s, n))
+            out.write("\n{0:<40} {1:>10} {2:>10}\n".format(
+                    "Import", "self ms", "total ms"))
+            for name, (selfTime, totalTime) in imports[:limit]:
+                out.write("{0:<40} {1:>10.1f} {2:>10.1f}\n".format(name,
+                        selfTime * 1000, totalTime * 1000))
+            if len(imports) > limit:
+                out.write("({0} more imports)\n".format(len(imports) - limit))
+
+
+
+profiler = StartupProfiler()
@@ -1,8 +1,12 @@
 import os, sys
+from StringIO import StringIO
 
+from twisted.application.service import Service
 from twisted.python import reflect
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks
+from twisted.internet.defer import (Deferred, DeferredList, gatherResults,
+        inlineCallbacks, returnValue)
+from twisted.internet.task import Clock, Cooperator
 from twisted.trial.unittest import TestCase
 
 from jersey import cli, log
@@ -67,6 +71,74 @@ class OptionsCase(ProgramTestBase, TestCase):
             self.assertRaises(usage.error, cli.Options.parseIP, badIp)
 
 
+    def test_parseEndpoint(self):
+        from twisted.python import usage
+        endpoint = cli.Options.parseEndpoint("[::1]:8080")
+        self.assertEquals(("::1", 8080), (str(endpoint.address), endpoint.port))
+        for bad in ("10.0.0.1", "::1:80", "host:80", "10.0.0.1:http"):
+            self.assertRaises(usage.error, cli.Options.parseEndpoint, bad)
+
+
+
+class ImportCase(TestCase):
+
+    script = """\
+import sys
+from jersey import cli
+options = cli.PluggableOptions("prog")
+options.parseOptions([])
+options.getUsage()
+print " ".join(m for m in sys.argv[1:] if m in sys.modules)
+"""
+
+    # Modules that are only imported when they are used.
+    deferredModules = [
+        "twisted.internet.reactor",
+        "twisted.internet.task",
+        "twisted.internet.protocol",
+        "twisted.internet.threads",
+        "twisted.python.threadpool",
+        ]
+
+    inetScript = """\
+import sys
+from jersey import inet
+inet.Endpoint.parse("127.0.0.1:80")
+inet.CachingResolver
+print " ".join(m for m in sys.argv[1:] if m in sys.modules)
+"""
+
+    # Modules that jersey.inet only imports when they are used.
+    inetDeferredModules = [
+        "twisted.internet.reactor",
+        "twisted.internet.defer",
+        "twisted.internet.address",
+        "twisted.python.failure",
+        ]
+
+    def _importedModules(self, script, modules):
+        import subprocess
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, "-c", script] + modules,
+                                   stdout=subprocess.PIPE, env=env)
+        output = process.communicate()[0]
+        self.assertEquals(0, process.returncode)
+        return output.split()
+
+
+    def test_reactorNotImported(self):
+        """Option parsing and usage output do not install the reactor, or
+        import modules that only some commands use."""
+        self.assertEquals([], self._importedModules(self.script,
+                                                    self.deferredModules))
+
+
+    def test_inet(self):
+        """Addresses can be used without importing Twisted's Deferreds."""
+        self.assertEquals([], self._importedModules(self.inetScript,
+                                                    self.inetDeferredModules))
+
+
 
 class TestCommandRunnerBase(object):
 
@@ -212,6 +284,262 @@ class CommandCases(ConfigTestBase, TestCase):
 
 
 
+class OrderedService(Service):
+
+    def __init__(self, name, events, dependencies=(), started=None):
+        self.setName(name)
+        self.events = events
+        self.dependencies = dependencies
+        self.started = started
+
+    def startService(self):
+        Service.startService(self)
+        self.events.append(("start", self.name))
+        return self.started
+
+    def stopService(self):
+        Service.stopService(self)
+        self.events.append(("stop", self.name))
+
+
+
+class ServiceStartupCases(ConfigTestBase, TestCase):
+
+    def setUp(self):
+        ConfigTestBase.setUp(self)
+        self.events = []
+        self.command = SensorCommand(self.config)
+        self.command.clock = self.clock = Clock()
+
+
+    def addService(self, name, dependencies=(), started=None):
+        svc = OrderedService(name, self.events, dependencies, started)
+        svc.setServiceParent(self.command)
+        return svc
+
+
+    def test_waves(self):
+        db = Deferred()
+        self.addService("warmer", ["db", "cache"])
+        self.addService("db", started=db)
+        self.addService("cache")
+        self.addService("web", ["warmer"])
+
+        self.assertEquals([["db", "cache"], ["warmer"], ["web"]],
+                [[svc.name for svc in wave]
+                 for wave in self.command.startupWaves()])
+
+        self.command.startService()
+        self.assertEquals([("start", "db"), ("start", "cache")], self.events)
+        self.assertFalse(self.command.executed)
+
+        self.clock.advance(2)
+        db.callback(None)
+        self.assertEquals(["db", "cache", "warmer", "web"],
+                          [name for event, name in self.events])
+        self.assertTrue(self.command.executed)
+        self.assertEquals([("db", 0, 2.0), ("cache", 0, 0.0),
+                           ("warmer", 1, 0.0), ("web", 2, 0.0)],
+                          sorted(self.command.startupTimes,
+                                 key=lambda (n, w, s): (w, -s)))
+        self.assertIn("wave 0: db (2.000s)", self.command.startupReport())
+
+        del self.events[:]
+        self.command.stopService()
+        self.assertEquals(["web", "warmer", "cache", "db"],
+                          [name for event, name in self.events])
+
+
+    def test_invalidDependencies(self):
+        self.addService("a", ["b"])
+        self.assertRaises(ValueError, self.command.startupWaves)
+        self.addService("b", ["a"])
+        self.assertRaises(ValueError, self.command.startupWaves)
+
+
+    def test_stringDependencies(self):
+        self.addService("db")
+        self.addService("web", "db")
+        self.assertRaises(TypeError, self.command.startupWaves)
+
+
+    def test_timeout(self):
+        self.command.serviceStartTimeout = 5
+        self.addService("db", started=Deferred())
+        self.addService("web", ["db"])
+
+        self.command.startService()
+        self.clock.advance(5)
+        self.assertEquals([("start", "db")], self.events)
+        self.assertFalse(self.command.executed)
+        self.assertEquals(1, len(self.flushLoggedErrors(cli.ServiceStartTimeout)))
+        return self.assertFailure(self.command.exit, cli.ServiceStartTimeout)
+
+
+    def test_serviceTimeout(self):
+        self.command.serviceStartTimeout = 5
+        svc = self.addService("db", started=Deferred())
+        svc.startTimeout = 10
+
+        self.command.startService()
+        self.clock.advance(5)
+        svc.started.callback(None)
+        self.assertTrue(self.command.executed)
+        self.assertEquals([], self.clock.getDelayedCalls())
+
+
+
+class FanOutCommand(cli.FanOutCommand):
+
+    def __init__(self, config, count):
+        cli.FanOutCommand.__init__(self, config)
+        self.count = count
+        self.pulled = []
+        self.pending = {}
+        self.results = []
+        self.errors = []
+        self.reports = []
+
+    def workItems(self):
+        for item in xrange(self.count):
+            self.pulled.append(item)
+            yield item
+
+    def process(self, item):
+        self.pending[item] = Deferred()
+        return self.pending[item]
+
+    def resultReceived(self, item, result):
+        self.results.append((item, result))
+
+    def errorReceived(self, item, reason):
+        self.errors.append((item, reason.value))
+
+    def reportProgress(self, progress):
+        self.reports.append(str(progress))
+
+
+
+class FanOutCommandCases(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.config = {}
+
+
+    def buildCommand(self, count, **kw):
+        command = FanOutCommand(self.config, count)
+        command.clock = self.clock
+        command.cooperator = Cooperator(
+                scheduler=lambda f: self.clock.callLater(0, f))
+        for name, value in kw.iteritems():
+            setattr(command, name, value)
+        return command
+
+
+    def runCommand(self, command):
+        self.exits = []
+        command.startService()
+        command.exit.addBoth(self.exits.append)
+        self.clock.advance(0)
+
+
+    def finish(self, command, item, error=None):
+        d = command.pending.pop(item)
+        if error is None:
+            d.callback(item * 10)
+        else:
+            d.errback(error)
+        self.clock.advance(0)
+
+
+    def test_concurrency(self):
+        command = self.buildCommand(5, concurrency=2)
+        self.runCommand(command)
+        self.assertEquals([0, 1], command.pulled)
+        self.assertEquals(2, command.progress.active)
+
+        self.finish(command, 1)
+        self.assertEquals([(1, 10)], command.results)
+        self.assertEquals([0, 1, 2], command.pulled)
+
+        for item in (0, 2, 3, 4):
+            self.finish(command, item)
+        self.assertEquals([1, 0, 2, 3, 4], [i for i, r in command.results])
+        self.assertEquals([None], self.exits)
+        self.assertEquals(5, command.progress.completed)
+
+
+    def test_options(self):
+        self.config["concurrency"] = 3
+        command = self.buildCommand(5, concurrency=2)
+        self.runCommand(command)
+        self.assertEquals([0, 1, 2], command.pulled)
+
+
+    def test_collectErrors(self):
+        command = self.buildCommand(3, concurrency=1)
+        self.runCommand(command)
+        self.finish(command, 0, ExoticException("0"))
+        self.finish(command, 1)
+        self.finish(command, 2, ExoticException("2"))
+
+        self.assertEquals([(1, 10)], command.results)
+        self.assertEquals(["0", "2"], [str(e) for i, e in command.errors])
+        [reason] = self.exits
+        reason.trap(cli.FanOutError)
+        self.assertEquals([0, 2], [i for i, f in reason.value.failures])
+        self.assertEquals("2 of 3 work items failed", str(reason.value))
+
+
+    def test_failFast(self):
+        command = self.buildCommand(10, concurrency=2)
+        self.config["fail-fast"] = True
+        self.runCommand(command)
+        self.finish(command, 0, ExoticException("0"))
+        self.assertEquals([0, 1], command.pulled)
+        self.assertEquals([], self.exits)
+
+        self.finish(command, 1)
+        self.assertEquals([0, 1], command.pulled)
+        [reason] = self.exits
+        reason.trap(ExoticException)
+
+
+    def test_progress(self):
+        command = self.buildCommand(3, concurrency=3, progressInterval=1.0)
+        self.runCommand(command)
+        self.clock.advance(1)
+        self.finish(command, 0)
+        self.clock.advance(1)
+        self.finish(command, 1)
+        self.finish(command, 2)
+        self.assertEquals([
+                "0 done (0 failed), 3 active in 1.0s (0.0/s)",
+                "1 done (0 failed), 2 active in 2.0s (0.5/s)",
+                "3 done (0 failed), 0 active in 2.0s (1.5/s)",
+                ], command.reports)
+        self.assertEquals(0, len(self.clock.getDelayedCalls()))
+
+
+    def test_empty(self):
+        command = self.buildCommand(0)
+        self.runCommand(command)
+        self.assertEquals([None], self.exits)
+
+
+    def test_invalidConcurrency(self):
+        class FanOutOptions(cli.FanOutOptionsMixin, cli.Options):
+            pass
+        options = FanOutOptions(self.id())
+        self.assertRaises(cli.UsageError, options.parseOptions,
+                          ["--concurrency", "0"])
+        options.parseOptions(["--concurrency", "4", "--fail-fast"])
+        self.assertEquals(4, options["concurrency"])
+        self.assertTrue(options["fail-fast"])
+
+
+
 class CommandRunnerCases(RunnerTestBase, TestCase):
 
     commandClass = SensorCommand
@@ -271,6 +599,132 @@ class CommandRunnerExitCases(RunnerTestBase, TestCase):
         self.assertEquals(self.runner.exitValue, os.EX_OK)
 
 
+class StartupProfileCases(RunnerTestBase, TestCase):
+
+    class optionsClass(cli.StartupProfileMixin, cli.Options):
+        pass
+
+    class runnerClass(TestCommandRunnerBase, cli.CommandRunner):
+        pass
+
+
+    def setUp(self):
+        RunnerTestBase.setUp(self)
+        from jersey import startup
+        self.profiler = startup.StartupProfiler()
+        self.patch(startup, "profiler", self.profiler)
+        self.stderr = StringIO()
+        self.patch(sys, "stderr", self.stderr)
+
+
+    def test_disabled(self):
+        self.config.parseOptions([])
+        self.assertFalse(self.config["startup-profile"])
+        self.buildRunner(SensorCommand(self.config)).run()
+
+        self.assertEquals([], self.profiler.phases)
+        self.assertEquals("", self.stderr.getvalue())
+
+
+    def test_report(self):
+        self.config.parseOptions(["--startup-profile"])
+        self.assertTrue(self.profiler.enabled)
+        self.buildRunner(SensorCommand(self.config)).run()
+
+        report = self.stderr.getvalue()
+        self.assertTrue(report.startswith("Startup profile: "))
+        for phase in ("option parsing", "createOrGetApplication",
+                      "startService"):
+            self.assertIn(phase, report)
+
+
+
+class ReactorSelectionCases(RunnerTestBase, TestCase):
+
+    class optionsClass(cli.ReactorSelectionMixin, cli.Options):
+        pass
+
+    class runnerClass(TestCommandRunnerBase, cli.CommandRunner):
+        installed = False
+
+        def reactorInstalled(self):
+            return self.installed
+
+
+    def setUp(self):
+        RunnerTestBase.setUp(self)
+        self.runner = self.buildRunner(SensorCommand(self.config))
+        self.available = set(["poll", "select"])
+        self.attempts = []
+        self.patch(cli, "installReactor", self.installReactor)
+
+
+    def installReactor(self, name):
+        self.attempts.append(name)
+        if name not in self.available:
+            raise ImportError(name)
+
+
+    def test_option(self):
+        self.assertEquals(None, self.config.get("reactor"))
+        self.config.parseOptions(["--reactor", "poll"])
+        self.assertEquals("poll", self.config["reactor"])
+
+        from twisted.python import usage
+        self.assertRaises(usage.UsageError, self.buildOptions().parseOptions,
+                          ["--reactor", "bogus"])
+
+
+    def test_preference(self):
+        self.assertEquals("poll", self.runner.installReactor())
+        self.assertEquals(["epoll", "kqueue", "poll"], self.attempts)
+
+
+    def test_requested(self):
+        self.config.parseOptions(["--reactor", "select"])
+        self.assertEquals("select", self.runner.installReactor())
+        self.assertEquals(["select"], self.attempts)
+
+
+    def test_fallback(self):
+        self.config.parseOptions(["--reactor", "kqueue"])
+        self.assertEquals("poll", self.runner.installReactor())
+        self.assertEquals(["kqueue", "epoll", "poll"], self.attempts)
+
+
+    def test_unavailable(self):
+        self.available = set()
+        self.assertRaises(ValueError, self.runner.installReactor)
+        self.assertEquals(list(self.runner.reactorPreference), self.attempts)
+
+
+    def test_alreadyInstalled(self):
+        self.runner.installed = True
+        self.runner.preApplication()
+        self.assertEquals([], self.attempts)
+
+
+    def test_install(self):
+        """The runner installs the selected reactor in a fresh process."""
+        import subprocess
+        script = "\n".join([
+            "from jersey import cli",
+            "class Options(cli.ReactorSelectionMixin, cli.Options): pass",
+            "config = Options('prog')",
+            "config.parseOptions(['--reactor', 'poll'])",
+            "cli.CommandRunner('prog', config, None).preApplication()",
+            "from twisted.internet import reactor",
+            "print reactor.__class__.__name__",
+            ])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, "-c", script],
+                                   stdout=subprocess.PIPE, env=env)
+        output = process.communicate()[0]
+        self.assertEquals(0, process.returncode)
+        self.assertEquals("PollReactor", output.strip())
+
+
+
 class PluggableTestBase(ProgramTestBase):
 
     commandPackageName = "animal_command_plugins"
@@ -407,6 +861,155 @@ class PluggableOptionsCase(PluggableTestBase, TestCase):
 
 
 
+class CommandIndexCase(PluggableTestBase, TestCase):
+
+    class optionsClass(cli.PluggableOptions):
+        longdesc = ""
+        commandIndex = True
+
+
+    def setUp(self):
+        self.program = self.id()
+        self._purgeModules()
+        self.installPlugins()
+        self.options = self.buildOptions()
+        self.package = self.options.commandPackage
+        self.pluginDir = os.path.dirname(self.package.__file__)
+
+
+    def tearDown(self):
+        sys.path = self._sys_path
+        self._purgeModules()
+
+
+    def _purgeModules(self):
+        for name in list(sys.modules):
+            if name.split(".")[0] == self.commandPackageName:
+                del sys.modules[name]
+
+
+    def _loadedPlugins(self):
+        prefix = self.commandPackageName + "."
+        # Python 2 leaves None placeholders for failed relative imports.
+        return sorted(name[len(prefix):] for name, module in sys.modules.items()
+                      if name.startswith(prefix) and module is not None)
+
+
+    def _index(self):
+        return cli.CommandIndex(self.package, cli.ICommandFactory)
+
+
+    def test_commands(self):
+        commands = dict((c.name, c) for c in self._index().commands())
+        self.assertEquals(["frog", "monkey"], sorted(commands))
+        self.assertEquals("m", commands["monkey"].shortcut)
+        self.assertEquals("My name is Bingo!", commands["monkey"].description)
+        self.assertEquals(self.commandPackageName + ".monkey",
+                          commands["monkey"].module)
+        self.assertTrue(os.path.exists(
+                os.path.join(self.pluginDir, cli.CommandIndex.indexName)))
+
+
+    def test_mode(self):
+        umask = os.umask(022)
+        try:
+            self._index().commands()
+        finally:
+            os.umask(umask)
+        path = os.path.join(self.pluginDir, cli.CommandIndex.indexName)
+        self.assertEquals(0644, os.stat(path).st_mode & 0777)
+
+
+    def test_cached(self):
+        self._index().commands()
+        self._purgeModules()
+        __import__(self.commandPackageName)
+
+        commands = self._index().commands()
+        self.assertEquals(2, len(commands))
+        self.assertEquals([], self._loadedPlugins())
+
+
+    def test_selectedImport(self):
+        self._index().commands()
+        self._purgeModules()
+        self.options = self.buildOptions()
+
+        monkey = self.options.getCommand("monkey")
+        self.assertEquals([], self._loadedPlugins())
+
+        command = monkey.buildCommand(monkey.options())
+        self.assertEquals(["monkey"], self._loadedPlugins())
+        self.assertImplements(cli.ICommand, command)
+
+
+    def test_lazyOptions(self):
+        self._index().commands()
+        for name in ("monkey", "frog"):
+            self._purgeModules()
+            options = self.buildOptions()
+            options.parseOptions([name])
+            self.assertEquals([name], self._loadedPlugins())
+            self.assertEquals(name, options.subCommand)
+
+        self._purgeModules()
+        options = self.buildOptions()
+        options.parseOptions(["m", "--nana"])
+        self.assertTrue(options.subOptions["nana"])
+        self.assertIdentical(options, options.subOptions.parent)
+
+
+    def test_usage(self):
+        self._index().commands()
+        self._purgeModules()
+        usage = self.buildOptions().getUsage()
+        self.assertIn("My name is Bingo!", usage)
+        self.assertIn("Quoi?", usage)
+        self.assertEquals([], self._loadedPlugins())
+
+
+    def test_stale(self):
+        self._index().commands()
+        path = os.path.join(self.pluginDir, "frog.py")
+        with open(path, "w") as frog:
+            frog.write(self.plugins["frog"].replace("Quoi?", "Ribbit?"))
+        os.unlink(os.path.join(self.pluginDir, "monkey.py"))
+        for compiled in ("monkey.pyc", "frog.pyc"):
+            if os.path.exists(os.path.join(self.pluginDir, compiled)):
+                os.unlink(os.path.join(self.pluginDir, compiled))
+        self._purgeModules()
+        __import__(self.commandPackageName)
+
+        commands = self._index().commands()
+        self.assertEquals([("frog", "Ribbit?")],
+                          [(c.name, c.description) for c in commands])
+
+
+    def test_corrupt(self):
+        with open(os.path.join(self.pluginDir, cli.CommandIndex.indexName),
+                  "w") as index:
+            index.write("{not json")
+        self.assertEquals(2, len(self._index().commands()))
+
+
+    def test_getPlugins(self):
+        self.options.commandIndex = False
+        self.assertEquals("monkey", self.options.getCommand("monkey").name)
+        self.assertFalse(os.path.exists(
+                os.path.join(self.pluginDir, cli.CommandIndex.indexName)))
+
+
+    def test_default(self):
+        options = PluggableTestBase.optionsClass(self.program)
+        options.commandPackage = self.package
+        monkey = options.getCommand("monkey")
+        self.assertNotIsInstance(monkey, cli.IndexedCommand)
+        self.assertEquals(["frog", "monkey"], self._loadedPlugins())
+        self.assertFalse(os.path.exists(
+                os.path.join(self.pluginDir, cli.CommandIndex.indexName)))
+
+
+
 class PluggableRunnerCase(PluggableTestBase, RunnerTestBase, TestCase):
 
     class optionsClass(cli.PluggableOptions):
@@ -467,6 +1070,221 @@ class PluggableRunnerCase(PluggableTestBase, RunnerTestBase, TestCase):
 
 
 
+class BatchCommandCase(PluggableTestBase, TestCase):
+
+    plugins = dict(PluggableTestBase.plugins, status="""\
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.plugin import IPlugin
+from zope.interface import implements
+from jersey.cli import CommandFactory, Command, Options
+
+running = []
+peak = []
+
+class StatusOptions(Options):
+    optParameters = [("delay", "d", 0.0, "Seconds to wait.", float), ]
+
+    def parseArgs(self, status):
+        self["status"] = int(status)
+
+class StatusCommand(Command):
+    def execute(self):
+        running.append(self)
+        peak.append(len(running))
+        d = deferLater(reactor, self.config["delay"], lambda: None)
+        d.addCallback(lambda _: running.remove(self))
+        d.addCallback(lambda _: self.config["status"])
+        return d
+
+class StatusPlugin(CommandFactory):
+    implements(IPlugin)
+    command = StatusCommand
+    options = StatusOptions
+
+    name = "status"
+    shortcut = "s"
+    description = "Exits with a status."
+
+statusPlugin = StatusPlugin()
+""")
+
+    class runnerClass(TestCommandRunnerBase, cli.BatchCommandRunner):
+        pass
+
+
+    def setUp(self):
+        self.program = self.id()
+        self.installPlugins()
+        self.report = StringIO()
+        self.plugin = reflect.namedModule(self.commandPackageName + ".status")
+        del self.plugin.peak[:]
+
+
+    def tearDown(self):
+        sys.path = self._sys_path
+
+
+    def _buildOptions(self, program):
+        return PluggableTestBase.buildOptions(self)
+
+
+    def runBatch(self, lines, *args):
+        config = cli.BatchOptions(self.program)
+        config.parseOptions(list(args))
+        runner = self.runner = self.runnerClass(self.program, config,
+                                                self._buildOptions)
+        command = runner.buildCommand()
+        command.stdin = StringIO("\n".join(lines))
+        command.stdout = self.report
+        d = command.startService()
+        d.addCallback(lambda _: command.exit)
+        return d
+
+
+    def test_statuses(self):
+        lines = ["monkey", "", "# comment", "s 0", "status 3", "frog --nana",
+                 "status 'four'", "s 5"]
+        d = self.runBatch(lines)
+
+        def cb_check(status):
+            self.assertEquals(1, status)
+            self.assertEquals([
+                    "1\tmonkey", "0\ts 0", "3\tstatus 3",
+                    "{0}\tfrog --nana".format(os.EX_USAGE),
+                    "{0}\tstatus 'four'".format(os.EX_USAGE),
+                    "5\ts 5",
+                    ], self.report.getvalue().splitlines())
+        d.addCallback(cb_check)
+        return d
+
+
+    def test_ordered(self):
+        lines = ["s -d 0.05 1", "s 0", "s -d 0.02 2", "s 0"]
+        d = self.runBatch(lines, "--concurrency", "2")
+
+        def cb_check(status):
+            self.assertEquals(1, status)
+            self.assertEquals(["1\ts -d 0.05 1", "0\ts 0", "2\ts -d 0.02 2",
+                               "0\ts 0"], self.report.getvalue().splitlines())
+            self.assertEquals(2, max(self.plugin.peak))
+        d.addCallback(cb_check)
+        return d
+
+
+    def test_serial(self):
+        d = self.runBatch(["s -d 0.01 0"] * 3)
+
+        def cb_check(status):
+            self.assertEquals(os.EX_OK, status)
+            self.assertEquals([1, 1, 1], self.plugin.peak)
+        d.addCallback(cb_check)
+        return d
+
+
+    def test_isolated(self):
+        """Lines that exit or fail to load don't stop the batch."""
+        def buildOptions(argv, buildOptions=self.runnerClass.buildOptions):
+            if argv == ["explode"]:
+                raise ImportError("No module named explode")
+            return buildOptions(self.runner, argv)
+        self.patch(self.runnerClass, "buildOptions",
+                   lambda runner, argv: buildOptions(argv))
+        self.patch(sys, "stdout", StringIO())
+
+        d = self.runBatch(["s --help", "explode", "s 2", "s 0"],
+                          "--concurrency", "2")
+
+        def cb_check(status):
+            self.assertEquals(os.EX_SOFTWARE, status)
+            self.assertEquals(["0\ts --help",
+                               "{0}\texplode".format(os.EX_SOFTWARE),
+                               "2\ts 2", "0\ts 0"],
+                              self.report.getvalue().splitlines())
+            self.assertEquals(1, len(self.flushLoggedErrors(ImportError)))
+        d.addCallback(cb_check)
+        return d
+
+
+    def test_invalidConcurrency(self):
+        config = cli.BatchOptions(self.program)
+        self.assertRaises(cli.UsageError, config.parseOptions, ["-c", "0"])
+
+
+
+class ScanCommandCases(ConfigTestBase, TestCase):
+
+    optionsClass = cli.ScanOptions
+
+    log = "\n".join([
+        "10.0.1.20 - - [12:34:56] GET / from [2001:470:1f06:2b8::2]:80",
+        "10.0.1.20:8080 ::ffff:10.0.1.21. 999.1.1.1 10.0.1.20.5",
+        ])
+
+
+    def setUp(self):
+        ConfigTestBase.setUp(self)
+        self.path = self.mktemp()
+        with open(self.path, "w") as f:
+            f.write(self.log)
+
+
+    def execute(self, *args):
+        self.config.parseOptions(list(args) + [self.path])
+        cmd = cli.ScanCommand(self.config)
+        cmd.out = StringIO()
+        cmd._execute()
+        return cmd.exit.addCallback(lambda _: cmd.out.getvalue().splitlines())
+
+
+    @inlineCallbacks
+    def test_scan(self):
+        addrs = yield self.execute()
+        self.assertEquals(["10.0.1.20", "2001:470:1f06:2b8::2", "10.0.1.20",
+                           "::ffff:10.0.1.21"], addrs)
+
+    @inlineCallbacks
+    def test_scan_unique(self):
+        addrs = yield self.execute("--unique", "--processes=2")
+        self.assertEquals(["10.0.1.20", "2001:470:1f06:2b8::2",
+                           "::ffff:10.0.1.21"], addrs)
+
+    @inlineCallbacks
+    def test_scan_family(self):
+        addrs = yield self.execute("--family=6")
+        self.assertEquals(["2001:470:1f06:2b8::2", "::ffff:10.0.1.21"], addrs)
+
+    @inlineCallbacks
+    def test_scan_thread(self):
+        import threading
+        threads = []
+        def scanFile(path, **kw):
+            threads.append(threading.current_thread())
+            return []
+        self.patch(cli, "scanFile", scanFile)
+
+        addrs = yield self.execute()
+        self.assertEquals([], addrs)
+        self.assertNotIdentical(threading.current_thread(), threads[0])
+
+
+    def test_family_error(self):
+        self.assertRaises(cli.UsageError, self.config.parseOptions,
+                          ["--family=5", self.path])
+
+    def test_stdin_default(self):
+        self.config.parseOptions([])
+        self.assertEquals(("-", ), self.config["paths"])
+
+
+    def test_factory(self):
+        factory = cli.ScanCommandFactory()
+        self.assertImplements(cli.ICommandFactory, factory)
+        self.assertIsInstance(factory.buildCommand(self.config),
+                              cli.ScanCommand)
+
+
+
 class _FakeObserver(object):
 
     def __init__(self):
@@ -514,3 +1332,602 @@ class LoggerCases(ProgramTestBase, TestCase):
         self.assertEquals(log.DEBUG, event.get("logLevel"))
 
 
+
+class CommandDaemonCase(PluggableTestBase, TestCase):
+
+    timeout = 30
+
+    commandPackageName = "daemon_command_plugins"
+
+    plugins = {
+    "__init__": "",
+
+    "echo": """\
+import os, sys
+from twisted.plugin import IPlugin
+from zope.interface import implements
+from jersey.cli import CommandFactory, Command, Options
+
+class EchoOptions(Options):
+    def parseArgs(self, status="0"):
+        self["status"] = int(status)
+
+class EchoCommand(Command):
+    def execute(self):
+        sys.stdout.write(sys.stdin.read().upper())
+        sys.stderr.write("{0} {1}\\n".format(os.getcwd(),
+                                              os.environ.get("ECHO")))
+        return self.config["status"]
+
+class EchoPlugin(CommandFactory):
+    implements(IPlugin)
+    command = EchoCommand
+    options = EchoOptions
+    name = "echo"
+    shortcut = "e"
+    description = "Echo stdin in upper case."
+
+echoPlugin = EchoPlugin()
+""",
+
+    "fail": """\
+from twisted.plugin import IPlugin
+from zope.interface import implements
+from jersey.cli import CommandFactory, Command, Options
+
+class FailCommand(Command):
+    def execute(self):
+        raise RuntimeError("Failed")
+
+class FailPlugin(CommandFactory):
+    implements(IPlugin)
+    command = FailCommand
+    options = Options
+    name = "fail"
+    shortcut = None
+    description = "Fail."
+
+failPlugin = FailPlugin()
+""",
+    }
+
+    script = """\
+import sys
+from twisted.python import reflect
+from jersey import cli
+
+path, package = sys.argv[1:]
+
+class Runner(cli.PluggableCommandRunner):
+    class loggerFactory(object):
+        def __init__(self, config):
+            pass
+        def start(self, application):
+            pass
+        def stop(self):
+            pass
+
+def buildOptions(program):
+    options = cli.PluggableOptions(program)
+    options.commandPackage = reflect.namedModule(package)
+    options.commandIndex = True
+    return options
+
+cli.CommandDaemon(path, buildOptions, Runner, "animals").serve()
+"""
+
+
+    def setUp(self):
+        import subprocess, tempfile, time
+
+        self.program = self.id()
+        self.installPlugins()
+        self.socketDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.socketDir, "daemon.sock")
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.daemon = subprocess.Popen(
+                [sys.executable, "-c", self.script, self.path,
+                 self.commandPackageName], env=env)
+
+        deadline = time.time() + 20
+        while not os.path.exists(self.path):
+            if self.daemon.poll() is not None or time.time() > deadline:
+                self.fail("Daemon did not start")
+            time.sleep(0.05)
+
+
+    def tearDown(self):
+        import shutil, signal
+        sys.path = self._sys_path
+        if self.daemon.poll() is None:
+            os.kill(self.daemon.pid, signal.SIGTERM)
+        self.daemon.wait()
+        shutil.rmtree(self.socketDir)
+
+
+    def forward(self, argv, stdin="", env=None):
+        stdout, stderr = StringIO(), StringIO()
+        status = cli.forwardCommand(self.path, argv, env=env or {},
+                cwd=self.socketDir, stdin=StringIO(stdin),
+                stdout=stdout, stderr=stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+
+    def test_stdio(self):
+        status, out, err = self.forward(["echo"], "eep! eep!\n",
+                                        {"ECHO": "ribbit"})
+        self.assertEquals(0, status)
+        self.assertEquals("EEP! EEP!\n", out)
+        self.assertEquals("{0} ribbit\n".format(self.socketDir), err)
+
+
+    def test_stdinFile(self):
+        path = self.mktemp()
+        with open(path, "w") as f:
+            f.write("x" * 100000)
+        with open(path) as stdin:
+            stdout = StringIO()
+            status = cli.forwardCommand(self.path, ["e"], stdin=stdin,
+                    stdout=stdout, stderr=StringIO())
+        self.assertEquals(0, status)
+        self.assertEquals("X" * 100000, stdout.getvalue())
+
+
+    def test_exitValue(self):
+        self.assertEquals(3, self.forward(["echo", "3"])[0])
+
+
+    def test_isolation(self):
+        status, out, err = self.forward(["fail"])
+        self.assertEquals(os.EX_SOFTWARE, status)
+
+        # The daemon still serves requests.
+        self.assertEquals(0, self.forward(["echo"])[0])
+        self.assertEquals(None, self.daemon.poll())
+
+
+    def test_usageError(self):
+        status, out, err = self.forward(["donkey"])
+        self.assertEquals(os.EX_USAGE, status)
+        self.assertIn("donkey", err)
+
+
+    def test_stop(self):
+        import signal
+        os.kill(self.daemon.pid, signal.SIGTERM)
+        self.assertEquals(0, self.daemon.wait())
+        self.assertFalse(os.path.exists(self.path))
+
+
+    def test_reactorImported(self):
+        import subprocess
+        path = os.path.join(self.socketDir, "reactor.sock")
+        pluginDir = os.path.join(sys.path[-1], self.commandPackageName)
+        with open(os.path.join(pluginDir, "reactor.py"), "w") as f:
+            f.write("from twisted.internet import reactor\n")
+            f.write(self.plugins["fail"].replace('"fail"', '"reactor"'))
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        daemon = subprocess.Popen(
+                [sys.executable, "-c", self.script, path,
+                 self.commandPackageName], env=env, stderr=subprocess.PIPE)
+        err = daemon.communicate()[1]
+        self.assertNotEquals(0, daemon.returncode)
+        self.assertIn("RuntimeError", err)
+        self.assertIn(self.commandPackageName, err)
+        self.assertFalse(os.path.exists(path))
+
+
+
+def square(n):
+    return n * n
+
+def raiseValueError(message):
+    raise ValueError(message)
+
+def raiseUnpicklable():
+    class LocalError(Exception):
+        pass
+    raise LocalError("local")
+
+
+
+class ProcessPoolServiceCase(TestCase):
+
+    def setUp(self):
+        self.pool = cli.ProcessPoolService(size=2)
+        self.pool.startService()
+
+
+    def tearDown(self):
+        if self.pool.running:
+            return self.pool.stopService()
+
+
+    def test_submit(self):
+        d = gatherResults([self.pool.submit(square, n) for n in xrange(10)])
+        d.addCallback(self.assertEquals, [n * n for n in xrange(10)])
+        return d
+
+
+    def test_failure(self):
+        d = self.pool.submit(raiseValueError, "bad")
+        d = self.assertFailure(d, ValueError)
+        d.addCallback(lambda e: self.assertEquals(("bad", ), e.args))
+        return d
+
+
+    def test_unpicklableException(self):
+        d = self.pool.submit(raiseUnpicklable)
+        d = self.assertFailure(d, cli.ProcessPoolError)
+        d.addCallback(lambda e: self.assertIn("LocalError: local", str(e)))
+        return d
+
+
+    def test_unpicklable(self):
+        return self.assertFailure(self.pool.submit(lambda: None), Exception)
+
+
+    def test_recycle(self):
+        self.pool.stopService()
+        self.pool = cli.ProcessPoolService(size=1, maxTasksPerWorker=2)
+        self.pool.startService()
+
+        @inlineCallbacks
+        def pids():
+            result = []
+            for i in xrange(4):
+                pid = yield self.pool.submit(os.getpid)
+                result.append(pid)
+            returnValue(result)
+
+        def cb_check(pids):
+            self.assertEquals(pids[0], pids[1])
+            self.assertEquals(pids[2], pids[3])
+            self.assertNotEquals(pids[1], pids[2])
+            self.assertNotIn(os.getpid(), pids)
+        return pids().addCallback(cb_check)
+
+
+    @inlineCallbacks
+    def test_workerExited(self):
+        yield self.assertFailure(self.pool.submit(os._exit, 3),
+                                 cli.ProcessPoolError)
+        self.flushLoggedErrors()
+        result = yield self.pool.submit(square, 3)
+        self.assertEquals(9, result)
+        self.assertEquals(2, len(self.pool._workers))
+
+
+    @inlineCallbacks
+    def test_idleWorkerExited(self):
+        import signal
+        worker = list(self.pool._workers)[0]
+        os.kill(worker.transport.pid, signal.SIGKILL)
+        yield worker.ended
+
+        self.assertEquals(2, len(self.pool._workers))
+        self.assertNotIn(worker, self.pool._workers)
+        results = yield gatherResults([self.pool.submit(square, n)
+                                       for n in xrange(4)])
+        self.assertEquals([0, 1, 4, 9], results)
+
+
+    @inlineCallbacks
+    def test_stop(self):
+        running = self.pool.submit(square, 2)
+        queued = [self.pool.submit(square, 3) for i in xrange(3)]
+        yield self.pool.stopService()
+
+        result = yield running
+        self.assertEquals(4, result)
+        for d in queued[1:]:
+            yield self.assertFailure(d, cli.ProcessPoolError)
+        self.assertEquals(set(), self.pool._workers)
+        yield self.assertFailure(self.pool.submit(square, 2),
+                                 cli.ProcessPoolError)
+
+
+    def test_size(self):
+        self.assertRaises(ValueError, cli.ProcessPoolService, size=0)
+        self.assertTrue(cli.ProcessPoolService().size >= 1)
+
+
+
+class ThreadPoolServiceCase(TestCase):
+
+    def setUp(self):
+        self.service = cli.ThreadPoolService("test-pool", maxThreads=1,
+                                             slowWait=0.01)
+        self.service.startService()
+        self.warnings = []
+        log.addObserver(self._observe)
+
+
+    def tearDown(self):
+        log.removeObserver(self._observe)
+        if self.service.running:
+            return self.service.stopService()
+
+
+    def _observe(self, event):
+        if event.get("logLevel") == log.WARN:
+            self.warnings.append(log.textFromEventDict(event))
+
+
+    @inlineCallbacks
+    def test_submit(self):
+        result = yield self.service.submit(square, 4)
+        self.assertEquals(16, result)
+        yield self.assertFailure(self.service.submit(raiseValueError, "bad"),
+                                 ValueError)
+        self.assertEquals((0, 0, 1, 1),
+                (self.service.waiting, self.service.active,
+                 self.service.completed, self.service.failed))
+        self.assertEquals([], self.warnings)
+
+
+    @inlineCallbacks
+    def test_slowWait(self):
+        import threading
+        release = threading.Event()
+        blocked = self.service.submit(release.wait)
+        waiting = self.service.submit(square, 2)
+        self.assertEquals(2, self.service.waiting)
+
+        started = Deferred()
+        reactor.callLater(0.05, started.callback, None)
+        yield started
+        self.assertEquals((1, 1), (self.service.waiting, self.service.active))
+
+        release.set()
+        yield blocked
+        result = yield waiting
+        self.assertEquals(4, result)
+        self.assertTrue(self.service.maxWaitTime >= 0.05)
+        self.assertEquals(1, len(self.warnings))
+        self.assertIn("test-pool: <function square", self.warnings[0])
+        self.assertIn("2 completed", str(self.service))
+
+
+    @inlineCallbacks
+    def test_cancelled(self):
+        import threading
+        from twisted.internet.defer import CancelledError
+        release = threading.Event()
+        blocked = self.service.submit(release.wait)
+        waiting = self.service.submit(square, 2)
+        waiting.cancel()
+        yield self.assertFailure(waiting, CancelledError)
+
+        release.set()
+        yield blocked
+        ran = Deferred()
+        reactor.callLater(0.05, ran.callback, None)
+        yield ran
+        self.assertEquals((0, 0, 1, 1),
+                (self.service.waiting, self.service.active,
+                 self.service.completed, self.service.failed))
+
+
+    @inlineCallbacks
+    def test_stop(self):
+        d = self.service.submit(square, 3)
+        yield self.service.stopService()
+        result = yield d
+        self.assertEquals(9, result)
+        self.assertFalse([t for t in self.service.pool.threads
+                          if t.isAlive()])
+        yield self.assertFailure(self.service.submit(square, 3), ValueError)
+
+
+    def test_size(self):
+        self.assertRaises(ValueError, cli.ThreadPoolService, "p", maxThreads=0)
+        self.assertRaises(ValueError, cli.ThreadPoolService, "p", 2, 1)
+
+
+
+class PreforkCase(PluggableTestBase, TestCase):
+
+    timeout = 60
+
+    commandPackageName = "prefork_command_plugins"
+
+    plugins = {
+    "__init__": "",
+
+    "serve": """\
+import os
+from twisted.internet.protocol import Protocol, ServerFactory
+from twisted.plugin import IPlugin
+from zope.interface import implements
+from jersey.cli import CommandFactory, ServerCommand, Options
+
+class PidProtocol(Protocol):
+    def connectionMade(self):
+        self.transport.write("{0}\\n".format(os.getpid()))
+        self.transport.loseConnection()
+
+class ServeCommand(ServerCommand):
+    def buildFactory(self):
+        return ServerFactory.forProtocol(PidProtocol)
+
+class ServePlugin(CommandFactory):
+    implements(IPlugin)
+    command = ServeCommand
+    options = Options
+
+    name = "serve"
+    shortcut = "s"
+    description = "Serves its pid."
+
+servePlugin = ServePlugin()
+""",
+
+    "broken": """\
+from twisted.plugin import IPlugin
+from zope.interface import implements
+from jersey.cli import CommandFactory, ServerCommand, Options
+
+class BrokenCommand(ServerCommand):
+    def buildFactory(self):
+        raise RuntimeError("Broken")
+
+class BrokenPlugin(CommandFactory):
+    implements(IPlugin)
+    command = BrokenCommand
+    options = Options
+
+    name = "broken"
+    shortcut = "b"
+    description = "Fails to start."
+
+brokenPlugin = BrokenPlugin()
+""",
+    }
+
+    script = """\
+import sys
+from twisted.python import reflect
+from jersey import cli
+
+portPath, package = sys.argv[1:3]
+
+class Options(cli.PreforkOptionsMixin, cli.PluggableOptions):
+    commandPackage = reflect.namedModule(package)
+
+class Supervisor(cli.PreforkSupervisor):
+    minUptime = 5.0
+    maxStartFailures = 3
+
+    def listen(self):
+        sock = cli.PreforkSupervisor.listen(self)
+        with open(portPath + ".tmp", "w") as f:
+            f.write(str(self.boundEndpoint().port))
+        os.rename(portPath + ".tmp", portPath)
+        return sock
+
+class Runner(cli.PreforkCommandRunner):
+    supervisorFactory = Supervisor
+
+    class loggerFactory(object):
+        def __init__(self, config):
+            pass
+        def start(self, application):
+            pass
+        def stop(self):
+            pass
+
+import os
+config = Options("prefork")
+config.parseOptions(sys.argv[3:])
+runner = Runner("prefork", config)
+runner.run()
+sys.exit(runner.exitValue)
+"""
+
+
+    def setUp(self):
+        self.program = self.id()
+        self.installPlugins()
+        self.portPath = os.path.abspath(self.mktemp())
+        self.supervisor = None
+
+
+    def tearDown(self):
+        import signal
+        sys.path = self._sys_path
+        if self.supervisor is not None and self.supervisor.poll() is None:
+            os.kill(self.supervisor.pid, signal.SIGTERM)
+            self.supervisor.wait()
+
+
+    def startSupervisor(self, *argv):
+        import subprocess, time
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.supervisor = subprocess.Popen(
+                [sys.executable, "-c", self.script, self.portPath,
+                 self.commandPackageName, "--listen", "127.0.0.1:0"]
+                + list(argv), env=env)
+
+        deadline = time.time() + 20
+        while not os.path.exists(self.portPath):
+            if self.supervisor.poll() is not None or time.time() > deadline:
+                self.fail("Supervisor did not start")
+            time.sleep(0.05)
+        with open(self.portPath) as f:
+            self.port = int(f.read())
+
+
+    def connect(self):
+        """Return the pid of the worker that accepted a connection."""
+        import socket
+        connection = socket.create_connection(("127.0.0.1", self.port), 10)
+        try:
+            return int(connection.makefile().readline())
+        finally:
+            connection.close()
+
+
+    def waitForPids(self, predicate, tries=200):
+        """Connect until the set of recently seen worker pids satisfies
+        predicate, and return it."""
+        import time
+        pids = []
+        for i in xrange(tries):
+            pids.append(self.connect())
+            if predicate(set(pids[-20:])):
+                return set(pids[-20:])
+            time.sleep(0.02)
+        self.fail("Unexpected worker pids: {0!r}".format(set(pids[-20:])))
+
+
+    def test_serve(self):
+        self.startSupervisor("--workers", "2", "serve")
+        pids = self.waitForPids(lambda pids: len(pids) == 2)
+        self.assertNotIn(self.supervisor.pid, pids)
+
+
+    def test_restartCrashed(self):
+        import signal
+        self.startSupervisor("--workers", "1", "serve")
+        pid = self.connect()
+        os.kill(pid, signal.SIGKILL)
+        self.waitForPids(lambda pids: pid not in pids)
+        self.assertEquals(None, self.supervisor.poll())
+
+
+    def test_rollingRestart(self):
+        import signal
+        self.startSupervisor("--workers", "2", "serve")
+        old = self.waitForPids(lambda pids: len(pids) == 2)
+        os.kill(self.supervisor.pid, signal.SIGHUP)
+        new = self.waitForPids(lambda pids: len(pids) == 2 and not pids & old)
+        self.assertEquals(None, self.supervisor.poll())
+
+
+    def test_stop(self):
+        import signal, socket
+        self.startSupervisor("--workers", "2", "serve")
+        self.connect()
+        os.kill(self.supervisor.pid, signal.SIGTERM)
+        self.assertEquals(0, self.supervisor.wait())
+        self.assertRaises(socket.error, self.connect)
+
+
+    def test_exitValue(self):
+        self.startSupervisor("--workers", "2", "broken")
+        self.assertEquals(os.EX_SOFTWARE, self.supervisor.wait())
+
+
+    def test_options(self):
+        class Options(cli.PreforkOptionsMixin, cli.Options):
+            pass
+        options = Options(self.program)
+        self.assertRaises(cli.UsageError, options.parseOptions, [])
+        self.assertRaises(cli.UsageError, options.parseOptions,
+                          ["--listen", "127.0.0.1:8080", "--workers", "0"])
+        options.parseOptions(["-l", "[::1]:8080", "-w", "3"])
+        self.assertEquals(3, options["workers"])
+        self.assertEquals(8080, options["listen"].port)
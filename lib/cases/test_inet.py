@@ -1,12 +1,18 @@
 """Test cases for jersey.inet"""
 
-import socket
+import mmap, os, socket
+from StringIO import StringIO
 
 from twisted.python import log
-from twisted.trial.unittest import TestCase
+from twisted.trial.unittest import SkipTest, TestCase
 
 from jersey import inet
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class AddressTestCase(TestCase):
 
@@ -231,3 +237,1276 @@ class AddressTestCase(TestCase):
         self.assertNotEquals(inet.V4Address("0.0.0.1"), inet.V6Address("::1"))
 
 
+    def test_toInt(self):
+        self.assertEquals(0x0a000114, inet.V4Address(self.v4Addr).toInt())
+        self.assertEquals(0xffff0a000114, inet.V6Address(self.v6v4Addr).toInt())
+
+    def test_fromInt(self):
+        self.assertEquals(self.v4Addr, inet.V4Address.fromInt(0x0a000114))
+        self.assertEquals(self.v6v4Addr, inet.V6Address.fromInt(0xffff0a000114))
+        ip = inet.V6Address(self.v6Addr)
+        self.assertEquals(ip, inet.V6Address.fromInt(ip.toInt()))
+
+    def test_fromInt_error(self):
+        self.assertRaises(ValueError, inet.V4Address.fromInt, -1)
+        self.assertRaises(ValueError, inet.V4Address.fromInt, 1 << 32)
+        self.assertRaises(ValueError, inet.V6Address.fromInt, 1 << 128)
+
+
+    def test_V6Address_toV4(self):
+        ip = inet.V6Address(self.v6v4Addr)
+        self.assertTrue(ip.isV4Mapped())
+        self.assertEquals(inet.V4Address(self.v4Addr), ip.toV4())
+        self.assertEquals(ip, inet.V4Address(self.v4Addr).toV6())
+
+    def test_V6Address_toV4_error(self):
+        ip = inet.V6Address(self.v6Addr)
+        self.assertFalse(ip.isV4Mapped())
+        self.assertRaises(ValueError, ip.toV4)
+
+
+
+class AddressPoolTestCase(TestCase):
+
+    def test_intern(self):
+        pool = inet.AddressPool()
+        ip = pool.intern("10.0.1.20")
+        self.assertIdentical(ip, pool.intern(inet.IP("10.0.1.20")))
+        self.assertIdentical(ip, pool.fromBytes("\x0a\x00\x01\x14"))
+        self.assertEquals(inet.IP("10.0.1.20"), ip)
+
+        v6 = pool.intern("2001:db8::1")
+        self.assertIsInstance(v6, inet.V6Address)
+        self.assertIdentical(v6, pool.fromBytes(v6.toBytes()))
+        self.assertEquals(2, len(pool))
+        self.assertIn("2001:db8::1", pool)
+        self.assertNotIn("2001:db8::2", pool)
+
+
+    def test_weak(self):
+        import gc
+        pool = inet.AddressPool()
+        pool.intern("10.0.1.20")
+        gc.collect()
+        self.assertEquals(0, len(pool))
+
+
+    def test_mapped(self):
+        pool = inet.AddressPool()
+        self.assertIsInstance(pool.intern("::ffff:10.0.1.20"), inet.V6Address)
+
+        pool = inet.AddressPool(foldMapped=True)
+        ip = pool.intern("10.0.1.20")
+        self.assertIdentical(ip, pool.intern("::ffff:10.0.1.20"))
+        mapped = pool.fromBytes(inet.IP("::ffff:10.0.1.21").toBytes())
+        self.assertEquals(inet.IP("10.0.1.21"), mapped)
+        self.assertIsInstance(mapped, inet.V4Address)
+
+
+    def test_invalid(self):
+        pool = inet.AddressPool()
+        self.assertRaises(ValueError, pool.intern, "10.0.1")
+        self.assertRaises(ValueError, pool.fromBytes, "\0" * 5)
+        self.assertRaises(ValueError, pool.fromBytes, None)
+        self.assertNotIn("bogus", pool)
+
+
+    def test_hash(self):
+        ip = inet.IP("10.0.1.20")
+        self.assertEquals(hash("10.0.1.20"), hash(ip))
+        self.assertEquals(hash(ip), hash(inet.IP("10.0.1.20") + 0))
+        self.assertEquals(inet.IP("10.0.1.20"), {"10.0.1.20": ip}[ip])
+
+
+
+class EndpointTestCase(TestCase):
+
+    def test_v4(self):
+        endpoint = inet.Endpoint("10.0.1.20", 80)
+        self.assertEquals(inet.AF_INET, endpoint.family)
+        self.assertEquals("10.0.1.20:80", str(endpoint))
+        self.assertEquals(("10.0.1.20", 80), endpoint.sockaddr())
+        self.assertIdentical(str(endpoint), str(endpoint))
+        self.assertEquals("Endpoint('10.0.1.20', 80)", repr(endpoint))
+
+
+    def test_v6(self):
+        endpoint = inet.Endpoint(inet.IP("2001:db8::2"), "443")
+        self.assertEquals(inet.AF_INET6, endpoint.family)
+        self.assertEquals("[2001:db8::2]:443", str(endpoint))
+        self.assertEquals(("2001:db8::2", 443, 0, 0), endpoint.sockaddr())
+
+
+    def test_parse(self):
+        for text in ("10.0.1.20:0", "[2001:db8::2]:65535", "[::ffff:1.2.3.4]:1"):
+            self.assertEquals(text, str(inet.Endpoint.parse(text)))
+
+        for bad in ("10.0.1.20", "10.0.1.20:", "10.0.1.20:http",
+                    "2001:db8::2:80", "[10.0.1.20]:80", "10.0.1.20:65536",
+                    "localhost:80"):
+            self.assertRaises(ValueError, inet.Endpoint.parse, bad)
+
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, inet.Endpoint, "10.0.1.20", -1)
+        self.assertRaises(ValueError, inet.Endpoint, "10.0.1.20", None)
+        self.assertRaises(ValueError, inet.Endpoint, "10.0.1", 80)
+
+
+    def test_slots(self):
+        endpoint = inet.Endpoint("10.0.1.20", 80)
+        self.assertRaises(AttributeError, setattr, endpoint, "other", 1)
+
+
+    def test_hash(self):
+        endpoints = set([inet.Endpoint("10.0.1.20", 80),
+                         inet.Endpoint(inet.IP("10.0.1.20"), "80"),
+                         inet.Endpoint("10.0.1.20", 81),
+                         inet.Endpoint("::ffff:10.0.1.20", 80)])
+        self.assertEquals(3, len(endpoints))
+        self.assertNotEquals(inet.Endpoint("10.0.1.20", 80), "10.0.1.20:80")
+
+
+    def test_twisted(self):
+        from twisted.internet.address import IPv4Address, IPv6Address
+
+        endpoint = inet.Endpoint("10.0.1.20", 80)
+        self.assertEquals(IPv4Address("TCP", "10.0.1.20", 80),
+                          endpoint.toTwisted())
+        self.assertEquals(IPv6Address("UDP", "::1", 53),
+                          inet.Endpoint("::1", 53).toTwisted("UDP"))
+        self.assertEquals(endpoint,
+                          inet.Endpoint.fromTwisted(endpoint.toTwisted()))
+
+
+
+class PrefixTestCase(TestCase):
+
+    def test_parse(self):
+        prefix = inet.Prefix("10.0.0.0/8")
+        self.assertEquals(inet.V4Address("10.0.0.0"), prefix.network)
+        self.assertEquals(8, prefix.length)
+        self.assertEquals(inet.AF_INET, prefix.family)
+        self.assertEquals("10.0.0.0/8", str(prefix))
+        self.assertEquals("Prefix('10.0.0.0/8')", repr(prefix))
+
+    def test_networkAndLength(self):
+        prefix = inet.Prefix(inet.IP("2001:470::"), 32)
+        self.assertEquals(inet.Prefix("2001:470::/32"), prefix)
+        self.assertEquals("2001:470::/32", prefix)
+        self.assertEquals(hash("2001:470::/32"), hash(prefix))
+
+    def test_errors(self):
+        for bad in ("10.0.0.0", "10.0.0.0/33", "10.0.0.0/x", "dog/8",
+                    "10.0.0.1/8", "::1/64"):
+            self.assertRaises(ValueError, inet.Prefix, bad)
+
+    def test_bounds(self):
+        prefix = inet.Prefix("10.0.1.0/24")
+        self.assertEquals("10.0.1.0", prefix.first())
+        self.assertEquals("10.0.1.255", prefix.last())
+        self.assertEquals("::ffff:ffff", inet.Prefix("::/96").last())
+
+    def test_contains(self):
+        prefix = inet.Prefix("10.0.1.0/24")
+        self.assertIn("10.0.1.20", prefix)
+        self.assertIn(inet.IP("10.0.1.255"), prefix)
+        self.assertNotIn("10.0.2.0", prefix)
+        self.assertNotIn("::ffff:10.0.1.20", prefix)
+        self.assertNotIn("dog", prefix)
+        self.assertIn("::1", inet.Prefix("::/0"))
+
+
+
+class AddressRangeTestCase(TestCase):
+
+    def test_arithmetic(self):
+        ip = inet.IP("10.0.0.255")
+        self.assertEquals(inet.IP("10.0.1.0"), ip + 1)
+        self.assertEquals(inet.IP("10.0.1.0"), 1 + ip)
+        self.assertEquals(inet.IP("10.0.0.0"), ip - 255)
+        self.assertEquals(255, ip - inet.IP("10.0.0.0"))
+        self.assertEquals(-1, inet.IP("::") - inet.IP("::1"))
+        self.assertEquals(inet.IP("::1:0"), inet.IP("::ffff") + 1L)
+
+        self.assertEquals(inet.IP("10.0.1.0"), ip.successor())
+        self.assertEquals(inet.IP("10.0.0.254"), ip.predecessor())
+        self.assertRaises(ValueError, inet.IP("0.0.0.0").predecessor)
+        self.assertRaises(ValueError, inet.IP("255.255.255.255").successor)
+        self.assertRaises(ValueError, lambda: ip - inet.IP("::1"))
+        self.assertRaises(TypeError, lambda: ip + "1")
+
+
+    def test_range(self):
+        addresses = inet.AddressRange("10.0.0.254", inet.IP("10.0.1.1"))
+        self.assertEquals(inet.AF_INET, addresses.family)
+        self.assertEquals(4, len(addresses))
+        self.assertEquals(["10.0.0.254", "10.0.0.255", "10.0.1.0", "10.0.1.1"],
+                          map(str, addresses))
+        self.assertEquals(inet.IP("10.0.0.255"), addresses[1])
+        self.assertEquals(inet.IP("10.0.1.1"), addresses[-1])
+        self.assertEquals(inet.IP("10.0.0.254"), addresses.start)
+        self.assertEquals(inet.IP("10.0.1.1"), addresses.end)
+        self.assertRaises(IndexError, addresses.__getitem__, 4)
+        self.assertRaises(IndexError, addresses.__getitem__, -5)
+        self.assertEquals("AddressRange('10.0.0.254', '10.0.1.1')",
+                          repr(addresses))
+
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, inet.AddressRange, "10.0.0.2", "10.0.0.1")
+        self.assertRaises(ValueError, inet.AddressRange, "10.0.0.1", "::1")
+        self.assertRaises(ValueError, inet.AddressRange, "10.0.0", "10.0.0.1")
+
+
+    def test_large(self):
+        addresses = inet.AddressRange("::", "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff")
+        self.assertEquals(1 << 128, addresses.size())
+        self.assertTrue(addresses)
+        self.assertEquals(inet.IP("::1:0"), addresses[0x10000])
+        self.assertEquals(inet.IP("ffff:ffff:ffff:ffff:ffff:ffff:ffff:fffe"),
+                          addresses[-2])
+        self.assertIn("2001:db8::1", addresses)
+        self.assertEquals(0x20010db8 << 96 | 1, addresses.index("2001:db8::1"))
+
+
+    def test_slice(self):
+        addresses = inet.Prefix("10.0.0.0/24").addresses()
+        self.assertEquals(inet.AddressRange("10.0.0.10", "10.0.0.19"),
+                          addresses[10:20])
+        self.assertEquals(inet.AddressRange("10.0.0.250", "10.0.0.255"),
+                          addresses[-6:])
+        self.assertEquals(inet.AddressRange("10.0.0.0", "10.0.0.255"),
+                          addresses[-1000:1000])
+        self.assertEquals(["10.0.0.12", "10.0.0.13"],
+                          map(str, addresses[10:20][2:4]))
+
+        empty = addresses[20:10]
+        self.assertEquals(0, len(empty))
+        self.assertFalse(empty)
+        self.assertEquals([], list(empty))
+        self.assertEquals(addresses[5:5], empty)
+        self.assertEquals("AddressRange()", repr(empty))
+        self.assertRaises(IndexError, getattr, empty, "start")
+        self.assertRaises(ValueError, addresses.__getitem__, slice(0, 10, 2))
+
+
+    def test_contains(self):
+        addresses = inet.AddressRange("10.0.0.10", "10.0.0.20")
+        self.assertIn("10.0.0.10", addresses)
+        self.assertIn(inet.IP("10.0.0.20"), addresses)
+        self.assertNotIn("10.0.0.21", addresses)
+        self.assertNotIn("::ffff:10.0.0.15", addresses)
+        self.assertNotIn("bogus", addresses)
+        self.assertEquals(5, addresses.index("10.0.0.15"))
+        self.assertRaises(ValueError, addresses.index, "10.0.0.9")
+
+
+    def test_chunks(self):
+        addresses = inet.AddressRange("10.0.0.0", "10.0.0.9")
+        chunks = list(addresses.chunks(4))
+        self.assertEquals([4, 4, 2], map(len, chunks))
+        self.assertEquals(list(addresses), [ip for c in chunks for ip in c])
+        self.assertEquals([addresses], list(addresses.chunks(100)))
+        self.assertRaises(ValueError, addresses.chunks, 0)
+
+
+    def test_hash(self):
+        self.assertEquals(1, len(set([
+                inet.AddressRange("10.0.0.0", "10.0.0.255"),
+                inet.Prefix("10.0.0.0/24").addresses()])))
+        self.assertNotEquals(inet.AddressRange("::", "::1"),
+                             inet.AddressRange("0.0.0.0", "0.0.0.1"))
+
+
+    def test_rangeSet(self):
+        ranges = inet.IPRangeSet([inet.AddressRange("10.0.0.1", "10.0.0.5"),
+                                  inet.AddressRange("10.0.0.6", "10.0.0.7")[0:0]])
+        self.assertEquals([(inet.IP("10.0.0.1"), inet.IP("10.0.0.5"))],
+                          list(ranges.ranges(inet.AF_INET)))
+
+
+
+class IPRangeSetTestCase(TestCase):
+
+    def setUp(self):
+        self.ranges = inet.IPRangeSet([
+                "10.0.1.0/24", "10.0.0.0/24", ("10.0.2.0", "10.0.2.5"),
+                inet.IP("10.0.2.6"), "2001:470::/32", "::ffff:1.2.3.0/120",
+                ])
+
+
+    def test_normalized(self):
+        self.assertEquals(
+                [("10.0.0.0", "10.0.2.6"),
+                 ("::ffff:1.2.3.0", "::ffff:1.2.3.255"),
+                 ("2001:470::", "2001:470:ffff:ffff:ffff:ffff:ffff:ffff")],
+                [(str(f), str(l)) for f, l in self.ranges.ranges()])
+
+    def test_prefixes(self):
+        self.assertEquals(
+                ["10.0.0.0/23", "10.0.2.0/30", "10.0.2.4/31", "10.0.2.6/32",
+                 "::ffff:1.2.3.0/120", "2001:470::/32"],
+                map(str, self.ranges.prefixes()))
+        self.assertEquals(["10.0.0.0/23"],
+                map(str, inet.IPRangeSet(["10.0.0.0/24", "10.0.1.0/24"]
+                    ).prefixes()))
+        self.assertEquals(["::/0"],
+                map(str, inet.IPRangeSet(["::/1", "8000::/1"]).prefixes()))
+
+    def test_size(self):
+        self.assertEquals(2 * 256 + 7, self.ranges.size(inet.AF_INET))
+        self.assertEquals(256 + (1 << 96), self.ranges.size(inet.AF_INET6))
+
+
+    def test_contains(self):
+        self.assertIn("10.0.1.7", self.ranges)
+        self.assertIn("10.0.0.0/23", self.ranges)
+        self.assertIn(("10.0.0.255", "10.0.2.1"), self.ranges)
+        self.assertIn("2001:470:1f06:2b8::2", self.ranges)
+        self.assertNotIn("10.0.2.7", self.ranges)
+        self.assertNotIn("10.0.0.0/22", self.ranges)
+        self.assertNotIn("9.255.255.255", self.ranges)
+        self.assertNotIn("dog", self.ranges)
+
+    def test_contains_mapped(self):
+        self.assertIn("::ffff:1.2.3.4", self.ranges)
+        self.assertNotIn("1.2.3.4", self.ranges)
+
+        folded = inet.IPRangeSet(["::ffff:1.2.3.0/120", "::fffe:0:0/95"],
+                                 foldMapped=True)
+        self.assertIn("1.2.3.4", folded)
+        self.assertIn("::ffff:1.2.3.4", folded)
+        self.assertIn("::fffe:0:1", folded)
+        self.assertEquals(["0.0.0.0/0", "::fffe:0:0/96"],
+                          map(str, folded.prefixes()))
+
+
+    def test_union(self):
+        union = self.ranges | ["10.0.2.7", "10.0.3.0/24", "::1"]
+        self.assertEquals(
+                ["10.0.0.0/23", "10.0.2.0/29", "10.0.3.0/24", "::1/128",
+                 "::ffff:1.2.3.0/120", "2001:470::/32"],
+                map(str, union.prefixes()))
+
+    def test_intersection(self):
+        intersection = self.ranges & ["10.0.1.128/25", ("10.0.2.4", "10.0.9.9"),
+                                      "::/0"]
+        self.assertEquals(
+                ["10.0.1.128/25", "10.0.2.4/31", "10.0.2.6/32",
+                 "::ffff:1.2.3.0/120", "2001:470::/32"],
+                map(str, intersection.prefixes()))
+
+    def test_difference(self):
+        difference = self.ranges - ["10.0.0.128/25", "10.0.2.0/31", "::/1"]
+        self.assertEquals(
+                ["10.0.0.0/25", "10.0.1.0/24", "10.0.2.2/31", "10.0.2.4/31",
+                 "10.0.2.6/32"],
+                map(str, difference.prefixes()))
+        self.assertFalse(self.ranges - self.ranges)
+
+
+    def test_equality(self):
+        self.assertEquals(inet.IPRangeSet(["10.0.0.0/23"]),
+                          inet.IPRangeSet(["10.0.1.0/24", "10.0.0.0/24"]))
+        self.assertNotEquals(inet.IPRangeSet(["10.0.0.0/23"]), self.ranges)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, inet.IPRangeSet, ["dog"])
+        self.assertRaises(ValueError, inet.IPRangeSet, [("10.0.0.2", "10.0.0.1")])
+        self.assertRaises(ValueError, inet.IPRangeSet, [("10.0.0.1", "::1")])
+
+
+
+
+
+class ArrayTestCase(TestCase):
+
+    if numpy is None:
+        skip = "NumPy is not installed"
+
+    v4Addrs = ["10.0.1.20", "192.168.0.1", "255.255.255.255"]
+    v6Addrs = ["2001:470:1f06:2b8::2", "::1", "::ffff:10.0.1.20"]
+    badAddrs = ["panix.olix0r.net", "10", None]
+
+
+    def test_parseV4Array(self):
+        values, valid = inet.parseV4Array(self.v4Addrs + self.badAddrs)
+        self.assertEquals(numpy.dtype(inet.V4_DTYPE), values.dtype)
+        self.assertEquals([True]*3 + [False]*3, list(valid))
+        self.assertEquals(0x0a000114, values[0])
+        self.assertEquals([0]*3, list(values[~valid]))
+
+    def test_parseV6Array(self):
+        values, valid = inet.parseV6Array(self.v6Addrs + self.v4Addrs)
+        self.assertEquals(numpy.dtype(inet.V6_DTYPE), values.dtype)
+        self.assertEquals([True]*3 + [False]*3, list(valid))
+        self.assertEquals(1, values[1]["lo"])
+        self.assertEquals(0x200104701f0602b8, values[0]["hi"])
+
+    def test_parseArray(self):
+        addrs = ["::1", "10.0.1.20", "dog"]
+        v4, v6, families = inet.parseArray(addrs)
+        self.assertEquals([inet.AF_INET6, inet.AF_INET, 0], list(families))
+        self.assertEquals([0, 0x0a000114, 0], list(v4))
+        self.assertEquals([1, 0, 0], list(v6["lo"]))
+
+
+    def test_unpack_buffer(self):
+        packed = "".join(inet.IP(a).toBytes() for a in self.v4Addrs)
+        values, valid = inet.unpackV4Array(packed)
+        self.assertTrue(valid.all())
+        self.assertEquals(packed, inet.packArray(values))
+
+        packed = "".join(inet.IP(a).toBytes() for a in self.v6Addrs)
+        values, valid = inet.unpackV6Array(packed)
+        self.assertTrue(valid.all())
+        self.assertEquals(packed, inet.packArray(values))
+
+    def test_unpack_buffer_error(self):
+        self.assertRaises(ValueError, inet.unpackV4Array, "\0" * 5)
+        self.assertRaises(ValueError, inet.unpackV6Array, "\0" * 17)
+
+    def test_unpack_items(self):
+        items = [inet.IP(self.v4Addrs[0]).toBytes(), "\0" * 3, object()]
+        values, valid = inet.unpackV4Array(iter(items))
+        self.assertEquals([True, False, False], list(valid))
+        self.assertEquals(0x0a000114, values[0])
+
+
+    def test_formatArray(self):
+        values, valid = inet.parseV4Array(self.v4Addrs)
+        self.assertEquals(self.v4Addrs, list(inet.formatArray(values)))
+
+        values, valid = inet.parseV6Array(self.v6Addrs)
+        self.assertEquals(self.v6Addrs, list(inet.formatArray(values)))
+
+
+    def test_addressesFromArray(self):
+        values, valid = inet.parseV4Array(self.v4Addrs)
+        ips = list(inet.addressesFromArray(values))
+        self.assertEquals(map(inet.V4Address, self.v4Addrs), ips)
+        for ip in ips:
+            self.assertIsInstance(ip, inet.V4Address)
+
+        values, valid = inet.parseV6Array(self.v6Addrs)
+        ips = list(inet.addressesFromArray(values))
+        self.assertEquals(map(inet.V6Address, self.v6Addrs), ips)
+        for ip in ips:
+            self.assertIsInstance(ip, inet.V6Address)
+
+    def test_arrayFromAddresses(self):
+        ips = map(inet.IP, self.v6Addrs)
+        values = inet.arrayFromAddresses(ips, inet.AF_INET6)
+        self.assertEquals(ips, list(inet.addressesFromArray(values)))
+
+    def test_arrayFromAddresses_familyError(self):
+        ips = map(inet.IP, self.v6Addrs)
+        self.assertRaises(ValueError, inet.arrayFromAddresses, ips)
+
+
+
+class AddressArrayTestCase(TestCase):
+
+    if numpy is None:
+        skip = "NumPy is not installed"
+
+    v4Addrs = ["10.0.0.3", "10.0.0.1", "10.0.0.2", "10.0.0.1"]
+    v6Addrs = ["2001:470:1f06:2b8::2", "::1", "::ffff:10.0.1.20"]
+
+    def setUp(self):
+        self.v4 = inet.AddressArray.fromAddresses(map(inet.IP, self.v4Addrs))
+        self.v6 = inet.AddressArray.fromAddresses(map(inet.IP, self.v6Addrs),
+                                                  inet.AF_INET6)
+
+
+    def test_iter(self):
+        self.assertEquals(self.v4Addrs, map(str, self.v4))
+        for ip in self.v6:
+            self.assertIsInstance(ip, inet.V6Address)
+        self.assertEquals(len(self.v4Addrs), len(self.v4))
+
+    def test_getitem(self):
+        self.assertEquals(inet.IP(self.v4Addrs[-1]), self.v4[-1])
+        self.assertIsInstance(self.v6[0], inet.V6Address)
+        self.assertRaises(IndexError, lambda: self.v4[len(self.v4Addrs)])
+
+    def test_slice(self):
+        part = self.v4[1:3]
+        self.assertIsInstance(part, inet.AddressArray)
+        self.assertEquals(self.v4Addrs[1:3], map(str, part))
+        self.assertTrue(numpy.may_share_memory(part.values, self.v4.values))
+
+
+    def test_sort(self):
+        self.assertFalse(self.v4.isSorted)
+        self.v4.sort()
+        self.assertTrue(self.v4.isSorted)
+        self.assertEquals(sorted(self.v4Addrs), map(str, self.v4))
+
+        self.v6.sort()
+        self.assertEquals(sorted(map(inet.IP, self.v6Addrs)), list(self.v6))
+
+    def test_dedupe(self):
+        self.v4.dedupe()
+        self.assertEquals(sorted(set(self.v4Addrs)), map(str, self.v4))
+
+
+    def test_contains(self):
+        for arr in (self.v4, self.v6):
+            for i in range(2):
+                for ip in arr:
+                    self.assertIn(ip, arr)
+                    self.assertIn(str(ip), arr)
+                self.assertNotIn("10.9.9.9", arr)
+                self.assertNotIn("::9", arr)
+                self.assertNotIn("dog", arr)
+                arr.sort()
+
+
+    def test_setOperations(self):
+        other = inet.AddressArray.fromAddresses(
+                map(inet.IP, ["10.0.0.3", "10.0.0.9"]))
+        self.assertEquals(["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.9"],
+                          map(str, self.v4 | other))
+        self.assertEquals(["10.0.0.3"], map(str, self.v4 & other))
+        self.assertEquals(["10.0.0.1", "10.0.0.2"], map(str, self.v4 - other))
+        self.assertTrue((self.v4 - other).isSorted)
+
+        empty = inet.AddressArray(family=inet.AF_INET6)
+        self.assertEquals(sorted(self.v6), list(self.v6 | empty))
+        self.assertEquals([], list(self.v6 & empty))
+
+    def test_setOperations_familyError(self):
+        self.assertRaises(ValueError, self.v4.union, self.v6)
+
+
+    def test_bytes(self):
+        packed = self.v6.toBytes()
+        self.assertEquals("".join(ip.toBytes() for ip in self.v6), packed)
+        copy = inet.AddressArray.fromBytes(packed, inet.AF_INET6)
+        self.assertEquals(list(self.v6), list(copy))
+
+
+
+class PrefixIndexTestCase(TestCase):
+
+    table = """\
+# prefix,country,asn
+10.0.0.0/8,US,"AS1, Inc."
+10.1.0.0/16,CA,2
+10.1.2.0/24,MX,3
+
+10.2.0.0/16,FR,5
+2001:db8::/32,DE,4
+"""
+
+    def setUp(self):
+        self.path = self.mktemp()
+        builder = inet.PrefixIndexBuilder()
+        builder.addCSV(StringIO(self.table))
+        builder.write(self.path)
+        self.index = inet.PrefixIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+
+
+    def test_lookup(self):
+        expected = {
+            "9.255.255.255": None,
+            "10.0.0.0": 'US,"AS1, Inc."',
+            "10.1.0.0": "CA,2",
+            "10.1.2.3": "MX,3",
+            "10.1.3.0": "CA,2",
+            "10.2.255.255": "FR,5",
+            "10.3.0.0": 'US,"AS1, Inc."',
+            "11.0.0.0": None,
+            "2001:db8::1": "DE,4",
+            "::1": None,
+            }
+        for address, metadata in expected.iteritems():
+            self.assertEquals(metadata, self.index.lookup(address))
+            self.assertEquals(metadata, self.index.lookup(inet.IP(address)))
+
+    def test_lookup_error(self):
+        self.assertRaises(ValueError, self.index.lookup, "dog")
+
+    def test_lookupPrefix(self):
+        self.assertEquals("10.1.2.0/24", self.index.lookupPrefix("10.1.2.3"))
+        self.assertEquals("10.1.0.0/16", self.index.lookupPrefix("10.1.3.0"))
+        self.assertEquals("10.0.0.0/8", self.index.lookupPrefix("10.3.0.0"))
+        self.assertEquals(None, self.index.lookupPrefix("11.0.0.0"))
+
+    def test_lookupOffset(self):
+        offset, length = self.index.lookupOffset("10.1.0.0")
+        self.assertEquals(4, length)
+        self.assertEquals(offset, self.index.lookupOffset("10.1.3.0")[0])
+        self.assertEquals(None, self.index.lookupOffset("::1"))
+
+
+    def test_reopen(self):
+        builder = inet.PrefixIndexBuilder()
+        builder.add("10.0.0.0/8", "rebuilt")
+        builder.add(inet.Prefix("10.0.0.0/8"), "replaced")
+        builder.write(self.path)
+
+        self.assertEquals("MX,3", self.index.lookup("10.1.2.3"))
+        self.index.reopen()
+        self.assertEquals("replaced", self.index.lookup("10.1.2.3"))
+        self.assertEquals(None, self.index.lookup("2001:db8::1"))
+        self.assertEquals(1, len(self.index))
+
+
+    def test_mode(self):
+        builder = inet.PrefixIndexBuilder()
+        builder.add("10.0.0.0/8", "rebuilt")
+        umask = os.umask(022)
+        try:
+            builder.write(self.path)
+        finally:
+            os.umask(umask)
+        self.assertEquals(0644, os.stat(self.path).st_mode & 0777)
+
+
+    def test_invalid(self):
+        path = self.mktemp()
+        for content in ("", "JPFX", "XXXX" + "\0" * 12):
+            with open(path, "w") as f:
+                f.write(content)
+            self.assertRaises(ValueError, inet.PrefixIndex, path)
+
+    def test_invalid_csv(self):
+        builder = inet.PrefixIndexBuilder()
+        self.assertRaises(ValueError, builder.addCSV, StringIO("dog,US\n"))
+
+
+
+class ScanTestCase(TestCase):
+
+    text = "\n".join([
+        "a 10.0.1.20 [::1]:80 10.0.1.21:8080 12:34:56 999.1.1.1 1.2.3.4.5",
+        "::ffff:10.0.1.22. client:10.0.1.23 fe80::1%eth0 2001:470::/32",
+        ])
+    expected = ["10.0.1.20", "::1", "10.0.1.21", "::ffff:10.0.1.22",
+                "10.0.1.23", "fe80::1", "2001:470::"]
+
+    def setUp(self):
+        self.path = self.mktemp()
+        with open(self.path, "w") as f:
+            f.write(self.text * 50)
+
+
+    def test_scanText(self):
+        ips = list(inet.scanText(self.text))
+        self.assertEquals(self.expected, map(str, ips))
+        self.assertIsInstance(ips[0], inet.V4Address)
+        self.assertIsInstance(ips[1], inet.V6Address)
+
+    def test_scanText_packed(self):
+        self.assertEquals([inet.IP(a).toBytes() for a in self.expected],
+                          list(inet.scanText(self.text, packed=True)))
+
+
+    def test_scanFile(self):
+        self.assertEquals(self.expected * 50,
+                          map(str, inet.scanFile(self.path)))
+
+    def test_scanFile_chunks(self):
+        expected = list(inet.scanFile(self.path, packed=True))
+        for chunkSize in (1, 7, 100):
+            self.assertEquals(expected, list(inet.scanFile(self.path,
+                    packed=True, chunkSize=chunkSize)))
+
+    def test_scanFile_processes(self):
+        expected = list(inet.scanFile(self.path, packed=True))
+        self.assertEquals(expected, list(inet.scanFile(self.path,
+                packed=True, processes=3, chunkSize=1000)))
+
+    def test_scanFile_empty(self):
+        open(self.path, "w").close()
+        self.assertEquals([], list(inet.scanFile(self.path)))
+
+
+
+class AddressSetTestCase(TestCase):
+
+    v4Addrs = ["10.0.1.20", "10.0.0.1", "192.168.0.1", "10.0.0.1"]
+    v6Addrs = ["2001:470:1f06:2b8::2", "::1", "::ffff:10.0.1.20"]
+    prefixes = ["10.0.0.0/16", "10.0.0.0/8", "1.0.0.0/8"]
+
+    def dump(self, function, items, *args):
+        out = StringIO()
+        function(items, out, *args)
+        return out.getvalue()
+
+
+    def test_addresses(self):
+        ips = map(inet.IP, self.v4Addrs)
+        data = self.dump(inet.dumpAddresses, ips)
+        self.assertEquals(sorted(ips), inet.loadAddresses(data))
+        self.assertEquals(sorted(ips), inet.loadAddresses(StringIO(data)))
+
+        ips = map(inet.IP, self.v6Addrs)
+        data = self.dump(inet.dumpAddresses, ips, inet.AF_INET6)
+        self.assertEquals(sorted(ips), inet.loadAddresses(data))
+
+    def test_addresses_compact(self):
+        ips = [inet.V4Address.fromInt(0x0a000000 + i) for i in range(1000)]
+        data = self.dump(inet.dumpAddresses, ips)
+        self.assertEquals(16 + 4 + 999, len(data))
+
+    def test_addresses_familyError(self):
+        ips = map(inet.IP, self.v6Addrs)
+        self.assertRaises(ValueError, self.dump, inet.dumpAddresses, ips,
+                          inet.AF_INET)
+
+
+    def test_array(self):
+        if numpy is None:
+            raise SkipTest("NumPy is not installed")
+
+        ips = map(inet.IP, self.v6Addrs)
+        array = inet.AddressArray.fromAddresses(ips, inet.AF_INET6)
+        data = self.dump(inet.dumpAddresses, array)
+        self.assertEquals(data, self.dump(inet.dumpAddresses, ips,
+                                          inet.AF_INET6))
+
+        loaded = inet.loadArray(data)
+        self.assertTrue(loaded.isSorted)
+        self.assertEquals("".join(ip.toBytes() for ip in sorted(ips)),
+                          loaded.toBytes())
+
+
+    def test_prefixes(self):
+        data = self.dump(inet.dumpPrefixes, self.prefixes)
+        self.assertEquals(["1.0.0.0/8", "10.0.0.0/8", "10.0.0.0/16"],
+                          map(str, inet.loadPrefixes(data)))
+
+    def test_ranges(self):
+        ranges = inet.IPRangeSet(["10.0.0.0/24", ("10.0.2.0", "10.0.2.5"),
+                                  "2001:470::/32", "::1"])
+        data = self.dump(inet.dumpRanges, ranges)
+        self.assertEquals(ranges, inet.loadRanges(data))
+        self.assertEquals(inet.IPRangeSet(), inet.loadRanges(
+                self.dump(inet.dumpRanges, inet.IPRangeSet())))
+
+
+    def test_mmap(self):
+        path = self.mktemp()
+        with open(path, "wb") as f:
+            inet.dumpAddresses(map(inet.IP, self.v4Addrs), f)
+
+        with open(path, "rb") as f:
+            fileMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.addCleanup(fileMap.close)
+        self.assertEquals(sorted(map(inet.IP, self.v4Addrs)),
+                          inet.loadAddresses(fileMap))
+
+
+    def test_streaming(self):
+        class Stream(object):
+            """An unseekable output."""
+            def __init__(self):
+                self.written = []
+            def write(self, data):
+                self.written.append(data)
+
+        out = Stream()
+        writer = inet.AddressSetWriter(out, inet.ADDRESSES, inet.AF_INET6)
+        for address in sorted(self.v6Addrs, key=lambda a: inet.IP(a).toInt()):
+            writer.write(address)
+        writer.close()
+
+        reader = inet.AddressSetReader(StringIO("".join(out.written)))
+        reader.blockSize = 3
+        self.assertEquals(sorted(map(inet.IP, self.v6Addrs)), list(reader))
+        self.assertEquals(inet.AddressSetWriter.UNKNOWN_COUNT, reader.count)
+        self.assertEquals(inet.AF_INET6, reader.family)
+
+    def test_count(self):
+        out = StringIO()
+        writer = inet.AddressSetWriter(out, inet.PREFIXES, count=2)
+        writer.write("10.0.0.0/8")
+        self.assertRaises(ValueError, writer.close)
+
+        out = StringIO()
+        with inet.AddressSetWriter(out, inet.PREFIXES) as writer:
+            writer.write(inet.Prefix("10.0.0.0/8"))
+        reader = inet.AddressSetReader(out.getvalue())
+        self.assertEquals(["10.0.0.0/8"], map(str, reader))
+        self.assertEquals(1, reader.count)
+
+
+    def test_writer_errors(self):
+        writer = inet.AddressSetWriter(StringIO(), inet.ADDRESSES)
+        writer.write("10.0.0.2")
+        self.assertRaises(ValueError, writer.write, "10.0.0.1")
+        self.assertRaises(ValueError, writer.write, "::1")
+
+        writer = inet.AddressSetWriter(StringIO(), inet.RANGES)
+        writer.write(("10.0.0.2", "10.0.0.5"))
+        self.assertRaises(ValueError, writer.write, ("10.0.0.5", "10.0.0.6"))
+        self.assertRaises(ValueError, writer.write, ("10.0.0.9", "10.0.0.7"))
+        self.assertRaises(ValueError, writer.write, "10.0.0.9")
+
+        self.assertRaises(ValueError, inet.AddressSetWriter, StringIO(), 9)
+
+
+    def test_reader_errors(self):
+        data = self.dump(inet.dumpAddresses, map(inet.IP, self.v6Addrs),
+                         inet.AF_INET6)
+        self.assertRaises(ValueError, inet.loadAddresses, data[:-1])
+        self.assertRaises(ValueError, inet.loadAddresses, data[:10])
+        self.assertRaises(ValueError, inet.loadAddresses, "XXXX" + data[4:])
+        self.assertRaises(ValueError, inet.loadPrefixes, data)
+
+
+
+class AddressFilterTestBase(object):
+
+    filterClass = None
+    capacity = 2000
+    errorRate = 0.01
+
+    def setUp(self):
+        self.filter = self.filterClass(self.capacity, self.errorRate)
+        self.members = [inet.V4Address.fromInt(0x0a000000 + i * 7)
+                        for i in range(self.capacity // 2)]
+        self.members += [inet.V6Address.fromInt((0x20010db8 << 96) + i * 7)
+                         for i in range(self.capacity // 2)]
+        self.others = [inet.V4Address.fromInt(0x0b000000 + i)
+                       for i in range(self.capacity)]
+
+
+    def test_contains(self):
+        self.filter.update(self.members)
+        self.assertEquals(len(self.members), self.filter.count)
+        for ip in self.members:
+            self.assertIn(ip, self.filter)
+            self.assertIn(str(ip), self.filter)
+        self.assertNotIn("dog", self.filter)
+
+        falsePositives = sum(1 for ip in self.others if ip in self.filter)
+        self.assertTrue(falsePositives < 3 * self.errorRate * len(self.others),
+                        falsePositives)
+
+    def test_distinguishesFamilies(self):
+        self.filter.add("0.0.0.1")
+        self.assertNotIn("::1", self.filter)
+
+
+    def test_addArray(self):
+        if numpy is None:
+            raise SkipTest("NumPy is not installed")
+
+        v4 = inet.arrayFromAddresses(self.members[:self.capacity // 2])
+        v6 = inet.AddressArray.fromAddresses(self.members[self.capacity // 2:],
+                                             inet.AF_INET6)
+        self.filter.addArray(v4)
+        self.filter.addArray(v6)
+        self.assertEquals(len(self.members), self.filter.count)
+        for ip in self.members:
+            self.assertIn(ip, self.filter)
+        self.assertTrue(self.filter.containsArray(v4).all())
+        self.assertTrue(self.filter.containsArray(v6).all())
+
+    def test_containsArray(self):
+        if numpy is None:
+            raise SkipTest("NumPy is not installed")
+
+        self.filter.update(self.members)
+        others = inet.arrayFromAddresses(self.others)
+        self.assertEquals([ip in self.filter for ip in self.others],
+                          list(self.filter.containsArray(others)))
+
+
+    def test_fromBuffer(self):
+        self.filter.update(self.members)
+        copy = self.filterClass.fromBuffer(self.filter.toBytes())
+        self.assertEquals(self.filter.count, copy.count)
+        for ip in self.members:
+            self.assertIn(ip, copy)
+        self.assertRaises(TypeError, copy.add, "10.0.0.1")
+
+    def test_fromBuffer_mmap(self):
+        self.filter.update(self.members[:10])
+        path = self.mktemp()
+        with open(path, "wb") as f:
+            f.write(self.filter.toBytes())
+
+        with open(path, "r+b") as f:
+            fileMap = mmap.mmap(f.fileno(), 0)
+        self.addCleanup(fileMap.close)
+
+        mapped = self.filterClass.fromBuffer(fileMap)
+        for ip in self.members[:10]:
+            self.assertIn(ip, mapped)
+        mapped.add(self.members[10])
+        fileMap.flush()
+
+        with open(path, "rb") as f:
+            reloaded = self.filterClass.fromBuffer(f.read())
+        self.assertIn(self.members[10], reloaded)
+        self.assertEquals(11, reloaded.count)
+
+    def test_fromBuffer_error(self):
+        data = self.filter.toBytes()
+        self.assertRaises(ValueError, self.filterClass.fromBuffer, "")
+        self.assertRaises(ValueError, self.filterClass.fromBuffer,
+                          "XXXX" + data[4:])
+        self.assertRaises(ValueError, self.filterClass.fromBuffer, data[:-1])
+
+
+    def test_invalidSize(self):
+        self.assertRaises(ValueError, self.filterClass, 0)
+        self.assertRaises(ValueError, self.filterClass, 10, 1.5)
+
+
+
+class BloomFilterTestCase(AddressFilterTestBase, TestCase):
+
+    filterClass = inet.BloomFilter
+
+    def test_size(self):
+        self.assertEquals(7, self.filter.hashCount)
+        self.assertTrue(9 * self.capacity < self.filter.bitCount
+                        < 10 * self.capacity)
+
+
+
+class CuckooFilterTestCase(AddressFilterTestBase, TestCase):
+
+    filterClass = inet.CuckooFilter
+
+    def test_remove(self):
+        self.filter.update(self.members)
+        for ip in self.members[::2]:
+            self.assertTrue(self.filter.remove(ip))
+        self.assertEquals(len(self.members) // 2, self.filter.count)
+        for ip in self.members[1::2]:
+            self.assertIn(ip, self.filter)
+        self.assertFalse(self.filter.remove("dog"))
+
+    def test_full(self):
+        small = inet.CuckooFilter(8)
+        added = []
+        try:
+            for ip in self.others:
+                small.add(ip)
+                added.append(ip)
+        except ValueError:
+            pass
+        else:
+            self.fail("CuckooFilter did not fill")
+
+        self.assertEquals(len(added), small.count)
+        for ip in added:
+            self.assertIn(ip, small)
+
+
+
+class _FakeResolver(object):
+    """Answers lookups from a table, recording each query."""
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+        self.pending = []
+
+
+    def _lookup(self, name, rrType):
+        from twisted.internet import defer
+        from twisted.names import dns, error
+
+        self.queries.append((name, rrType))
+        answers = [dns.RRHeader(name, rrType, ttl=ttl, payload=payload)
+                   for (n, t, ttl, payload) in self.records
+                   if n == name and t == rrType]
+        d = defer.Deferred()
+        if answers:
+            self.pending.append((d, (answers, [], [])))
+        else:
+            self.pending.append((d, error.DomainError(name)))
+        return d
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for d, result in pending:
+            if isinstance(result, Exception):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def lookupAddress(self, name):
+        from twisted.names import dns
+        return self._lookup(name, dns.A)
+
+    def lookupIPV6Address(self, name):
+        from twisted.names import dns
+        return self._lookup(name, dns.AAAA)
+
+    def lookupPointer(self, name):
+        from twisted.names import dns
+        return self._lookup(name, dns.PTR)
+
+
+
+class CachingResolverTestCase(TestCase):
+
+    def setUp(self):
+        from twisted.internet.task import Clock
+        from twisted.names import dns
+
+        self.fake = _FakeResolver([
+                ("example.com", dns.A, 300, dns.Record_A("192.0.2.1")),
+                ("example.com", dns.A, 60, dns.Record_A("192.0.2.2")),
+                ("example.com", dns.AAAA, 600, dns.Record_AAAA("2001:db8::1")),
+                ("1.2.0.192.in-addr.arpa", dns.PTR, 120,
+                    dns.Record_PTR("example.com")),
+                ])
+        self.clock = Clock()
+        self.resolver = inet.CachingResolver(self.fake, self.clock,
+                negativeTTL=30)
+
+
+    def resolve(self, *args):
+        results = []
+        d = self.resolver.resolve(*args)
+        d.addBoth(results.append)
+        self.fake.flush()
+        self.assertEquals(1, len(results))
+        return results[0]
+
+
+    def test_reverseName(self):
+        self.assertEquals("1.2.0.192.in-addr.arpa",
+                inet.reverseName("192.0.2.1"))
+        self.assertEquals("1." + "0." * 23 + "8.b.d.0.1.0.0.2"
+                ".ip6.arpa", inet.reverseName("2001:db8::1"))
+
+
+    def test_resolve(self):
+        addresses = self.resolve("example.com")
+        self.assertEquals(["192.0.2.1", "192.0.2.2", "2001:db8::1"],
+                map(str, addresses))
+        self.assertEquals([inet.V4Address, inet.V4Address, inet.V6Address],
+                map(type, addresses))
+
+
+    def test_resolve_family(self):
+        self.assertEquals(["2001:db8::1"],
+                map(str, self.resolve("example.com", inet.AF_INET6)))
+        self.assertEquals(1, len(self.fake.queries))
+
+
+    def test_resolve_literal(self):
+        self.assertEquals([inet.IP("10.0.0.1")], self.resolve("10.0.0.1"))
+        self.assertEquals([], self.fake.queries)
+        self.resolve("10.0.0.1", inet.AF_INET6).trap(ValueError)
+
+
+    def test_cached(self):
+        first = self.resolve("example.com")
+        self.assertEquals(first, self.resolve("EXAMPLE.COM"))
+        self.assertEquals(2, len(self.fake.queries))
+
+        # The cache honors the shortest TTL of the answers.
+        self.clock.advance(59)
+        self.resolve("example.com")
+        self.assertEquals(2, len(self.fake.queries))
+        self.clock.advance(1)
+        self.resolve("example.com")
+        self.assertEquals(4, len(self.fake.queries))
+
+
+    def test_purge(self):
+        from twisted.names.error import DomainError
+
+        self.resolver.minPurgeSize = 2
+        self.resolver.purge()
+        for n in xrange(3):
+            self.resolve("missing{0}.example.com".format(n)).trap(DomainError)
+        self.assertEquals(3, len(self.resolver._cache))
+
+        # Expired answers are purged once the cache has doubled in size
+        # since it was last purged, rather than on every answer.
+        self.clock.advance(30)
+        self.resolve("example.com")
+        self.assertEquals(4, len(self.resolver._cache))
+        self.resolve("example.com", inet.AF_INET6)
+        self.assertEquals(2, len(self.resolver._cache))
+
+
+    def test_negative(self):
+        from twisted.names.error import DomainError
+
+        self.resolve("missing.example.com").trap(DomainError)
+        self.resolve("missing.example.com").trap(DomainError)
+        self.assertEquals(2, len(self.fake.queries))
+
+        self.clock.advance(30)
+        self.resolve("missing.example.com").trap(DomainError)
+        self.assertEquals(4, len(self.fake.queries))
+
+
+    def test_coalesced(self):
+        results = []
+        for i in range(3):
+            self.resolver.resolve("example.com").addCallback(results.append)
+        self.assertEquals(2, len(self.fake.queries))
+        self.assertEquals([], results)
+
+        self.fake.flush()
+        self.assertEquals(3, len(results))
+        self.assertEquals(results[0], results[2])
+        self.assertNotIdentical(results[0], results[2])
+
+
+    def test_reverse(self):
+        from twisted.names.error import DomainError
+
+        names = []
+        self.resolver.reverse("192.0.2.1").addCallback(names.append)
+        self.fake.flush()
+        self.resolver.reverse(inet.IP("192.0.2.1")).addCallback(names.append)
+        self.assertEquals(["example.com", "example.com"], names)
+        self.assertEquals(1, len(self.fake.queries))
+
+        failures = []
+        self.resolver.reverse("192.0.2.2").addErrback(failures.append)
+        self.fake.flush()
+        failures[0].trap(DomainError)
+
+
+    def test_hosts(self):
+        from twisted.names.hosts import Resolver
+
+        path = self.mktemp()
+        with open(path, "w") as hosts:
+            hosts.write("192.0.2.7 gateway.example.com\n"
+                        "2001:db8::7 gateway.example.com\n")
+        resolver = inet.CachingResolver(Resolver(path), self.clock)
+
+        d = resolver.resolve("gateway.example.com")
+        d.addCallback(lambda addrs: self.assertEquals(
+                ["192.0.2.7", "2001:db8::7"], map(str, addrs)))
+        return d
+
+
+
+class RateLimiterTestCase(TestCase):
+
+    def setUp(self):
+        from twisted.internet.task import Clock
+        self.clock = Clock()
+
+
+    def test_burst(self):
+        limiter = inet.RateLimiter(1, 3, clock=self.clock)
+        self.assertEquals([True, True, True, False],
+                [limiter.allow("10.0.0.1") for i in range(4)])
+        self.assertTrue(limiter.allow("10.0.0.2"))
+        self.assertFalse(limiter.allow(inet.IP("10.0.0.1")))
+
+
+    def test_refill(self):
+        limiter = inet.RateLimiter(2, 2, clock=self.clock)
+        limiter.allow("10.0.0.1", 2)
+        self.assertEquals(0, limiter.tokens("10.0.0.1"))
+
+        self.clock.advance(0.25)
+        self.assertEquals(0.5, limiter.tokens("10.0.0.1"))
+        self.assertFalse(limiter.allow("10.0.0.1"))
+        self.clock.advance(0.25)
+        self.assertTrue(limiter.allow("10.0.0.1"))
+
+        # Buckets never exceed their burst size.
+        self.clock.advance(60)
+        self.assertEquals(2, limiter.tokens("10.0.0.1"))
+        self.assertEquals([], self.clock.getDelayedCalls())
+
+
+    def test_prefixes(self):
+        limiter = inet.RateLimiter(1, 1, v4Length=24, v6Length=64,
+                clock=self.clock)
+        self.assertTrue(limiter.allow("10.0.0.1"))
+        self.assertFalse(limiter.allow("10.0.0.254"))
+        self.assertTrue(limiter.allow("10.0.1.1"))
+
+        self.assertTrue(limiter.allow("2001:db8::1"))
+        self.assertFalse(limiter.allow("2001:db8::ffff:1"))
+        self.assertTrue(limiter.allow("2001:db8:0:1::1"))
+
+        # Families are tracked separately, even for equal prefix bytes.
+        self.assertTrue(limiter.allow("::"))
+        self.assertTrue(limiter.allow("0.0.0.0"))
+        self.assertEquals(6, len(limiter))
+
+
+    def test_partialPrefix(self):
+        limiter = inet.RateLimiter(1, 1, v4Length=20, clock=self.clock)
+        self.assertTrue(limiter.allow("10.0.16.1"))
+        self.assertFalse(limiter.allow("10.0.31.1"))
+        self.assertTrue(limiter.allow("10.0.32.1"))
+
+
+    def test_eviction(self):
+        limiter = inet.RateLimiter(1, 1, maxKeys=2, clock=self.clock)
+        limiter.allow("10.0.0.1")
+        limiter.allow("10.0.0.2")
+        limiter.allow("10.0.0.1")
+        limiter.allow("10.0.0.3")
+        self.assertEquals(2, len(limiter))
+
+        # 10.0.0.2 was least recently used, so it was evicted.
+        self.assertFalse(limiter.allow("10.0.0.1"))
+        self.assertTrue(limiter.allow("10.0.0.2"))
+
+
+    def test_tokensKeepsOrder(self):
+        limiter = inet.RateLimiter(1, 1, maxKeys=2, clock=self.clock)
+        limiter.allow("10.0.0.1")
+        limiter.allow("10.0.0.2")
+        self.assertEquals(0, limiter.tokens("10.0.0.1"))
+        limiter.allow("10.0.0.3")
+
+        # Checking 10.0.0.1's tokens did not spare it from eviction.
+        self.assertTrue(limiter.allow("10.0.0.1"))
+
+
+    def test_purge(self):
+        limiter = inet.RateLimiter(1, 2, clock=self.clock)
+        limiter.allow("10.0.0.1", 2)
+        self.clock.advance(1.5)
+        limiter.allow("10.0.0.2", 2)
+        self.clock.advance(0.5)
+        limiter.purge()
+        self.assertEquals(1, len(limiter))
+        self.assertEquals(2, limiter.tokens("10.0.0.1"))
+
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, inet.RateLimiter, 0, 1, clock=self.clock)
+        self.assertRaises(ValueError, inet.RateLimiter, 1, 1, v4Length=33,
+                clock=self.clock)
+        self.assertRaises(ValueError, inet.RateLimiter, 1, 1, maxKeys=0,
+                clock=self.clock)
+
+
+
+class ConnectionTrackerTestCase(TestCase):
+
+    def test_track(self):
+        tracker = inet.ConnectionTracker(2, v4Length=24)
+        self.assertTrue(tracker.open("10.0.0.1"))
+        self.assertTrue(tracker.open("10.0.0.2"))
+        self.assertFalse(tracker.open("10.0.0.3"))
+        self.assertEquals(2, tracker.count("10.0.0.99"))
+
+        tracker.close("10.0.0.1")
+        self.assertTrue(tracker.open("10.0.0.3"))
+        tracker.close("10.0.0.2")
+        tracker.close("10.0.0.3")
+        self.assertEquals(0, len(tracker))
+        self.assertRaises(ValueError, tracker.close, "10.0.0.1")
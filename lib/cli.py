@@ -1,20 +1,34 @@
 """Command-Line Interface library"""
 
-import os, sys
+import errno, json, os, select, shlex, signal, socket, struct, sys
+import threading, time
 
+from collections import deque
+from cPickle import HIGHEST_PROTOCOL, dumps, loads
+
+from jersey import startup
+if startup.requested():
+    startup.profiler.enable()
+    startup.profiler.installImportHook()
+
+# The reactor is not imported here:  importing it installs the default reactor,
+# and usage output and option parsing should not pay for it.  Runners import it
+# when it is started.
 from twisted.application import app
 from twisted.application.service import Application, MultiService, Service
-from twisted.internet import reactor
-from twisted.internet.defer import (Deferred, succeed, fail,
-        inlineCallbacks, returnValue, maybeDeferred, gatherResults)
-from twisted.plugin import getPlugins
+from twisted.internet.defer import (CancelledError, Deferred, DeferredList,
+        DeferredSemaphore, FirstError, succeed, fail, inlineCallbacks,
+        returnValue, maybeDeferred, gatherResults)
 from twisted.python import usage
 from twisted.python.failure import Failure
 
 from zope.interface import Attribute, Interface, implements
 
 from jersey import log
-from jersey.inet import IP
+from jersey.inet import AF_INET, AF_INET6, IP, Endpoint, scanFile, scanText
+from jersey.inet import _openTemporary
+
+startup.profiler.record("imports", startup.profiler.started)
 
 
 UsageError = usage.error
@@ -44,30 +58,162 @@ class ICommandFactory(Interface):
 
 
 
+class ServiceStartTimeout(Exception):
+    """A Command's child service did not start in time."""
+
+
+
 class Command(MultiService):
     """Abstract Command implementation.
 
     Subclasses must implement execute()
+
+    Child services are started before execute() is called.  A child service
+    may declare `dependencies', a sequence of the names of sibling services
+    that must be started before it, and `startTimeout', the seconds it may
+    take to start (overriding serviceStartTimeout).  Services are started in
+    waves:  every service whose dependencies have started is started at once.
+    Services are stopped in the reverse order.
+
+    If a service fails to start, later waves are not started and exit fails.
+
+    Attributes:
+        serviceStartTimeout --  Seconds a child service may take to start, or
+                                None.
+        startupTimes --  A list of (service name, wave, seconds) for started
+                         child services.
+        clock --  An IReactorTime used for timeouts (defaults to the reactor).
     """
     implements(ICommand)
 
+    serviceStartTimeout = None
+    clock = None
+
     def __init__(self, config):
         MultiService.__init__(self)
         self.config = config
         self.exit = Deferred()
+        self.startupTimes = []
 
     @inlineCallbacks
     def startService(self):
         """Initiate execution."""
         Service.startService(self)
-        ds = []
-        for svc in self:
-            log.debug("{0} starting service: {1}".format(self, svc))
-            d = maybeDeferred(svc.startService)
-            ds.append(d)
-        yield gatherResults(ds)
+        try:
+            for wave, services in enumerate(self.startupWaves()):
+                yield gatherResults([self._startChild(svc, wave)
+                                     for svc in services], consumeErrors=True)
+        except Exception:
+            failure = Failure()
+            if failure.check(FirstError):
+                failure = failure.value.subFailure
+            log.err(failure, "{0} failed to start services".format(self))
+            if not self.exit.called:
+                self.exit.errback(failure)
+            return
+
+        if self.startupTimes:
+            log.debug(self.startupReport())
         yield self._execute()
 
+
+    def startupWaves(self):
+        """Order child services by their dependencies.
+
+        Returns:
+            A list of waves, each a list of services whose dependencies are
+            in earlier waves.
+        Raises:
+            ValueError if a dependency is unknown or cyclic.
+            TypeError if a service's dependencies are a string, rather than a
+            sequence of names.
+        """
+        dependencies = {}
+        for svc in self:
+            names = getattr(svc, "dependencies", ())
+            if isinstance(names, basestring):
+                raise TypeError("Service dependencies must be a sequence of "
+                                "names", svc.name, names)
+            for name in names:
+                if name not in self.namedServices:
+                    raise ValueError("Unknown service dependency",
+                                     svc.name, name)
+            dependencies[svc] = set(self.namedServices[n] for n in names)
+
+        waves = []
+        started = set()
+        remaining = list(self)
+        while remaining:
+            wave = [svc for svc in remaining if dependencies[svc] <= started]
+            if not wave:
+                raise ValueError("Cyclic service dependencies",
+                                 [svc.name for svc in remaining])
+            waves.append(wave)
+            started.update(wave)
+            remaining = [svc for svc in remaining if svc not in started]
+        return waves
+
+
+    def _startChild(self, svc, wave):
+        log.debug("{0} starting service: {1}".format(self, svc))
+        if self.clock is None:
+            from twisted.internet import reactor
+            self.clock = reactor
+
+        start = self.clock.seconds()
+        profilerStart = startup.profiler.clock()
+        d = maybeDeferred(svc.startService)
+
+        timeout = getattr(svc, "startTimeout", self.serviceStartTimeout)
+        timedOut = []
+        if timeout is not None:
+            def cancel():
+                timedOut.append(True)
+                d.cancel()
+            call = self.clock.callLater(timeout, cancel)
+
+        def cb_started(result):
+            if timeout is not None and call.active():
+                call.cancel()
+            if timedOut and isinstance(result, Failure) \
+                    and result.check(CancelledError):
+                raise ServiceStartTimeout(svc.name, timeout)
+            if not isinstance(result, Failure):
+                name = svc.name or repr(svc)
+                self.startupTimes.append((name, wave,
+                                          self.clock.seconds() - start))
+                startup.profiler.record("start {0}".format(name),
+                                        profilerStart)
+            return result
+        return d.addBoth(cb_started)
+
+
+    def startupReport(self):
+        """Describe how long each child service took to start."""
+        lines = ["{0} started services:".format(self)]
+        for name, wave, seconds in self.startupTimes:
+            lines.append("  wave {0}: {1} ({2:.3f}s)".format(
+                    wave, name, seconds))
+        return "\n".join(lines)
+
+
+    @inlineCallbacks
+    def stopService(self):
+        """Stop child services in the reverse of the order they started."""
+        Service.stopService(self)
+        try:
+            waves = self.startupWaves()
+        except ValueError:
+            waves = [list(self)]
+        for services in reversed(waves):
+            results = yield DeferredList(
+                    [maybeDeferred(svc.stopService)
+                     for svc in reversed(services) if svc.running],
+                    consumeErrors=True)
+            for succeeded, result in results:
+                if not succeeded:
+                    log.err(result, "{0} failed to stop a service".format(self))
+
     def _execute(self):
         """Ensure that exit is called with the result of execute."""
         return maybeDeferred(self.execute).chainDeferred(self.exit)
@@ -78,6 +224,203 @@ class Command(MultiService):
 
 
 
+class FanOutError(Exception):
+    """Raised when work items of a FanOutCommand failed.
+
+    Attributes:
+        failures --  A list of (item, Failure) for the failed work items.
+    """
+
+    def __init__(self, failures, count):
+        Exception.__init__(self, "{0} of {1} work items failed".format(
+                len(failures), count))
+        self.failures = failures
+
+
+
+class FanOutProgress(object):
+    """The progress of a FanOutCommand.
+
+    Attributes:
+        started --  When work began (in clock seconds).
+        pulled --  The number of work items pulled from the work items.
+        completed --  The number of work items that succeeded.
+        failed --  The number of work items that failed.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.started = clock.seconds()
+        self.pulled = 0
+        self.completed = 0
+        self.failed = 0
+
+
+    @property
+    def done(self):
+        return self.completed + self.failed
+
+    @property
+    def active(self):
+        return self.pulled - self.done
+
+
+    def elapsed(self):
+        return self.clock.seconds() - self.started
+
+    def throughput(self):
+        """Return the number of work items done per second."""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.done / elapsed
+
+
+    def __str__(self):
+        return ("{0.done} done ({0.failed} failed), {0.active} active "
+                "in {1:.1f}s ({2:.1f}/s)").format(
+                        self, self.elapsed(), self.throughput())
+
+
+
+class FanOutCommand(Command):
+    """Runs a Deferred-returning operation on many work items, a few at once.
+
+    Work items are pulled lazily from workItems(), so that large inputs are
+    never held in memory, and no more than `concurrency' of them are processed
+    at once.  Results are passed to resultReceived() as they arrive, and
+    failures to errorReceived().
+
+    If failFast is set, no more work items are started once one has failed,
+    and execute() fails with the first failure once active items are done.
+    Otherwise, every work item is processed, and execute() fails with a
+    FanOutError if any of them failed.
+
+    Subclasses must implement workItems() and process().
+
+    The concurrency and failFast attributes are overridden by the options of
+    FanOutOptionsMixin, when present in the config.
+
+    Attributes:
+        concurrency --  The maximum number of work items processed at once.
+        failFast --  Whether to stop starting work items after a failure.
+        progressInterval --  Seconds between progress reports (None to only
+                             report once done).
+        progress --  A FanOutProgress, once executing.
+        clock --  An IReactorTime used for progress (defaults to the reactor).
+        cooperator --  Schedules work (defaults to Twisted's cooperator).
+    """
+
+    concurrency = 10
+    failFast = False
+    progressInterval = 10.0
+
+    progress = None
+    clock = None
+    cooperator = None
+
+
+    def workItems(self):
+        """Return an iterable of work items."""
+        raise NotImplementedError("workItems() must be implemented by subclass.")
+
+    def process(self, item):
+        """Process a work item.
+
+        Returns:
+            The result of the work item, or a Deferred that fires with it.
+        """
+        raise NotImplementedError("process() must be implemented by subclass.")
+
+
+    def resultReceived(self, item, result):
+        """Called with each work item's result as it completes."""
+
+    def errorReceived(self, item, reason):
+        """Called with each work item's Failure as it fails.  Logs it."""
+        log.err(reason, "Work item failed: {0!r}".format(item))
+
+
+    def reportProgress(self, progress):
+        """Called periodically, and when done, to report progress."""
+        log.info("{0}: {1}".format(self.__class__.__name__, progress))
+
+
+    def execute(self):
+        # Not imported with the module, since twisted.internet.task imports
+        # much of twisted.internet.
+        from twisted.internet.task import LoopingCall, cooperate
+
+        concurrency = self.config.get("concurrency") or self.concurrency
+        if concurrency < 1:
+            raise ValueError("Invalid concurrency", concurrency)
+
+        if self.clock is None:
+            from twisted.internet import reactor
+            self.clock = reactor
+        self.progress = FanOutProgress(self.clock)
+        self._failures = []
+
+        if self.progressInterval:
+            self._progressCall = LoopingCall(self.reportProgress, self.progress)
+            self._progressCall.clock = self.clock
+            self._progressCall.start(self.progressInterval, now=False)
+        else:
+            self._progressCall = None
+
+        # Each cooperative task pulls from the same generator, so at most
+        # `concurrency' work items are in progress.
+        work = self._work(iter(self.workItems()))
+        schedule = self.cooperator and self.cooperator.cooperate or cooperate
+        tasks = [schedule(work) for i in xrange(concurrency)]
+
+        d = gatherResults([t.whenDone() for t in tasks])
+        d.addBoth(self._done)
+        return d
+
+
+    def _isFailFast(self):
+        return bool(self.config.get("fail-fast") or self.failFast)
+
+
+    def _work(self, items):
+        failFast = self._isFailFast()
+        while not (failFast and self._failures):
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            self.progress.pulled += 1
+            d = maybeDeferred(self.process, item)
+            d.addCallbacks(self._cb_processed, self._eb_processed,
+                    callbackArgs=(item,), errbackArgs=(item,))
+            yield d
+
+
+    def _cb_processed(self, result, item):
+        self.progress.completed += 1
+        self.resultReceived(item, result)
+
+    def _eb_processed(self, reason, item):
+        self.progress.failed += 1
+        self._failures.append((item, reason))
+        self.errorReceived(item, reason)
+
+
+    def _done(self, result):
+        if self._progressCall is not None:
+            self._progressCall.stop()
+        self.reportProgress(self.progress)
+
+        if isinstance(result, Failure):
+            return result
+        if self._failures:
+            if self._isFailFast():
+                return self._failures[0][1]
+            raise FanOutError(self._failures, self.progress.done)
+
+
+
 class CommandFactory(object):
     """Abstract CommandFactory implementation.
 
@@ -110,6 +453,19 @@ class Options(usage.Options):
         except ValueError:
             raise usage.error("Not an IP address", addr)
 
+
+    @staticmethod
+    def parseEndpoint(endpoint):
+        """Wraps Endpoint.parse() to throw usage.error instead of ValueError.
+
+        Endpoints are specified as host:port or [v6host]:port.
+        """
+        try:
+            return Endpoint.parse(endpoint)
+
+        except ValueError:
+            raise usage.error("Not an endpoint", endpoint)
+
     
     def __init__(self, program=None):
         """Construct Options.
@@ -142,6 +498,99 @@ class Options(usage.Options):
 
 
 
+class StartupProfileMixin(object):
+    """Provides the --startup-profile option to an Options class.
+
+    Reporting is performed by AbstractCommandRunner.  Phases are recorded
+    from the time the option is parsed, but module imports are only timed if
+    startup.requested() when jersey.cli was imported.
+    """
+
+    optFlags = [
+        ["startup-profile", None, "Report where startup time is spent."],
+        ]
+
+    def parseOptions(self, options=None):
+        with startup.profiler.phase("option parsing"):
+            super(StartupProfileMixin, self).parseOptions(options)
+            if self["startup-profile"]:
+                startup.profiler.enable()
+
+
+
+# Modules providing install() for common reactors, so that they may be
+# installed without searching for reactor plugins.
+reactorModules = {
+    "epoll": "twisted.internet.epollreactor",
+    "kqueue": "twisted.internet.kqreactor",
+    "poll": "twisted.internet.pollreactor",
+    "select": "twisted.internet.selectreactor",
+    "default": "twisted.internet.default",
+    }
+
+
+def installReactor(name):
+    """Install a reactor by name (e.g. "epoll").
+
+    Names not in reactorModules are looked up as twisted.application.reactors
+    plugins.
+
+    Raises:
+        KeyError if there is no such reactor.
+        ImportError if the reactor is not available on this platform.
+        ReactorAlreadyInstalledError if a reactor is already installed.
+    """
+    if name in reactorModules:
+        module = reactorModules[name]
+        __import__(module)
+        sys.modules[module].install()
+
+    else:
+        from twisted.application.reactors import NoSuchReactor, installReactor
+        try:
+            installReactor(name)
+        except NoSuchReactor:
+            raise KeyError("No such reactor", name)
+
+
+
+class ReactorSelectionMixin(object):
+    """Provides the --reactor option to an Options class.
+
+    Unlike Twisted's ReactorSelectionMixin, the reactor is not installed while
+    options are parsed; AbstractCommandRunner installs it before the
+    application is built.
+    """
+
+    def opt_reactor(self, name):
+        """The reactor to use (e.g. epoll, kqueue, poll or select)."""
+        if name not in reactorModules:
+            from twisted.application.reactors import getReactorTypes
+            if name not in [r.shortName for r in getReactorTypes()]:
+                raise usage.UsageError("No such reactor", name)
+        self["reactor"] = name
+
+
+
+class FanOutOptionsMixin(object):
+    """Provides --concurrency and --fail-fast options for a FanOutCommand."""
+
+    optFlags = [
+        ["fail-fast", None, "Stop starting work after a failure."],
+        ]
+
+    optParameters = [
+        ["concurrency", None, None,
+            "Maximum number of work items processed at once.", int],
+        ]
+
+    def postOptions(self):
+        super(FanOutOptionsMixin, self).postOptions()
+        if self["concurrency"] is not None and self["concurrency"] < 1:
+            raise usage.UsageError("Invalid concurrency", self["concurrency"])
+
+
+
 class Logger(app.AppLogger):
     """CLI-oriented logger factory."""
 
@@ -165,25 +614,42 @@ class Logger(app.AppLogger):
 
 
 class AbstractCommandRunner(app.ApplicationRunner):
-    """Configures an application"""
+    """Configures an application
+
+    Attributes:
+        reactorPreference --  Reactors to try installing, in order, if the
+                              configured reactor is unavailable or if none is
+                              configured.
+    """
 
     loggerFactory = Logger
 
+    reactorPreference = ("epoll", "kqueue", "poll", "select")
+
     def __init__(self, name, config):
         app.ApplicationRunner.__init__(self, config)
         self.name = name
         self.exitValue = os.EX_OK
 
 
+    def run(self):
+        """Run the application, then report the startup profile if enabled."""
+        app.ApplicationRunner.run(self)
+        if startup.profiler.enabled:
+            startup.profiler.removeImportHook()
+            startup.profiler.report(sys.stderr)
+
+
     def createOrGetApplication(self):
         """Build the CLI by delegating control to a subcommand."""
-        app = Application(self.name)
+        with startup.profiler.phase("createOrGetApplication"):
+            app = Application(self.name)
 
-        cmd = self.buildCommand()
-        cmd.setServiceParent(app)
+            cmd = self.buildCommand()
+            cmd.setServiceParent(app)
 
-        cmd.exit.addCallbacks(self.cb_setExitValue, self.eb_setExitValue)
-        cmd.exit.addBoth(self._completed)
+            cmd.exit.addCallbacks(self.cb_setExitValue, self.eb_setExitValue)
+            cmd.exit.addBoth(self._completed)
 
         return app
 
@@ -219,8 +685,46 @@ class AbstractCommandRunner(app.ApplicationRunner):
 
 
     def preApplication(self):
-        """No pre-application steps are required."""
-        pass
+        """Install a reactor before the application is built."""
+        self.installReactor()
+
+
+    def reactorInstalled(self):
+        """Determine whether a reactor has been installed."""
+        return "twisted.internet.reactor" in sys.modules
+
+
+    def installReactor(self):
+        """Install the configured reactor or, failing that, a preferred one.
+
+        Nothing is installed if a reactor has already been installed.
+
+        Returns:
+            The name of the installed reactor, or None.
+        Raises:
+            ValueError if no reactor could be installed.
+        """
+        if self.reactorInstalled():
+            log.debug("Reactor already installed.")
+            return None
+
+        requested = self.config.get("reactor")
+        names = [requested] if requested else []
+        names += [n for n in self.reactorPreference if n != requested]
+
+        for name in names:
+            try:
+                installReactor(name)
+            except (ImportError, KeyError), e:
+                if name == requested:
+                    log.warn("Cannot use the {0} reactor: {1}".format(name, e))
+                else:
+                    log.debug("Cannot use the {0} reactor: {1}".format(name, e))
+            else:
+                log.debug("Installed the {0} reactor.".format(name))
+                return name
+
+        raise ValueError("No reactor could be installed", names)
 
 
     def buildCommand(self):
@@ -238,16 +742,28 @@ class AbstractCommandRunner(app.ApplicationRunner):
 
     def startApplication(self):
         """Start the application and setup shutdown hooks."""
-        app.startApplication(self.application, False)
+        with startup.profiler.phase("startService"):
+            app.startApplication(self.application, False)
 
 
     def startReactor(self):
         """Start Twisted's event loop without complex setup."""
+        from twisted.internet import reactor
+        startup.profiler.begin("reactor start")
+        reactor.callWhenRunning(startup.profiler.end, "reactor start")
         reactor.run()
 
     def stopReactor(self):
-        """Stop the Twisted reactor."""
-        reactor.stop()
+        """Stop the Twisted reactor.
+
+        Commands may complete while the application is started, before the
+        reactor is running, in which case it is stopped once it starts.
+        """
+        from twisted.internet import reactor
+        if reactor.running:
+            reactor.stop()
+        else:
+            reactor.callWhenRunning(reactor.stop)
 
 
 class CommandRunner(AbstractCommandRunner):
@@ -262,16 +778,232 @@ class CommandRunner(AbstractCommandRunner):
 
 
 
+class IndexedCommand(object):
+    """A command plugin described by a CommandIndex.
+
+    The name, shortcut and description are read from the index; the plugin
+    itself is only imported when it is used (i.e. to build a command).
+    """
+
+    def __init__(self, name, shortcut, description, module, attribute):
+        self.name = name
+        self.shortcut = shortcut
+        self.description = description
+        self.module = module
+        self.attribute = attribute
+        self._plugin = None
+
+
+    def load(self):
+        """Import and return the plugin."""
+        if self._plugin is None:
+            log.debug("Importing command plugin: {0.module}.{0.attribute}"
+                    .format(self))
+            __import__(self.module)
+            self._plugin = getattr(sys.modules[self.module], self.attribute)
+        return self._plugin
+
+
+    @property
+    def options(self):
+        return self.load().options
+
+
+    def buildOptions(self, *args, **kw):
+        """Import the plugin and build an instance of its options class.
+
+        This stands in for the options class in PluggableOptions.subCommands,
+        so that a plugin is only imported when its subcommand is parsed.
+        """
+        return self.options(*args, **kw)
+
+
+    def buildCommand(self, *args, **kw):
+        return self.load().buildCommand(*args, **kw)
+
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} {0.name} {0.module}.{0.attribute}>" \
+                .format(self)
+
+
+
+class CommandIndex(object):
+    """A persistent index of the command plugins in a plugin package.
+
+    Like twisted.plugin's dropin.cache, an index file is kept in each of the
+    package's directories.  It records each plugin's name, shortcut and
+    description, so that commands may be listed without importing any plugin
+    modules.  Index entries are validated against the mtime and size of their
+    module, and modules that have changed are re-imported and re-indexed.
+
+    Attributes:
+        package --  The plugin package.
+        interface --  The Interface that command plugins provide.
+    """
+
+    indexName = "jersey-commands.json"
+    version = 1
+
+    _moduleSuffixes = (".py", ".pyc", ".pyo")
+
+
+    def __init__(self, package, interface):
+        self.package = package
+        self.interface = interface
+
+
+    def commands(self):
+        """Return IndexedCommands for the plugins that provide the interface.
+        """
+        identifier = self.interface.__identifier__
+        commands = []
+        for directory in self._directories():
+            index = self._refresh(directory)
+            for moduleName, entry in sorted(index["modules"].iteritems()):
+                module = "{0}.{1}".format(self.package.__name__, moduleName)
+                for plugin in entry["plugins"]:
+                    if identifier in plugin["provides"]:
+                        commands.append(IndexedCommand(plugin["name"],
+                                plugin["shortcut"], plugin["description"],
+                                module, plugin["attribute"]))
+        return commands
+
+
+    def _directories(self):
+        path = getattr(self.package, "__path__", None)
+        if path is None:
+            path = [os.path.dirname(self.package.__file__)]
+        return [os.path.abspath(d) for d in path if os.path.isdir(d)]
+
+
+    def _sources(self, directory):
+        """Map module names in a directory to (mtime, size) of their source."""
+        sources = {}
+        for fileName in sorted(os.listdir(directory)):
+            moduleName, suffix = os.path.splitext(fileName)
+            if (suffix in self._moduleSuffixes and moduleName != "__init__"
+                    and moduleName not in sources):
+                for suffix in self._moduleSuffixes:
+                    path = os.path.join(directory, moduleName + suffix)
+                    if os.path.exists(path):
+                        break
+                stat = os.stat(path)
+                sources[moduleName] = (stat.st_mtime, stat.st_size)
+        return sources
+
+
+    def _read(self, path):
+        try:
+            with open(path) as indexFile:
+                index = json.load(indexFile)
+        except (IOError, ValueError):
+            return None
+
+        if not isinstance(index, dict) or index.get("version") != self.version:
+            return None
+        return index
+
+
+    def _write(self, path, index):
+        """Atomically replace the index file, if the directory is writable."""
+        directory = os.path.dirname(path)
+        try:
+            fd, tmpPath = _openTemporary(directory, ".")
+        except (IOError, OSError), e:
+            log.debug("Cannot write command index {0}: {1}".format(path, e))
+            return
+
+        try:
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(index, tmp, indent=1, sort_keys=True)
+            os.rename(tmpPath, path)
+        except (IOError, OSError), e:
+            log.debug("Cannot write command index {0}: {1}".format(path, e))
+            os.unlink(tmpPath)
+
+
+    def _refresh(self, directory):
+        """Read a directory's index, re-indexing modules that have changed."""
+        path = os.path.join(directory, self.indexName)
+        index = self._read(path) or {"version": self.version, "modules": {}}
+        modules = index["modules"]
+
+        sources = self._sources(directory)
+        changed = set(modules) - set(sources)
+        for moduleName in changed:
+            del modules[moduleName]
+
+        for moduleName, (mtime, size) in sources.iteritems():
+            entry = modules.get(moduleName)
+            if entry and entry["mtime"] == mtime and entry["size"] == size:
+                continue
+
+            plugins = self._indexModule(moduleName)
+            if plugins is None:
+                modules.pop(moduleName, None)
+            else:
+                modules[moduleName] = {
+                    "mtime": mtime,
+                    "size": size,
+                    "plugins": plugins,
+                    }
+            changed.add(moduleName)
+
+        if changed:
+            self._write(path, index)
+        return index
+
+
+    def _indexModule(self, moduleName):
+        """Import a plugin module and describe the plugins it provides.
+
+        Returns:
+            A list of plugin descriptions, or None if the module could not be
+            imported.
+        """
+        from twisted.plugin import IPlugin
+        from zope.interface import providedBy
+
+        module = "{0}.{1}".format(self.package.__name__, moduleName)
+        log.msg("Indexing command plugins: {0}".format(module))
+        try:
+            __import__(module)
+        except Exception:
+            log.err(None, "Failed to import command plugins: {0}".format(module))
+            return None
+
+        plugins = []
+        for attribute, obj in sorted(vars(sys.modules[module]).iteritems()):
+            if IPlugin.providedBy(obj):
+                plugins.append({
+                    "attribute": attribute,
+                    "provides": [iface.__identifier__
+                                 for iface in providedBy(obj).flattened()],
+                    "name": getattr(obj, "name", None),
+                    "shortcut": getattr(obj, "shortcut", None),
+                    "description": getattr(obj, "description", None),
+                    })
+        return plugins
+
+
+
 class PluggableOptions(Options):
     """Options handler supporting pluggable subcommands.
 
     Members:
         commandInterface --  The Interface class that command plugins implement
         commandPackage --  The Python package where commands are loaded from.
+        commandIndex --  If true, commands are listed from a CommandIndex, and
+                         only the selected command's module is imported.
+                         Otherwise (the default), all plugins are loaded with
+                         getPlugins().  The index only describes plugins whose
+                         command factories are module-level attributes.
     """
 
     commandInterface = ICommandFactory
     commandPackage = None
+    commandIndex = False
 
     def __init__(self, *args, **kw):
         Options.__init__(self, *args, **kw)
@@ -280,9 +1012,18 @@ class PluggableOptions(Options):
 
     @property
     def subCommands(self):
-        """Supported sub-commands."""
+        """Supported sub-commands.
+
+        Indexed commands' options classes are given as lazy references that
+        import the plugin only if the sub-command is parsed, so listing
+        commands (e.g. for usage) imports no plugins.
+        """
         for cmd in self._cacheCommands():
-            yield (cmd.name, cmd.shortcut, cmd.options, cmd.description)
+            if isinstance(cmd, IndexedCommand):
+                options = cmd.buildOptions
+            else:
+                options = cmd.options
+            yield (cmd.name, cmd.shortcut, options, cmd.description)
 
     def getCommand(self, name):
         """Get a given command, or raise a KeyError."""
@@ -294,12 +1035,21 @@ class PluggableOptions(Options):
         if len(self._commands) == 0:
             cmdIface, cmdPkg = self.commandInterface, self.commandPackage
             if cmdIface and cmdPkg:
-                for cmd in getPlugins(cmdIface, cmdPkg):
-                    log.msg("Loaded command: {0!r}".format(cmd))
-                    self._commands[cmd.name] = cmd
+                with startup.profiler.phase("plugin loading"):
+                    self._loadCommands(cmdIface, cmdPkg)
 
         return self._commands.itervalues()
 
+    def _loadCommands(self, cmdIface, cmdPkg):
+        if self.commandIndex:
+            commands = CommandIndex(cmdPkg, cmdIface).commands()
+        else:
+            from twisted.plugin import getPlugins
+            commands = getPlugins(cmdIface, cmdPkg)
+        for cmd in commands:
+            log.msg("Loaded command: {0!r}".format(cmd))
+            self._commands[cmd.name] = cmd
+
 
 
 class PluggableCommandRunner(AbstractCommandRunner):
@@ -312,3 +1062,1427 @@ class PluggableCommandRunner(AbstractCommandRunner):
 
 
 
+def _statusOf(value):
+    """Convert a command's exit value to an exit status, as sys.exit() does."""
+    if not value:
+        return os.EX_OK
+    if isinstance(value, (int, long)):
+        return value
+    return 1
+
+
+
+class BatchOptions(Options):
+    """Options for BatchCommand."""
+
+    synopsis = "[options] [file]"
+
+    optParameters = [
+        ("concurrency", "c", 1, "Number of commands to run at once.", int),
+        ("report", "r", "-",
+            "Write each line's exit value to this file (- for stdout)."),
+        ]
+
+    def parseArgs(self, path="-"):
+        self["path"] = path
+
+    def postOptions(self):
+        if self["concurrency"] < 1:
+            raise UsageError("Invalid concurrency", self["concurrency"])
+
+
+
+class BatchCommand(Command):
+    """Runs command lines from a file (or stdin) as one command.
+
+    Each line is parsed with shell quoting rules by the runner's options
+    factory (e.g. as PluggableOptions), and its command is run in this
+    process's reactor, up to the configured number at a time.  Blank lines
+    and lines starting with # are skipped.
+
+    Each line's exit value is reported, in input order, as:
+        <exit value><TAB><line>
+
+    The batch's exit value is the first non-zero exit value, in input order.
+    """
+
+    stdin = sys.stdin
+    stdout = sys.stdout
+
+    def __init__(self, config, runner):
+        Command.__init__(self, config)
+        self.runner = runner
+
+
+    def execute(self):
+        self._report = self._openReport()
+        self._statuses = {}
+        self._reported = 0
+
+        semaphore = DeferredSemaphore(self.config["concurrency"])
+        ds = []
+        for index, line in enumerate(self._readLines()):
+            d = semaphore.run(self.runLine, line)
+            d.addErrback(self._eb_status, line)
+            d.addCallback(self._cb_report, index, line)
+            ds.append(d)
+
+        d = gatherResults(ds, consumeErrors=True)
+        d.addCallback(self._cb_status)
+        d.addBoth(self._closeReport)
+        return d
+
+
+    def _readLines(self):
+        if self.config["path"] == "-":
+            stream = self.stdin
+        else:
+            stream = open(self.config["path"])
+        try:
+            lines = [l.strip() for l in stream]
+        finally:
+            if stream is not self.stdin:
+                stream.close()
+        return [l for l in lines if l and not l.startswith("#")]
+
+
+    def _openReport(self):
+        if self.config["report"] == "-":
+            return self.stdout
+        return open(self.config["report"], "w")
+
+    def _closeReport(self, result):
+        if self._report is not self.stdout:
+            self._report.close()
+        return result
+
+
+    def runLine(self, line):
+        """Run a command line.
+
+        Returns:
+            A Deferred that fires with the line's exit status.
+        """
+        try:
+            config = self.runner.buildOptions(shlex.split(line))
+        except (UsageError, ValueError), e:
+            log.warn("Invalid command line: {0!r}: {1}".format(line, e))
+            return succeed(os.EX_USAGE)
+        except SystemExit, se:
+            # e.g. --help or --version
+            return succeed(_statusOf(se.code))
+        except Exception:
+            log.err(None, "Failed to parse command line: {0!r}".format(line))
+            return succeed(os.EX_SOFTWARE)
+
+        try:
+            command = self.runner.buildLineCommand(config)
+        except Exception:
+            log.err(None, "Failed to build command: {0!r}".format(line))
+            return succeed(os.EX_SOFTWARE)
+
+        d = maybeDeferred(command.startService)
+        d.addErrback(self._eb_startFailed, command)
+        command.exit.addCallbacks(_statusOf, self._eb_status, errbackArgs=(line,))
+        command.exit.addBoth(self._stopCommand, command)
+        return command.exit
+
+
+    @staticmethod
+    def _eb_startFailed(reason, command):
+        if not command.exit.called:
+            command.exit.errback(reason)
+
+    @staticmethod
+    def _eb_status(reason, line):
+        if reason.check(SystemExit):
+            return _statusOf(reason.value.code)
+        log.err(reason, "Command failed: {0!r}".format(line))
+        return os.EX_SOFTWARE
+
+    @staticmethod
+    def _stopCommand(status, command):
+        d = maybeDeferred(command.stopService)
+        d.addErrback(log.err, "Failed to stop command")
+        d.addCallback(lambda _: status)
+        return d
+
+
+    def _cb_report(self, status, index, line):
+        """Record a line's status, reporting every line that's now in order."""
+        self._statuses[index] = (status, line)
+        while self._reported in self._statuses:
+            self._report.write("{0}\t{1}\n".format(
+                    *self._statuses.pop(self._reported)))
+            self._reported += 1
+        self._report.flush()
+        return status
+
+
+    @staticmethod
+    def _cb_status(statuses):
+        for status in statuses:
+            if status:
+                return status
+        return os.EX_OK
+
+
+
+class BatchCommandRunner(PluggableCommandRunner):
+    """Runs a batch of pluggable command lines in one process and reactor.
+
+    Plugins are discovered and imported once for the batch, rather than once
+    per command.
+
+    Attributes:
+        optionsFactory --  Builds the Options (e.g. a PluggableOptions
+                           subclass) used to parse each line, given the
+                           program name.
+    """
+
+    def __init__(self, name, config, optionsFactory):
+        PluggableCommandRunner.__init__(self, name, config)
+        self.optionsFactory = optionsFactory
+        self._commands = None
+
+
+    def buildCommand(self):
+        return BatchCommand(self.config, self)
+
+
+    def buildOptions(self, argv):
+        """Parse a command line's arguments.
+
+        Raises:
+            UsageError if the arguments are invalid.
+        """
+        config = self.optionsFactory(self.name)
+        if isinstance(config, PluggableOptions):
+            # Share the plugins loaded for the first line with later lines.
+            if self._commands is None:
+                config._cacheCommands()
+                self._commands = config._commands
+            config._commands = self._commands
+        config.parseOptions(argv)
+        return config
+
+
+    def buildLineCommand(self, config):
+        """Build the command selected by a line's options."""
+        plg = config.getCommand(config.subCommand)
+        return plg.buildCommand(config.subOptions)
+
+
+
+class ScanOptions(Options):
+    """Options for ScanCommand."""
+
+    synopsis = "[options] [file ...]"
+
+    optFlags = [
+        ("unique", "u", "Print each address only once."),
+        ]
+
+    optParameters = [
+        ("family", "f", None, "Only print addresses of a family (4 or 6)."),
+        ("processes", "p", 1, "Number of processes scanning each file.", int),
+        ]
+
+    families = {None: None, "4": AF_INET, "6": AF_INET6, }
+
+
+    def parseArgs(self, *paths):
+        self["paths"] = paths or ("-", )
+
+
+    def postOptions(self):
+        if self["family"] not in self.families:
+            raise UsageError("Invalid address family", self["family"])
+        self["family"] = self.families[self["family"]]
+
+
+
+class ScanCommand(Command):
+    """Print the IP addresses found in files (or stdin), one per line.
+
+    Attributes:
+        out --  The stream addresses are written to.
+    """
+
+    out = sys.stdout
+
+    _familySizes = {AF_INET: 4, AF_INET6: 16, }
+
+
+    @inlineCallbacks
+    def execute(self):
+        """Scan each path in turn.
+
+        Paths are scanned in a thread, so that the reactor keeps running,
+        unless files are scanned by a pool of processes.
+        """
+        seen = set()
+        for path in self.config["paths"]:
+            if path != "-" and self.config["processes"] > 1:
+                self._scanPath(path, seen)
+            else:
+                from twisted.internet.threads import deferToThread
+                yield deferToThread(self._scanPath, path, seen)
+
+
+    def _scanPath(self, path, seen):
+        family = self.config["family"]
+        for packed in self._scan(path):
+            if family and len(packed) != self._familySizes[family]:
+                continue
+            if self.config["unique"]:
+                if packed in seen:
+                    continue
+                seen.add(packed)
+            self._write(packed)
+
+
+    def _scan(self, path):
+        if path == "-":
+            for line in sys.stdin:
+                for packed in scanText(line, packed=True):
+                    yield packed
+        else:
+            for packed in scanFile(path, packed=True,
+                                   processes=self.config["processes"]):
+                yield packed
+
+
+    def _write(self, packed):
+        family = AF_INET if len(packed) == 4 else AF_INET6
+        self.out.write(socket.inet_ntop(family, packed) + "\n")
+
+
+
+class ScanCommandFactory(CommandFactory):
+    """Provides ScanCommand as the "scan" subcommand.
+
+    A command plugin package exposes it with an instance of a subclass that
+    implements IPlugin.
+    """
+
+    command = ScanCommand
+    options = ScanOptions
+
+    name = "scan"
+    shortcut = None
+    description = "Print the IP addresses found in files."
+
+
+
+# Frames exchanged between forwardCommand() and CommandDaemon are a type byte
+# and a length, followed by that many bytes of data.
+_FRAME = struct.Struct("!cI")
+
+_REQUEST = "R"
+_STDIN = "I"
+_STDOUT = "O"
+_STDERR = "E"
+_EXIT = "X"
+
+_CHUNK_SIZE = 1 << 16
+
+
+def _retry(function, *args):
+    """Call function, retrying if it is interrupted by a signal."""
+    while True:
+        try:
+            return function(*args)
+        except (select.error, socket.error, OSError, IOError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+def _writeFrame(sock, kind, data=""):
+    _retry(sock.sendall, _FRAME.pack(kind, len(data)) + data)
+
+
+def _readExactly(sock, size):
+    chunks = []
+    while size:
+        chunk = _retry(sock.recv, min(size, _CHUNK_SIZE))
+        if not chunk:
+            raise EOFError()
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
+def _readFrame(sock):
+    """Read a (kind, data) frame.
+
+    Raises:
+        EOFError if the connection is closed.
+    """
+    kind, size = _FRAME.unpack(_readExactly(sock, _FRAME.size))
+    return kind, _readExactly(sock, size)
+
+
+def _exitCode(value):
+    """Convert a sys.exit() value to a process exit status, as Python does."""
+    if value is None:
+        return os.EX_OK
+    if isinstance(value, (int, long)):
+        return value
+    sys.stderr.write("{0}\n".format(value))
+    return 1
+
+
+def _waitStatus(status):
+    """Convert an os.waitpid() status to an exit status, as shells do."""
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+
+class CommandDaemon(object):
+    """Runs commands on behalf of forwardCommand() clients.
+
+    A daemon keeps Twisted and its command plugins imported, so commands
+    forwarded to it start without paying for interpreter startup, imports or
+    plugin discovery.
+
+    Each request is handled in a forked process, which runs the command in
+    another forked process with the client's arguments, environment and
+    working directory, and relays its stdio to and from the client.  Failing
+    commands therefore cannot affect the daemon or other requests.
+
+    The daemon itself must not install a reactor (or it would be shared by
+    each command's process), so it serves requests with blocking sockets.
+
+    Attributes:
+        path --  The path of the UNIX socket to listen on.
+        optionsFactory --  Builds the Options (e.g. a PluggableOptions
+                           subclass) for a request, given the program name.
+        runnerFactory --  Builds the runner of a request's command, given the
+                          program name and the parsed Options.
+        program --  The program name used in usage messages.
+    """
+
+    backlog = 50
+
+    def __init__(self, path, optionsFactory,
+            runnerFactory=PluggableCommandRunner, program=None):
+        self.path = path
+        self.optionsFactory = optionsFactory
+        self.runnerFactory = runnerFactory
+        self.program = program or os.path.basename(sys.argv[0])
+        self.running = False
+        self._socket = None
+        self._children = set()
+
+
+    def warm(self):
+        """Import every command plugin, so that requests needn't.
+
+        Raises:
+            RuntimeError if the reactor was imported, e.g. by a plugin module,
+            since every command's process would then share it.
+        """
+        self._checkReactor("the daemon")
+        options = self.optionsFactory(self.program)
+        if isinstance(options, PluggableOptions):
+            commands = list(options._cacheCommands())
+            self._checkReactor(options.commandPackage.__name__)
+            for command in commands:
+                if isinstance(command, IndexedCommand):
+                    command.load()
+                    self._checkReactor(command.module)
+
+
+    def _checkReactor(self, importer):
+        if "twisted.internet.reactor" in sys.modules:
+            raise RuntimeError("The reactor must not be imported before "
+                               "commands are forked", importer)
+
+
+    def listen(self):
+        """Bind the daemon's socket, replacing a stale socket file."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        self._socket.listen(self.backlog)
+
+
+    def serve(self):
+        """Serve requests until stop() is called (e.g. on SIGTERM).
+
+        The socket is bound once the daemon is warm, unless listen() was
+        called already.
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        self.warm()
+        if self._socket is None:
+            self.listen()
+
+        self._socket.settimeout(1.0)
+        self.running = True
+        log.msg("Serving commands on {0}".format(self.path))
+        try:
+            while self.running:
+                self._reap()
+                try:
+                    connection, address = self._socket.accept()
+                except socket.timeout:
+                    continue
+                except socket.error, se:
+                    if se.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                try:
+                    self._fork(connection)
+                finally:
+                    connection.close()
+        finally:
+            self._close()
+
+
+    def stop(self):
+        self.running = False
+
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+    def _reap(self):
+        for pid in list(self._children):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self._children.discard(pid)
+            except OSError:
+                self._children.discard(pid)
+
+
+    def _fork(self, connection):
+        # Don't let children inherit (and duplicate) buffered output.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self._children.add(pid)
+            return
+
+        status = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self._socket.close()
+            connection.settimeout(None)
+            self.handle(connection)
+            status = os.EX_OK
+        except Exception:
+            log.err(None, "Failed to handle a command request")
+        finally:
+            os._exit(status)
+
+
+    def handle(self, connection):
+        """Run a request's command and relay its stdio.  Runs in a child."""
+        try:
+            kind, data = _readFrame(connection)
+        except EOFError:
+            return
+        if kind != _REQUEST:
+            raise ValueError("Expected a request", kind)
+        request = json.loads(data)
+
+        pipes = [os.pipe() for fd in (0, 1, 2)]
+        pid = os.fork()
+        if not pid:
+            try:
+                connection.close()
+                for fd, (r, w) in enumerate(pipes):
+                    os.dup2(r if fd == 0 else w, fd)
+                    os.close(r)
+                    os.close(w)
+                status = self.runCommand(request)
+            except SystemExit, se:
+                status = _exitCode(se.code)
+            except Exception:
+                log.err(None, "Command failed")
+                status = os.EX_SOFTWARE
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            os._exit(status)
+
+        # Keep the parent's ends of the pipes:  stdin's write end, and the
+        # read ends of stdout and stderr.
+        (stdinR, stdin), (stdoutR, stdoutW), (stderrR, stderrW) = pipes
+        for fd in (stdinR, stdoutW, stderrW):
+            os.close(fd)
+        outputs = {stdoutR: _STDOUT, stderrR: _STDERR}
+
+        try:
+            self._relay(connection, stdin, outputs)
+        except (EOFError, socket.error):
+            # The client has gone away.
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            return
+
+        status = _waitStatus(_retry(os.waitpid, pid, 0)[1])
+        _writeFrame(connection, _EXIT, struct.pack("!i", status))
+
+
+    def _relay(self, connection, stdin, outputs):
+        while outputs:
+            readable = _retry(select.select, [connection] + list(outputs),
+                              [], [])[0]
+            for fd in readable:
+                if fd is connection:
+                    kind, data = _readFrame(connection)
+                    if kind != _STDIN or stdin is None:
+                        continue
+                    if data:
+                        try:
+                            _retry(os.write, stdin, data)
+                        except OSError:
+                            pass
+                    else:
+                        os.close(stdin)
+                        stdin = None
+                else:
+                    data = _retry(os.read, fd, _CHUNK_SIZE)
+                    if data:
+                        _writeFrame(connection, outputs[fd], data)
+                    else:
+                        os.close(fd)
+                        del outputs[fd]
+        if stdin is not None:
+            os.close(stdin)
+
+
+    def runCommand(self, request):
+        """Run a request's command.  Runs in a child with stdio redirected.
+
+        Returns:
+            The exit status set by the runner.
+        """
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = [self.program] + request["argv"]
+
+        config = self.optionsFactory(self.program)
+        try:
+            config.parseOptions(request["argv"])
+        except usage.UsageError, ue:
+            sys.stderr.write("{0}\n{1}: {2}\n".format(config, self.program, ue))
+            return os.EX_USAGE
+
+        runner = self.runnerFactory(self.program, config)
+        runner.run()
+        return _exitCode(runner.exitValue)
+
+
+
+def forwardCommand(path, argv=None, env=None, cwd=None,
+        stdin=None, stdout=None, stderr=None):
+    """Run a command in the CommandDaemon listening on path.
+
+    Arguments:
+        path --  The path of the daemon's UNIX socket.
+        argv --  The command's arguments.  Defaults to sys.argv[1:].
+        env --  The command's environment.  Defaults to os.environ.
+        cwd --  The command's working directory.  Defaults to os.getcwd().
+        stdin, stdout, stderr --  Files to relay the command's stdio to and
+                                  from.  Default to sys's.
+    Returns:
+        The command's exit status.
+    Raises:
+        socket.error if the daemon is not running.
+        EOFError if the daemon closes the connection before the command exits.
+    """
+    request = {
+        "argv": list(sys.argv[1:] if argv is None else argv),
+        "env": dict(os.environ if env is None else env),
+        "cwd": os.getcwd() if cwd is None else cwd,
+        }
+    stdin = sys.stdin if stdin is None else stdin
+    outputs = {
+        _STDOUT: sys.stdout if stdout is None else stdout,
+        _STDERR: sys.stderr if stderr is None else stderr,
+        }
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        _retry(connection.connect, path)
+        _writeFrame(connection, _REQUEST, json.dumps(request))
+
+        try:
+            stdinFd = stdin.fileno()
+        except (AttributeError, IOError, ValueError):
+            # Not a real file (e.g. a StringIO), so send it all at once.
+            _writeFrame(connection, _STDIN, stdin.read())
+            _writeFrame(connection, _STDIN)
+            stdinFd = None
+
+        while True:
+            readers = [connection] + ([stdinFd] if stdinFd is not None else [])
+            for fd in _retry(select.select, readers, [], [])[0]:
+                if fd is connection:
+                    kind, data = _readFrame(connection)
+                    if kind == _EXIT:
+                        return struct.unpack("!i", data)[0]
+                    outputs[kind].write(data)
+                    outputs[kind].flush()
+                else:
+                    data = _retry(os.read, stdinFd, _CHUNK_SIZE)
+                    _writeFrame(connection, _STDIN, data)
+                    if not data:
+                        stdinFd = None
+    finally:
+        connection.close()
+
+
+
+_POOL_CALL = "C"
+_POOL_VALUE = "V"
+_POOL_FAILURE = "F"
+
+# The file descriptors on which pool workers read calls and write results.
+_POOL_CALLS_FD = 3
+_POOL_RESULTS_FD = 4
+
+
+class ProcessPoolError(Exception):
+    """A task submitted to a ProcessPoolService could not be completed."""
+
+
+
+class _Pipe(object):
+    """Adapts a pipe's file descriptor for _readFrame() and _writeFrame()."""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def recv(self, size):
+        return os.read(self.fd, size)
+
+    def sendall(self, data):
+        while data:
+            data = data[_retry(os.write, self.fd, data):]
+
+
+def _dumpException():
+    """Pickle the current exception.
+
+    Exceptions that cannot be pickled are reported as a ProcessPoolError with
+    the original traceback.
+    """
+    failure = Failure()
+    try:
+        return dumps(failure.value, HIGHEST_PROTOCOL)
+    except Exception:
+        return dumps(ProcessPoolError(failure.getTraceback()),
+                     HIGHEST_PROTOCOL)
+
+
+def runPoolWorker(callsFd=_POOL_CALLS_FD, resultsFd=_POOL_RESULTS_FD):
+    """Run a ProcessPoolService worker until its calls pipe is closed."""
+    calls, results = _Pipe(callsFd), _Pipe(resultsFd)
+    while True:
+        try:
+            kind, data = _readFrame(calls)
+        except EOFError:
+            return
+
+        try:
+            function, args, kw = loads(data)
+            result = _POOL_VALUE, dumps(function(*args, **kw), HIGHEST_PROTOCOL)
+        except Exception:
+            result = _POOL_FAILURE, _dumpException()
+        _writeFrame(results, *result)
+
+
+
+class ProcessPoolService(Service):
+    """Runs CPU-bound callables in a pool of Python worker processes.
+
+    Commands (which are MultiServices) may attach a pool as a child service,
+    so that it is started before execute() and stopped with the command.
+
+    Callables, their arguments and their results are pickled, so callables
+    must be importable by name (i.e. module-level functions) and the modules
+    defining them must be importable from sys.path.
+
+    Workers are recycled after maxTasksPerWorker tasks, if it is set, to bound
+    the effects of leaks in long-running pools.  A worker that dies while
+    running a task is replaced, and the task fails with a ProcessPoolError.
+    Workers that die while idle are replaced too.
+
+    Attributes:
+        size --  The number of worker processes (defaults to the CPU count).
+        maxTasksPerWorker --  The number of tasks after which a worker is
+                              replaced, or None.
+    """
+
+    workerCode = "from jersey.cli import runPoolWorker; runPoolWorker()"
+
+    # Workers that exit before completing a task are replaced until this many
+    # have done so in a row.
+    maxStartFailures = 5
+
+    def __init__(self, size=None, maxTasksPerWorker=None, reactor=None):
+        if size is None:
+            import multiprocessing
+            try:
+                size = multiprocessing.cpu_count()
+            except NotImplementedError:
+                size = 1
+        if size < 1:
+            raise ValueError("Invalid pool size", size)
+        if maxTasksPerWorker is not None and maxTasksPerWorker < 1:
+            raise ValueError("Invalid maxTasksPerWorker", maxTasksPerWorker)
+
+        self.size = size
+        self.maxTasksPerWorker = maxTasksPerWorker
+        self._reactor = reactor
+        self._queue = deque()
+        self._idle = []
+        self._workers = set()
+        self._startFailures = 0
+
+
+    def startService(self):
+        Service.startService(self)
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        for i in xrange(self.size):
+            self._spawn()
+
+
+    def stopService(self):
+        """Stop the workers once their current tasks are complete.
+
+        Tasks that have not started fail with a ProcessPoolError.
+
+        Returns:
+            A Deferred that fires once all workers have exited.
+        """
+        Service.stopService(self)
+        while self._queue:
+            d, call = self._queue.popleft()
+            d.errback(ProcessPoolError("Process pool stopped"))
+
+        ended = [w.ended for w in self._workers]
+        while self._idle:
+            self._idle.pop().retire()
+        return DeferredList(ended)
+
+
+    def submit(self, function, *args, **kw):
+        """Call function(*args, **kw) in a worker process.
+
+        Returns:
+            A Deferred that fires with the function's return value, or fails
+            with the exception it raised.
+        """
+        if not self.running:
+            return fail(ProcessPoolError("Process pool is not running"))
+        if not self._workers:
+            return fail(ProcessPoolError("No process pool workers"))
+        try:
+            call = dumps((function, args, kw), HIGHEST_PROTOCOL)
+        except Exception:
+            return fail()
+
+        d = Deferred()
+        self._queue.append((d, call))
+        self._dispatch()
+        return d
+
+
+    def _spawn(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+
+        from jersey._pool import PoolWorker
+        worker = PoolWorker(self)
+        self._reactor.spawnProcess(worker, sys.executable,
+                [sys.executable, "-c", self.workerCode], env=env,
+                childFDs={0: "w", 1: 1, 2: 2,
+                          _POOL_CALLS_FD: "w", _POOL_RESULTS_FD: "r"})
+        self._workers.add(worker)
+        self._idle.append(worker)
+        self._dispatch()
+
+
+    def _dispatch(self):
+        while self._queue and self._idle:
+            self._idle.pop().run(self._queue.popleft())
+
+
+    def _workerIdle(self, worker):
+        if not self.running:
+            worker.retire()
+
+        elif self.maxTasksPerWorker and \
+                worker.tasks >= self.maxTasksPerWorker:
+            worker.retire()
+            self._spawn()
+
+        else:
+            self._idle.append(worker)
+            self._dispatch()
+
+
+    def _workerEnded(self, worker, task, reason):
+        self._workers.discard(worker)
+        if worker in self._idle:
+            self._idle.remove(worker)
+        if worker.retired:
+            return
+
+        log.warn("Process pool worker exited: {0}".format(
+                reason.getErrorMessage()))
+        if task is not None:
+            d, call = task
+            d.errback(ProcessPoolError("Worker exited while running task",
+                                       reason.getErrorMessage()))
+
+        if not self.running:
+            return
+
+        if worker.tasks:
+            self._startFailures = 0
+        else:
+            self._startFailures += 1
+        if self._startFailures < self.maxStartFailures:
+            while len(self._workers) < self.size:
+                self._spawn()
+
+        elif not self._workers:
+            # Workers are failing to start, so don't spawn them forever.
+            log.error("Process pool workers are failing to start")
+            while self._queue:
+                d, call = self._queue.popleft()
+                d.errback(ProcessPoolError("No process pool workers"))
+
+
+
+class ThreadPoolService(Service):
+    """Runs blocking calls in a named thread pool owned by a command.
+
+    Commands (which are MultiServices) may attach a pool as a child service,
+    so that its threads are started before execute() and stopped with the
+    command, rather than sharing the reactor's global thread pool.
+
+    Statistics are maintained in the reactor thread.
+
+    Attributes:
+        name --  The service's name, also used to name its threads.
+        pool --  The ThreadPool.
+        slowWait --  Seconds that a call may wait for a thread before a
+                     warning is logged, or None.
+        waiting --  The number of calls waiting for a thread.
+        active --  The number of calls running.
+        completed --  The number of calls that returned.
+        failed --  The number of calls that raised an exception.
+        waitTime --  The total seconds that calls waited for a thread.
+        maxWaitTime --  The longest that a call waited for a thread.
+        runTime --  The total seconds that finished calls ran.
+    """
+
+    clock = time.time
+
+    def __init__(self, name, minThreads=0, maxThreads=10, slowWait=None,
+            reactor=None):
+        if maxThreads < 1 or minThreads < 0 or minThreads > maxThreads:
+            raise ValueError("Invalid thread pool size",
+                             minThreads, maxThreads)
+        from twisted.python.threadpool import ThreadPool
+        self.name = name
+        self.pool = ThreadPool(minThreads, maxThreads, name)
+        self.slowWait = slowWait
+        self._reactor = reactor
+
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.runTime = 0.0
+
+
+    def startService(self):
+        from twisted.internet.threads import deferToThreadPool
+        Service.startService(self)
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        self._deferToThreadPool = deferToThreadPool
+        self.pool.start()
+
+
+    def stopService(self):
+        """Stop the pool once calls that were submitted have completed.
+
+        Returns:
+            A Deferred that fires once the pool's threads have exited.
+        """
+        Service.stopService(self)
+
+        # ThreadPool.stop() blocks until its threads exit, so wait for it in
+        # another thread to keep the reactor running calls' callbacks.
+        d = Deferred()
+        def stop():
+            self.pool.stop()
+            self._reactor.callFromThread(d.callback, None)
+        threading.Thread(target=stop, name="{0}-stop".format(self.name)).start()
+        return d
+
+
+    def submit(self, function, *args, **kw):
+        """Call function(*args, **kw) in a pool thread.
+
+        Returns:
+            A Deferred that fires with the function's return value, or fails
+            with the exception it raised.
+        """
+        if not self.running:
+            return fail(ValueError("Thread pool is not running", self.name))
+
+        # When the call started, or None.  Only used in the reactor thread.
+        started = [None]
+        submitted = self.clock()
+        def call():
+            self._reactor.callFromThread(self._callStarted, function,
+                                         submitted, self.clock(), started)
+            return function(*args, **kw)
+
+        self.waiting += 1
+        d = self._deferToThreadPool(self._reactor, self.pool, call)
+        d.addBoth(self._callFinished, started)
+        return d
+
+
+    def _callStarted(self, function, submitted, now, started):
+        if started[0] is not None:
+            # The call's Deferred already fired (e.g. it was cancelled).
+            return
+        started[0] = now
+        wait = now - submitted
+
+        self.waiting -= 1
+        self.active += 1
+        self.waitTime += wait
+        self.maxWaitTime = max(self.maxWaitTime, wait)
+        if self.slowWait is not None and wait > self.slowWait:
+            log.warn("{0}: {1!r} waited {2:.3f}s for a thread "
+                     "({3} waiting, {4} active)".format(self.name, function,
+                            wait, self.waiting, self.active))
+
+    def _callFinished(self, result, started):
+        if started[0] is None:
+            # The call hadn't started (e.g. it was cancelled), so mark it as
+            # started to ignore it if it does.
+            started[0] = self.clock()
+            self.waiting -= 1
+            self.failed += 1
+            return result
+
+        self.active -= 1
+        self.runTime += self.clock() - started[0]
+        if isinstance(result, Failure):
+            self.failed += 1
+        else:
+            self.completed += 1
+        return result
+
+
+    def meanWaitTime(self):
+        """Return the mean seconds that started calls waited for a thread."""
+        started = self.active + self.completed + self.failed
+        return started and self.waitTime / started or 0.0
+
+    def meanRunTime(self):
+        """Return the mean seconds that finished calls ran."""
+        finished = self.completed + self.failed
+        return finished and self.runTime / finished or 0.0
+
+
+    def __str__(self):
+        return ("{0.name}: {0.waiting} waiting, {0.active} active, "
+                "{0.completed} completed, {0.failed} failed, "
+                "mean wait {1:.3f}s (max {0.maxWaitTime:.3f}s), "
+                "mean run {2:.3f}s").format(self, self.meanWaitTime(),
+                        self.meanRunTime())
+
+
+
+def listenSocket(endpoint, backlog=50):
+    """Bind a non-blocking, listening TCP socket to an Endpoint.
+
+    The socket may be shared by processes forked after it is bound.
+    """
+    sock = socket.socket(endpoint.family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(endpoint.sockaddr())
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+
+class ServerCommand(Command):
+    """A command that serves connections until it is stopped.
+
+    Connections are accepted on listeningSocket, when a runner (such as
+    PreforkCommandRunner) provides one, or else on a socket bound to the
+    "listen" option of the command's options (or their parents).
+
+    Subclasses must implement buildFactory().
+
+    Attributes:
+        listeningSocket --  A listening socket provided by the runner.
+        port --  The IListeningPort, once executing.
+    """
+
+    listeningSocket = None
+    port = None
+
+    def buildFactory(self):
+        """Build the ServerFactory for connections."""
+        raise NotImplementedError(
+                "buildFactory() must be implemented by subclass.")
+
+
+    def execute(self):
+        """Serve connections.
+
+        Returns:
+            A Deferred that does not fire:  servers run until the reactor is
+            stopped.
+        """
+        from twisted.internet import reactor
+
+        sock = self.listeningSocket
+        if sock is None:
+            endpoint = self._findEndpoint()
+            if endpoint is None:
+                raise ValueError("No endpoint to listen on")
+            sock = listenSocket(endpoint)
+
+        # The reactor listens on a duplicate of the socket.
+        self.port = reactor.adoptStreamPort(sock.fileno(), sock.family,
+                                            self.buildFactory())
+        if sock is not self.listeningSocket:
+            sock.close()
+        return Deferred()
+
+
+    def _findEndpoint(self):
+        config = self.config
+        while config is not None:
+            if config.get("listen") is not None:
+                return config["listen"]
+            config = getattr(config, "parent", None)
+
+
+    def stopService(self):
+        ds = [Command.stopService(self)]
+        if self.port is not None:
+            ds.append(maybeDeferred(self.port.stopListening))
+        return gatherResults(ds)
+
+
+
+class PreforkOptionsMixin(object):
+    """Provides --listen and --workers options for a PreforkCommandRunner."""
+
+    optParameters = [
+        ["listen", "l", None, "Endpoint to listen on (host:port).",
+            Options.parseEndpoint],
+        ["workers", "w", None,
+            "Number of worker processes (defaults to the CPU count).", int],
+        ]
+
+    def postOptions(self):
+        super(PreforkOptionsMixin, self).postOptions()
+        if self["listen"] is None:
+            raise usage.UsageError("No endpoint to listen on")
+        if self["workers"] is not None and self["workers"] < 1:
+            raise usage.UsageError("Invalid number of workers", self["workers"])
+
+
+
+class PreforkSupervisor(object):
+    """Runs worker processes that share a listening socket, and supervises them.
+
+    The socket is bound once, before workers are forked, so that every worker
+    accepts connections on it and the kernel balances connections between
+    them.  Like CommandDaemon, the supervisor must not install a reactor (or
+    it would be shared by its workers), so it polls its workers with
+    os.waitpid().
+
+    Workers that exit with a non-zero status are restarted.  If workers keep
+    exiting shortly after they start (e.g. because the command is
+    misconfigured), the supervisor gives up and exits with their status.
+
+    On SIGTERM (or SIGINT), workers are sent SIGTERM and the supervisor exits
+    once they have, with the first non-zero status of a worker, if any.
+
+    On SIGHUP, workers are replaced one at a time:  each replacement is
+    started before the old worker is sent SIGTERM, so that connections are
+    accepted throughout.
+
+    Attributes:
+        endpoint --  The Endpoint to listen on.
+        workers --  The number of worker processes.
+        runWorker --  Runs a worker, given the listening socket, and returns
+                      its exit status.  Called in each worker process.
+        minUptime --  Seconds a worker must run for its exit not to count as
+                      a failure to start.
+        maxStartFailures --  Consecutive failures to start after which the
+                             supervisor gives up.
+        pollInterval --  Seconds between checks for exited workers.
+    """
+
+    backlog = 50
+    minUptime = 1.0
+    maxStartFailures = 5
+    pollInterval = 0.1
+
+    def __init__(self, endpoint, workers, runWorker):
+        if workers < 1:
+            raise ValueError("Invalid number of workers", workers)
+        self.endpoint = endpoint
+        self.workers = workers
+        self.runWorker = runWorker
+        self.running = False
+        self.exitValue = os.EX_OK
+        self._socket = None
+        self._workers = {}
+        self._startFailures = 0
+        self._stopping = False
+        self._restartRequested = False
+        self._replacing = []
+        self._retiring = None
+
+
+    def listen(self):
+        """Bind the listening socket.
+
+        Returns:
+            The socket.
+        """
+        self._socket = listenSocket(self.endpoint, self.backlog)
+        return self._socket
+
+
+    def boundEndpoint(self):
+        """Return the Endpoint that the socket is bound to (e.g. its port)."""
+        host, port = self._socket.getsockname()[:2]
+        return Endpoint(host, port)
+
+
+    def serve(self):
+        """Run workers until stop() is called (e.g. on SIGTERM).
+
+        Returns:
+            The supervisor's exit status.
+        """
+        handlers = {
+            signal.SIGTERM: lambda signum, frame: self.stop(),
+            signal.SIGINT: lambda signum, frame: self.stop(),
+            signal.SIGHUP: lambda signum, frame: self.restart(),
+            }
+        previous = dict((signum, signal.signal(signum, handler))
+                        for signum, handler in handlers.iteritems())
+        try:
+            if self._socket is None:
+                self.listen()
+            log.msg("Serving {0} with {1} workers".format(
+                    self.boundEndpoint(), self.workers))
+
+            self.running = True
+            for i in xrange(self.workers):
+                self._spawn()
+            while self._workers:
+                self._supervise()
+        finally:
+            self.running = False
+            for signum, handler in previous.iteritems():
+                signal.signal(signum, handler)
+            self._close()
+
+        return self.exitValue
+
+
+    def stop(self):
+        self.running = False
+
+    def restart(self):
+        self._restartRequested = True
+
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+    def _supervise(self):
+        if not self.running and not self._stopping:
+            self._stopping = True
+            log.msg("Stopping workers")
+            for pid in self._workers:
+                self._kill(pid)
+
+        if self._restartRequested and not self._stopping:
+            self._restartRequested = False
+            log.msg("Restarting workers")
+            self._replacing = [pid for pid in self._workers
+                               if pid != self._retiring]
+        if self._retiring is None and self._replacing and not self._stopping:
+            self._retiring = self._replacing.pop(0)
+            self._spawn()
+            self._kill(self._retiring)
+
+        exited = False
+        for pid in list(self._workers):
+            try:
+                result, status = _retry(os.waitpid, pid, os.WNOHANG)
+            except OSError:
+                result, status = pid, 0
+            if result:
+                exited = True
+                self._exited(pid, _waitStatus(status))
+        if not exited:
+            time.sleep(self.pollInterval)
+
+
+    def _exited(self, pid, status):
+        started = self._workers.pop(pid)
+        if pid in self._replacing:
+            self._replacing.remove(pid)
+
+        if pid == self._retiring:
+            self._retiring = None
+            log.msg("Worker {0} restarted".format(pid))
+            return
+
+        if self._stopping:
+            log.msg("Worker {0} exited with status {1}".format(pid, status))
+            # Workers that hadn't started their reactors are killed by SIGTERM.
+            killed = status == 128 + signal.SIGTERM
+            if status and not killed and not self.exitValue:
+                self.exitValue = status
+            return
+
+        if not status:
+            log.msg("Worker {0} exited".format(pid))
+            return
+
+        log.warn("Worker {0} exited with status {1}".format(pid, status))
+        if time.time() - started < self.minUptime:
+            self._startFailures += 1
+        else:
+            self._startFailures = 0
+
+        if self._startFailures >= self.maxStartFailures:
+            log.error("Workers are failing to start; stopping")
+            self.exitValue = status
+            self.stop()
+        else:
+            self._spawn()
+
+
+    def _kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+    def _spawn(self):
+        # Don't let workers inherit (and duplicate) buffered output.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = time.time()
+            return pid
+
+        status = os.EX_SOFTWARE
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            status = self.runWorker(self._socket)
+        except SystemExit, se:
+            status = _exitCode(se.code)
+        except Exception:
+            log.err(None, "Worker failed")
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+
+
+class PreforkCommandRunner(PluggableCommandRunner):
+    """Runs a ServerCommand in several processes sharing a listening socket.
+
+    Each worker process runs the command as PluggableCommandRunner would, with
+    its own reactor, so that a server may use every core.  Options must
+    provide "listen" and "workers", as PreforkOptionsMixin does.
+    """
+
+    supervisorFactory = PreforkSupervisor
+
+    def __init__(self, name, config):
+        PluggableCommandRunner.__init__(self, name, config)
+        self.listeningSocket = None
+
+
+    def run(self):
+        """Run and supervise the workers.  Sets exitValue."""
+        workers = self.config["workers"]
+        if workers is None:
+            import multiprocessing
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+
+        supervisor = self.supervisorFactory(self.config["listen"], workers,
+                                            self.runWorker)
+        self.exitValue = supervisor.serve()
+
+
+    def runWorker(self, listeningSocket):
+        """Run the command in a worker process.
+
+        Returns:
+            The worker's exit status.
+        """
+        self.listeningSocket = listeningSocket
+        PluggableCommandRunner.run(self)
+        return _exitCode(self.exitValue)
+
+
+    def buildCommand(self):
+        command = PluggableCommandRunner.buildCommand(self)
+        command.listeningSocket = self.listeningSocket
+        return command
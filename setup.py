@@ -37,7 +37,8 @@ setup(
     package_dir = {"jersey": "lib", },
     packages = ["jersey", "jersey.cases", ],
 
-    provides = ["jersey", "jersey.cli", "jersey.inet", "jersey.log", ],
+    provides = ["jersey", "jersey.cli", "jersey.inet", "jersey.log",
+                "jersey.startup", ],
     setup_requires = ["twisted", ],
     install_requires = ["twisted>=9.0.0", ],
     )